@@ -1,11 +1,87 @@
+import datetime
+
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.shortcuts import render_to_response
+from django.template import RequestContext
+from django.utils.translation import ugettext, ugettext_lazy as _
 
-from ellaschedule.models import Calendar, Event, CalendarRelation, Rule
+from ellaschedule.forms import SeriesRangeForm
+from ellaschedule.models import Calendar, Event, CalendarRelation, Rule, prefetch_content_objects
 
 class CalendarAdminOptions(admin.ModelAdmin):
     prepopulated_fields = {"slug": ("name",)}
     search_fields = ['name']
 
 
+class EventAdminOptions(admin.ModelAdmin):
+    actions = ['cancel_occurrences', 'shift_occurrences', 'split_series']
+
+    def _series_action(self, request, queryset, action, required):
+        """
+        Asks for the range of occurrences with a SeriesRangeForm and applies
+        ``action`` to each selected event with the cleaned data once it is
+        valid.
+        """
+        if request.POST.get('apply'):
+            form = SeriesRangeForm(required, request.POST)
+            if form.is_valid():
+                count = 0
+                for event in queryset:
+                    try:
+                        action(event, form.cleaned_data)
+                        count += 1
+                    except ValueError, e:
+                        self.message_user(request, u'%s: %s' % (event, e))
+                self.message_user(request, ugettext("%(count)d events were changed.") % {
+                    'count': count})
+                return None
+        else:
+            form = SeriesRangeForm(required)
+        return render_to_response('admin/ellaschedule/event/series_action.html', {
+            'title': _("Change occurrences"),
+            'form': form,
+            'queryset': queryset,
+            'action': request.POST.get('action'),
+            'action_checkbox_name': admin.ACTION_CHECKBOX_NAME,
+        }, context_instance=RequestContext(request))
+
+    def cancel_occurrences(self, request, queryset):
+        return self._series_action(request, queryset,
+            lambda event, data: event.cancel_range(data['start'], data['end']),
+            ('start', 'end'))
+    cancel_occurrences.short_description = _("Cancel occurrences of selected events")
+
+    def shift_occurrences(self, request, queryset):
+        return self._series_action(request, queryset,
+            lambda event, data: event.shift_range(data['start'], data['end'],
+                datetime.timedelta(minutes=data['shift'])),
+            ('start', 'shift'))
+    shift_occurrences.short_description = _("Shift occurrences of selected events")
+
+    def split_series(self, request, queryset):
+        return self._series_action(request, queryset.exclude(rule=None),
+            lambda event, data: event.split_series_at(data['start']),
+            ('start',))
+    split_series.short_description = _("Split selected series")
+
+
+class CalendarRelationChangeList(ChangeList):
+
+    def get_results(self, request):
+        super(CalendarRelationChangeList, self).get_results(request)
+        # the related objects of a page in a query per model
+        self.result_list = prefetch_content_objects(self.result_list)
+
+
+class CalendarRelationAdminOptions(admin.ModelAdmin):
+    list_select_related = True
+
+    def get_changelist(self, request, **kwargs):
+        return CalendarRelationChangeList
+
+
 admin.site.register(Calendar, CalendarAdminOptions)
-admin.site.register([Rule, Event, CalendarRelation])
+admin.site.register(Event, EventAdminOptions)
+admin.site.register(CalendarRelation, CalendarRelationAdminOptions)
+admin.site.register(Rule)
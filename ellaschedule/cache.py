@@ -0,0 +1,428 @@
+import datetime
+import operator
+import threading
+import time
+from array import array
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db.models import Q
+from django.db.models.query import QuerySet
+from django.utils.hashcompat import md5_constructor
+
+from ellaschedule.conf.settings import SCHEDULE_CACHE_TIMEOUT, SHOW_CANCELLED_OCCURRENCES, \
+    OCCURRENCE_CACHE_SIZE
+
+# version counters outlive the data cached under them
+VERSION_TIMEOUT = 60 * 60 * 24 * 30
+
+def _version_key(calendar_id):
+    return 'ellaschedule:calendar:%s:version' % calendar_id
+
+def _object_version_key(content_type_id, object_id):
+    return 'ellaschedule:object:%s:%s:version' % (content_type_id, object_id)
+
+# the version of all the relations, for changes which can not tell the
+# objects they concern
+RELATIONS_VERSION_KEY = 'ellaschedule:relations:version'
+
+def _get_versions(keys):
+    versions = cache.get_many(keys)
+    for key in keys:
+        if versions.get(key) is None:
+            # a fresh version never matches data cached before the counter
+            # was evicted
+            versions[key] = int(time.time() * 1000)
+            cache.add(key, versions[key], VERSION_TIMEOUT)
+    return [versions[key] for key in keys]
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, int(time.time() * 1000), VERSION_TIMEOUT)
+
+def get_version(calendar_id):
+    """
+    Returns the current version of a calendar, which changes whenever one
+    of its events, occurrences or rules does.  Data derived from the
+    calendar is cached under it.
+    """
+    return _get_versions([_version_key(calendar_id)])[0]
+
+def bump_version(calendar_id):
+    """
+    Invalidates everything cached under the version of a calendar.
+    """
+    _bump(_version_key(calendar_id))
+
+def bump_object_version(content_type_id, object_id):
+    """
+    Invalidates the visible calendars and events cached for an object, see
+    get_visible_ids.
+    """
+    _bump(_object_version_key(content_type_id, object_id))
+
+def bump_relations_version():
+    """
+    Invalidates the visible calendars and events cached for all objects.
+    """
+    _bump(RELATIONS_VERSION_KEY)
+
+def _calendar_name_key(name):
+    # names may hold characters memcached does not take in keys
+    return 'ellaschedule:calendar:named:%s' % md5_constructor(
+        name.encode('utf-8')).hexdigest()
+
+def get_cached_calendar_id(name):
+    """
+    Returns the id of the calendar named ``name`` stored by
+    set_cached_calendar_id, or None.  The id is shared by all processes.
+    """
+    return cache.get(_calendar_name_key(name))
+
+def set_cached_calendar_id(name, calendar_id):
+    cache.set(_calendar_name_key(name), calendar_id, SCHEDULE_CACHE_TIMEOUT)
+
+def delete_cached_calendar_id(name):
+    cache.delete(_calendar_name_key(name))
+
+def get_visible_ids(obj, distinction=None):
+    """
+    Returns (calendar ids, inherited calendar ids, event ids) for ``obj``,
+    e.g. a user: the calendars it is related to, the ones among them whose
+    relation is inheritable, so that it sees all their events, and the
+    events it is related to directly, all with ``distinction`` if given.
+
+    The ids are cached under the version of the object, which changes with
+    its CalendarRelations and EventRelations, and memoized on the object,
+    so that filtering a page by permissions costs at most one cache lookup.
+    """
+    from ellaschedule.models import CalendarRelation, EventRelation
+
+    memo = obj.__dict__.setdefault('_visible_ids', {})
+    if distinction not in memo:
+        ct = ContentType.objects.get_for_model(type(obj))
+        key = 'ellaschedule:object:%s:%s:%s:%s:visible:%s' % ((ct.id, obj.id) + tuple(
+            _get_versions([_object_version_key(ct.id, obj.id), RELATIONS_VERSION_KEY])) +
+            (distinction or '',))
+        ids = cache.get(key)
+        if ids is None:
+            calendars = CalendarRelation.objects.filter(content_type=ct, object_id=obj.id)
+            events = EventRelation.objects.filter(content_type=ct, object_id=obj.id)
+            if distinction:
+                calendars = calendars.filter(distinction=distinction)
+                events = events.filter(distinction=distinction)
+            calendar_ids, inherited = set(), set()
+            for calendar_id, inheritable in calendars.values_list('calendar', 'inheritable'):
+                calendar_ids.add(calendar_id)
+                if inheritable:
+                    inherited.add(calendar_id)
+            ids = (calendar_ids, inherited, set(events.values_list('event', flat=True)))
+            cache.set(key, ids, SCHEDULE_CACHE_TIMEOUT)
+        memo[distinction] = ids
+    return memo[distinction]
+
+def get_visible_events(events, obj, distinction=None):
+    """
+    Filters the ``events`` queryset down to the ones ``obj`` sees according
+    to get_visible_ids, for GET_EVENTS_FUNC.
+    """
+    calendar_ids, inherited, event_ids = get_visible_ids(obj, distinction)
+    visible = []
+    if inherited:
+        visible.append(Q(calendar__in=inherited))
+    if event_ids:
+        visible.append(Q(pk__in=event_ids))
+    if not visible:
+        return events.none()
+    return events.filter(reduce(operator.or_, visible))
+
+def get_busy_days(calendar, year):
+    """
+    Returns an array of 46 bytes, a bit per day of ``year``, set for days
+    with an occurrence of the calendar (see is_busy_day).  The bitmap is
+    cached under the calendar version and memoized on the calendar object,
+    so that rendering a year costs one cache lookup, not an expansion per
+    day.
+    """
+    memo = calendar.__dict__.setdefault('_busy_days', {})
+    if year not in memo:
+        key = 'ellaschedule:calendar:%s:%s:busy:%d' % (calendar.id,
+            get_version(calendar.id), year)
+        data = cache.get(key)
+        if data is None:
+            bitmap = compute_busy_days(calendar, year)
+            cache.set(key, bitmap.tostring(), SCHEDULE_CACHE_TIMEOUT)
+        else:
+            bitmap = array('B')
+            bitmap.fromstring(data)
+        memo[year] = bitmap
+    return memo[year]
+
+def compute_busy_days(calendar, year):
+    """
+    Computes the busy days bitmap of get_busy_days with one batched
+    expansion of the year.  A day counts as busy the way
+    Period.has_occurrences counts it, boundaries included.
+    """
+    from ellaschedule.models import Event
+    from ellaschedule.utils import expand_occurrences
+
+    start = datetime.datetime(year, 1, 1)
+    end = datetime.datetime(year + 1, 1, 1)
+    first_day = start.date()
+    days = (end - start).days
+    bitmap = array('B', [0] * 46)
+    events = Event.objects.in_window(start, end).filter(calendar=calendar)
+    for o_start, o_end, event, occurrence in expand_occurrences(events, start, end):
+        if occurrence is not None and occurrence.cancelled and not SHOW_CANCELLED_OCCURRENCES:
+            continue
+        first = (o_start.date() - first_day).days
+        if o_start.time() == datetime.time.min:
+            # touches the end of the day before
+            first -= 1
+        last = (o_end.date() - first_day).days
+        for day in range(max(first, 0), min(last, days - 1) + 1):
+            bitmap[day >> 3] |= 1 << (day & 7)
+    return bitmap
+
+def is_busy_day(bitmap, day):
+    """
+    Tells whether the bit of ``day`` (a date) is set in a bitmap returned
+    by get_busy_days.
+
+    >>> bitmap = array('B', [0] * 46)
+    >>> bitmap[4] = 2
+    >>> is_busy_day(bitmap, datetime.date(2008, 1, 10)), is_busy_day(bitmap, datetime.date(2008, 2, 3))
+    (False, True)
+    """
+    day = day.timetuple().tm_yday - 1
+    return bool(bitmap[day >> 3] & (1 << (day & 7)))
+
+
+class LRUCache(object):
+    """
+    A mapping of at most ``size`` items which drops the least recently used
+    ones first, safe to share between threads.
+
+    >>> lru = LRUCache(2)
+    >>> lru.set('a', 1); lru.set('b', 2); lru.get('a'); lru.set('c', 3)
+    1
+    >>> lru.get('b'), lru.get('a'), len(lru)
+    (None, 1, 2)
+    """
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._links = {}
+        # a circular list of [previous, next, key, value] links, the most
+        # recently used last
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+
+    def __len__(self):
+        return len(self._links)
+
+    def _unlink(self, link):
+        link[0][1] = link[1]
+        link[1][0] = link[0]
+
+    def _append(self, link):
+        last = self._root[0]
+        link[0], link[1] = last, self._root
+        last[1] = self._root[0] = link
+
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            link = self._links.get(key)
+            if link is None:
+                return default
+            self._unlink(link)
+            self._append(link)
+            return link[3]
+        finally:
+            self._lock.release()
+
+    def set(self, key, value):
+        if self.size <= 0:
+            return
+        self._lock.acquire()
+        try:
+            link = self._links.get(key)
+            if link is not None:
+                self._unlink(link)
+                link[3] = value
+            else:
+                if len(self._links) >= self.size:
+                    oldest = self._root[1]
+                    self._unlink(oldest)
+                    del self._links[oldest[2]]
+                link = self._links[key] = [None, None, key, value]
+            self._append(link)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._links.clear()
+            self._root[:] = [self._root, self._root, None, None]
+        finally:
+            self._lock.release()
+
+# the month buckets of occurrences of this process, see get_cached_occurrences
+_occurrence_buckets = LRUCache(OCCURRENCE_CACHE_SIZE)
+
+def clear_occurrence_buckets():
+    """
+    Forgets the occurrences cached in the process, not the ones in the cache
+    backend.
+    """
+    _occurrence_buckets.clear()
+
+def _next_month(month):
+    if month.month == 12:
+        return month.replace(year=month.year + 1, month=1)
+    return month.replace(month=month.month + 1)
+
+def _get_months(start, end):
+    """
+    Returns the first days of the months from the one of start to the one
+    of end.
+    """
+    month = datetime.datetime(start.year, start.month, 1)
+    months = []
+    while month <= end:
+        months.append(month)
+        month = _next_month(month)
+    return months
+
+def _bucket_key(event, calendar_version, month):
+    # what the expansion of the event depends on besides its calendar: its
+    # rule and occurrences bump the calendar version, its own fields do not
+    # always (e.g. while unsaved)
+    state = md5_constructor(repr((event.start, event.end, event.rule_id,
+        event.end_recurring_period, event.exceptions))).hexdigest()[:12]
+    return 'ellaschedule:event:%s:%s:%s:occurrences:%d-%02d' % (event.id,
+        calendar_version, state, month.year, month.month)
+
+def _expand_buckets(missing):
+    """
+    Expands the (event, month) buckets of ``missing``, {key: (event, month)},
+    at once and returns {key: packed occurrences}.
+    """
+    from ellaschedule.packing import pack_occurrences
+    from ellaschedule.utils import expand_occurrences, get_persisted_occurrences
+
+    events, months = {}, {}
+    for key, (event, month) in missing.items():
+        events[event.id] = event
+        months.setdefault(event.id, []).append((month, _next_month(month), key))
+    start = min([month for event, month in missing.values()])
+    end = _next_month(max([month for event, month in missing.values()]))
+    events = events.values()
+    buckets = dict([(key, []) for key in missing])
+    for o_start, o_end, event, occurrence in expand_occurrences(events, start, end,
+            get_persisted_occurrences(events, start, end, 'description')):
+        occurrence = occurrence or event._create_occurrence(o_start, o_end)
+        for month, next_month, key in months[event.id]:
+            if o_start <= next_month and o_end >= month:
+                buckets[key].append(occurrence)
+    return dict([(key, pack_occurrences(occurrences))
+        for key, occurrences in buckets.items()])
+
+def _is_generated(event, item):
+    # whether the packed occurrence is one the rule of the event generates
+    # as it is, not a persisted one or one changed by an exception
+    o_start, o_end, event_id, cancelled, occurrence_id, original_start = item[:6]
+    return (event.rule_id is not None and occurrence_id is None and
+        not cancelled and o_start == original_start and
+        event._get_exception_occurrence(o_start, o_end) is None)
+
+def get_cached_occurrences(events, start, end):
+    """
+    Returns the occurrences of ``events`` (a list or a queryset) between
+    start and end, sorted by start and end, for Period.
+
+    Expanding an event depends only on the event, its rule and its
+    persisted occurrences, so the occurrences are cached in buckets of a
+    calendar month per event, under the version of the event's calendar and
+    the fields of the event which drive the expansion: in the LRU of the
+    process first, then in the cache backend.  The buckets missing from both
+    are expanded at once and stored in both, so that month, week and day
+    views share them.  Events without a calendar, whose changes bump no
+    version, and unsaved ones are expanded every time.
+
+    Persisted occurrences only come back with what pages show, see
+    inflate_occurrences; reload them before saving.
+    """
+    from ellaschedule.packing import unpack_occurrences, inflate_occurrences
+    from ellaschedule.utils import expand_occurrences
+
+    if isinstance(events, QuerySet):
+        events = events.select_related('rule')
+    events = list(events)
+    calendar_ids = list(set([event.calendar_id for event in events
+        if event.calendar_id is not None and event.id is not None]))
+    versions = dict(zip(calendar_ids,
+        _get_versions([_version_key(calendar_id) for calendar_id in calendar_ids])))
+    months = _get_months(start, end)
+
+    buckets, uncached = {}, []
+    for event in events:
+        if event.calendar_id is None or event.id is None:
+            uncached.append(event)
+            continue
+        for month in months:
+            buckets[_bucket_key(event, versions[event.calendar_id], month)] = (event, month)
+
+    items, missing = [], {}
+    for key, bucket in buckets.items():
+        cached = _occurrence_buckets.get(key)
+        if cached is None:
+            missing[key] = bucket
+        else:
+            items.extend(cached)
+    if missing:
+        for key, data in cache.get_many(missing.keys()).items():
+            try:
+                cached = unpack_occurrences(data)
+            except ValueError:
+                # left by another version of the format
+                continue
+            _occurrence_buckets.set(key, cached)
+            items.extend(cached)
+            del missing[key]
+    if missing:
+        packed = _expand_buckets(missing)
+        cache.set_many(packed, SCHEDULE_CACHE_TIMEOUT)
+        for key, data in packed.items():
+            cached = unpack_occurrences(data)
+            _occurrence_buckets.set(key, cached)
+            items.extend(cached)
+
+    # occurrences which span months are in the buckets of each of them; the
+    # window is the one of expand_occurrences, which keeps the occurrences
+    # ending at start but, of the ones starting at end, only the generated
+    # occurrences of series
+    events_by_id = dict([(event.id, event) for event in events])
+    seen = set()
+    selected = []
+    for item in items:
+        o_start, o_end, event_id, cancelled, occurrence_id, original_start = item[:6]
+        if o_end < start or o_start > end:
+            continue
+        if o_start == end and not _is_generated(events_by_id[event_id], item):
+            continue
+        identity = (event_id, occurrence_id, original_start)
+        if identity not in seen:
+            seen.add(identity)
+            selected.append(item)
+    occurrences = inflate_occurrences(selected, events_by_id)
+    if uncached:
+        for o_start, o_end, event, occurrence in expand_occurrences(uncached, start, end):
+            occurrences.append(occurrence or event._create_occurrence(o_start, o_end))
+    occurrences.sort(key=lambda occurrence: (occurrence.start, occurrence.end))
+    return occurrences
@@ -32,6 +32,17 @@ if not CHECK_PERMISSION_FUNC:
 
     CHECK_PERMISSION_FUNC = check_edit_permission
 
+# Callable used to check the edit permissions of many events at once, e.g.
+# all the events of a calendar page. It takes the events and the user and
+# returns {event id: boolean}. By default CHECK_PERMISSION_FUNC is called
+# for each event
+CHECK_PERMISSIONS_BULK_FUNC = getattr(settings, 'CHECK_PERMISSIONS_BULK_FUNC', None)
+if not CHECK_PERMISSIONS_BULK_FUNC:
+    def check_edit_permissions(events, user):
+        return dict([(event.id, CHECK_PERMISSION_FUNC(event, user)) for event in events])
+
+    CHECK_PERMISSIONS_BULK_FUNC = check_edit_permissions
+
 # Callable used to customize the event list given for a calendar and user
 # (e.g. all events on that calendar, those events plus another calendar's events,
 # or the events filtered based on user permissions)
@@ -39,9 +50,50 @@ if not CHECK_PERMISSION_FUNC:
 GET_EVENTS_FUNC = getattr(settings, 'GET_EVENTS_FUNC', None)
 if not GET_EVENTS_FUNC:
     def get_events(request, calendar):
-        return calendar.event_set.all()
+        return calendar.event_set.slim()
 
     GET_EVENTS_FUNC = get_events
 
+# Name of the calendar of events saved without one, created when needed
+EVENT_DEFAULT_CALENDAR_NAME = getattr(settings, 'EVENT_DEFAULT_CALENDAR_NAME', None) or u"default"
+
 # URL to redirect to to after an occurrence is canceled
 OCCURRENCE_CANCEL_REDIRECT = getattr(settings, 'OCCURRENCE_CANCEL_REDIRECT', None)
+
+# Whether Atom feeds are validated before they are written. Validation needs
+# all the entries in memory, without it entries are written as they are
+# produced.
+FEED_VALIDATE = getattr(settings, 'FEED_VALIDATE', settings.DEBUG)
+
+# Whether EventForm refuses events whose occurrences overlap occurrences of
+# other events in the same calendar or at the same place
+CHECK_EVENT_CONFLICTS = getattr(settings, 'CHECK_EVENT_CONFLICTS', False)
+
+# How many days of occurrences of recurring events without an end are
+# checked for conflicts
+CONFLICT_CHECK_DAYS = getattr(settings, 'CONFLICT_CHECK_DAYS', 365)
+
+# Resolution in minutes of the place occupancy index of child events (see
+# PlaceOccupancy), must divide a day
+OCCUPANCY_SLOT_MINUTES = getattr(settings, 'OCCUPANCY_SLOT_MINUTES', 15)
+if (24 * 60) % OCCUPANCY_SLOT_MINUTES:
+    raise ImproperlyConfigured("OCCUPANCY_SLOT_MINUTES must divide a day")
+
+# How long (in seconds) data derived from calendars, like the busy days of
+# the small calendar views, is cached.  It is cached under a calendar
+# version, changes of the calendar invalidate it sooner.
+SCHEDULE_CACHE_TIMEOUT = getattr(settings, 'SCHEDULE_CACHE_TIMEOUT', 60 * 60 * 24)
+
+# Whether the small month and year views take busy days from a cached
+# per-year bitmap of calendar.event_set instead of expanding the
+# occurrences.  On by default unless GET_EVENTS_FUNC is customized, as the
+# bitmap does not know about it.
+BUSY_DAYS_CACHE = getattr(settings, 'BUSY_DAYS_CACHE',
+                          getattr(settings, 'GET_EVENTS_FUNC', None) is None)
+
+# Whether periods take the occurrences of their events from month buckets
+# cached per event, in the process (at most OCCURRENCE_CACHE_SIZE buckets)
+# and in the cache backend, instead of expanding them for every request.
+# Their persisted occurrences then only have the fields pages show.
+OCCURRENCE_CACHE = getattr(settings, 'OCCURRENCE_CACHE', False)
+OCCURRENCE_CACHE_SIZE = getattr(settings, 'OCCURRENCE_CACHE_SIZE', 10000)
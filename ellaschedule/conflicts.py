@@ -0,0 +1,131 @@
+import heapq
+
+from django.db.models import Q
+
+from ellaschedule.utils import expand_occurrences
+
+def get_spans(events, start, end):
+    """
+    Returns the (start, end, event, persisted occurrence or None) spans of the
+    occurrences of ``events`` which overlap start-end and are not cancelled,
+    sorted by start.
+    """
+    spans = []
+    for span in expand_occurrences(events, start, end):
+        o_start, o_end, event, occurrence = span
+        if occurrence is not None and occurrence.cancelled:
+            continue
+        if o_start < end and o_end > start:
+            spans.append(span)
+    return spans
+
+def sweep_conflicts(spans):
+    """
+    Returns all the pairs of overlapping spans, given as tuples starting with
+    their start and end and sorted by start, in O(n log n + k).  Spans which
+    only touch do not conflict.
+
+    >>> sweep_conflicts([(1, 3, 'a'), (2, 4, 'b'), (3, 5, 'c'), (6, 7, 'd')])
+    [((1, 3, 'a'), (2, 4, 'b')), ((2, 4, 'b'), (3, 5, 'c'))]
+    """
+    conflicts = []
+    # spans which have not ended yet, by their end
+    active = []
+    for i, span in enumerate(spans):
+        while active and active[0][0] <= span[0]:
+            heapq.heappop(active)
+        for end, j, other in active:
+            conflicts.append((other, span))
+        heapq.heappush(active, (span[1], i, span))
+    return conflicts
+
+def _is_parent(span, other):
+    # child events of e.g. a conference overlap their parent event on purpose
+    event, other_event = span[2], other[2]
+    return (event.parent_event_id is not None and event.parent_event_id == other_event.id) or \
+        (other_event.parent_event_id is not None and other_event.parent_event_id == event.id)
+
+def normalize_place(place):
+    return u' '.join(place.lower().split())
+
+def find_conflicts(calendars, start, end, by=('calendar', 'place')):
+    """
+    Returns the overlapping occurrences of the events of ``calendars``
+    between start and end, within the same calendar and/or at the same
+    place (compared case insensitively), as a list of (kind, key, span,
+    other span) tuples, where kind is 'calendar' or 'place', key the
+    calendar id or the place and spans are (start, end, event, persisted
+    occurrence or None) tuples.  Occurrences of child events do not
+    conflict with their parent event.
+
+    Occurrences are expanded once and grouped, each group is swept in
+    O(n log n + k).
+    """
+    from ellaschedule.models import Event
+    events = Event.objects.in_window(start, end).filter(
+        calendar__in=calendars).select_related('rule')
+    groups = {}
+    for span in get_spans(events, start, end):
+        event = span[2]
+        if 'calendar' in by:
+            groups.setdefault(('calendar', event.calendar_id), []).append(span)
+        if 'place' in by and event.place and event.place.strip():
+            groups.setdefault(('place', normalize_place(event.place)), []).append(span)
+
+    conflicts = []
+    for kind, key in sorted(groups):
+        for span, other in sweep_conflicts(groups[(kind, key)]):
+            if not _is_parent(span, other):
+                conflicts.append((kind, key, span, other))
+    return conflicts
+
+def find_event_conflicts(event, calendar=None, until=None):
+    """
+    Returns the occurrences of other events in ``calendar`` (the event's
+    calendar by default) or at the event's place which overlap occurrences
+    of ``event``, as a list of (span, other span) tuples.  The event need
+    not be saved, e.g. it may be built from a form.  Occurrences of
+    recurring events are checked up to ``until`` or their end recurring
+    period.
+
+    Only events near the occurrences of ``event`` are read and expanded.
+    """
+    from ellaschedule.models import Event
+    if calendar is None:
+        calendar = event.calendar
+    if event.rule is not None:
+        if event.end_recurring_period and (until is None or event.end_recurring_period < until):
+            until = event.end_recurring_period
+        if until is None:
+            raise ValueError("recurring events without an end need until")
+    else:
+        until = event.end
+    spans = [(o_start, o_end, event, None) for o_start, o_end in
+        event._get_occurrence_spans(event.start, until)]
+    if not spans:
+        return []
+    start = spans[0][0]
+    end = max([span[1] for span in spans])
+
+    near = Q(calendar=calendar)
+    if event.place and event.place.strip():
+        near |= Q(place__iexact=event.place.strip())
+    others = Event.objects.in_window(start, end).filter(near).select_related('rule')
+    if event.pk is not None:
+        others = others.exclude(pk=event.pk)
+    others = get_spans(others, start, end)
+
+    conflicts = []
+    j = 0
+    # other spans which started before the end of the current span, by their end
+    active = []
+    for span in spans:
+        while j < len(others) and others[j][0] < span[1]:
+            heapq.heappush(active, (others[j][1], j, others[j]))
+            j += 1
+        while active and active[0][0] <= span[0]:
+            heapq.heappop(active)
+        for o_end, k, other in active:
+            if other[0] < span[1] and not _is_parent(span, other):
+                conflicts.append((span, other))
+    return conflicts
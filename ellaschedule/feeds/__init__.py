@@ -1,18 +1,25 @@
-from schedule.models import Calendar
+from ellaschedule.models import Calendar, Occurrence
+from ellaschedule.conf.settings import FEED_VALIDATE
 from django.contrib.syndication.feeds import FeedDoesNotExist
 from django.core.exceptions import ObjectDoesNotExist
 from django.conf import settings
-from schedule.feeds.atom import Feed
-from schedule.feeds.icalendar import ICalendarFeed
+from ellaschedule.feeds.atom import Feed
+from ellaschedule.feeds.icalendar import ICalendarFeed
+from django.db.models import Max
 from django.http import HttpResponse
 import datetime, itertools
 
 class UpcomingEventsFeed(Feed):
     feed_id = "upcoming"
+    VALIDATE = FEED_VALIDATE
     
     def feed_title(self, obj):
         return "Upcoming Events for %s" % obj.name
     
+    def feed_updated(self, obj):
+        # known up front, so that entries can be streamed
+        return obj.events.aggregate(updated=Max('created_on'))['updated']
+    
     def get_object(self, bits):
         if len(bits) != 1:
             raise ObjectDoesNotExist
@@ -49,8 +56,14 @@ class CalendarICalendar(ICalendarFeed):
     def items(self):
         cal_id = self.args[1]
         cal = Calendar.objects.get(pk=cal_id)
-        
-        return cal.events.all()
+
+        # persisted occurrences of the whole calendar in one query, they are
+        # serialized as exceptions of their event's recurrence
+        self.persisted_occurrences = {}
+        for occurrence in Occurrence.objects.slim().filter(event__calendar=cal):
+            self.persisted_occurrences.setdefault(occurrence.event_id, []).append(occurrence)
+
+        return cal.event_set.slim('created_on').select_related('rule')
 
     def item_uid(self, item):
         return str(item.id)
@@ -63,6 +76,51 @@ class CalendarICalendar(ICalendarFeed):
 
     def item_summary(self, item):
         return item.title
-        
+
+    def item_location(self, item):
+        return item.place
+
     def item_created(self, item):
-        return item.created_on
\ No newline at end of file
+        return item.created_on
+
+    def item_rrule(self, item):
+        return item.get_ical_rrule()
+
+    def item_exdates(self, item):
+        if item.rule is None:
+            return None
+        exdates = [occurrence.original_start for occurrence in
+            self.persisted_occurrences.get(item.id, []) if occurrence.cancelled]
+        exdates.extend([original for original, span in
+            item.get_exceptions().items() if span is None])
+        return sorted(exdates)
+
+    def item_overrides(self, item):
+        if item.rule is None:
+            return []
+        overrides = []
+        for occurrence in self.persisted_occurrences.get(item.id, []):
+            if occurrence.moved and not occurrence.cancelled:
+                occurrence.event = item
+                overrides.append(occurrence)
+        difference = item.end - item.start
+        for original, span in sorted(item.get_exceptions().items()):
+            if span is not None:
+                overrides.append(item._get_exception_occurrence(original,
+                    original + difference))
+        return overrides
+
+    def override_recurrence_id(self, override):
+        return override.original_start
+
+    def override_start(self, override):
+        return override.start
+
+    def override_end(self, override):
+        return override.end
+
+    def override_summary(self, override):
+        return override.title
+
+    def override_location(self, override):
+        return override.event.place
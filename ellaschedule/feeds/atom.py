@@ -76,16 +76,23 @@ class Feed(object):
     VALIDATE = True
     
     
+    # how each attribute is fetched, see __get_dynamic_attr
+    MISSING, VALUE, CALL, CALL_WITH_OBJ = range(4)
+    
+    # Feed class -> {attname: one of the above}, filled lazily
+    _dispatch_tables = {}
+    
+    
     def __init__(self, slug, feed_url):
         # @@@ slug and feed_url are not used yet
         pass
     
     
-    def __get_dynamic_attr(self, attname, obj, default=None):
+    def __get_dispatch(self, attname):
         try:
             attr = getattr(self, attname)
         except AttributeError:
-            return default
+            return self.MISSING
         if callable(attr):
             # Check func_code.co_argcount rather than try/excepting the
             # function and catching the TypeError, because something inside
@@ -96,12 +103,48 @@ class Feed(object):
             else:
                 argcount = attr.__call__.func_code.co_argcount
             if argcount == 2: # one argument is 'self'
-                return attr(obj)
+                return self.CALL_WITH_OBJ
             else:
-                return attr()
+                return self.CALL
+        return self.VALUE
+    
+    
+    def __get_dynamic_attr(self, attname, obj, default=None):
+        # attributes are inspected once per Feed class, not per item
+        table = self._dispatch_tables.setdefault(self.__class__, {})
+        try:
+            kind = table[attname]
+        except KeyError:
+            kind = table[attname] = self.__get_dispatch(attname)
+        if kind == self.MISSING:
+            return default
+        attr = getattr(self, attname)
+        if kind == self.CALL_WITH_OBJ:
+            return attr(obj)
+        elif kind == self.CALL:
+            return attr()
         return attr
     
     
+    def __get_entries(self, feed, items):
+        for item in items:
+            yield feed.make_item(
+                atom_id = self.__get_dynamic_attr('item_id', item), 
+                title = self.__get_dynamic_attr('item_title', item),
+                updated = self.__get_dynamic_attr('item_updated', item),
+                content = self.__get_dynamic_attr('item_content', item),
+                published = self.__get_dynamic_attr('item_published', item),
+                rights = self.__get_dynamic_attr('item_rights', item),
+                source = self.__get_dynamic_attr('item_source', item),
+                summary = self.__get_dynamic_attr('item_summary', item),
+                authors = self.__get_dynamic_attr('item_authors', item, default=[]),
+                categories = self.__get_dynamic_attr('item_categories', item, default=[]),
+                contributors = self.__get_dynamic_attr('item_contributors', item, default=[]),
+                links = self.__get_dynamic_attr('item_links', item, default=[]),
+                extra_attrs = self.__get_dynamic_attr('item_extra_attrs', None, default={}),
+            )
+    
+    
     def get_feed(self, extra_params=None):
         
         if extra_params:
@@ -132,22 +175,14 @@ class Feed(object):
         if items is None:
             raise LookupError('Feed has no items field')
         
-        for item in items:
-            feed.add_item(
-                atom_id = self.__get_dynamic_attr('item_id', item), 
-                title = self.__get_dynamic_attr('item_title', item),
-                updated = self.__get_dynamic_attr('item_updated', item),
-                content = self.__get_dynamic_attr('item_content', item),
-                published = self.__get_dynamic_attr('item_published', item),
-                rights = self.__get_dynamic_attr('item_rights', item),
-                source = self.__get_dynamic_attr('item_source', item),
-                summary = self.__get_dynamic_attr('item_summary', item),
-                authors = self.__get_dynamic_attr('item_authors', item, default=[]),
-                categories = self.__get_dynamic_attr('item_categories', item, default=[]),
-                contributors = self.__get_dynamic_attr('item_contributors', item, default=[]),
-                links = self.__get_dynamic_attr('item_links', item, default=[]),
-                extra_attrs = self.__get_dynamic_attr('item_extra_attrs', None, default={}),
-            )
+        entries = self.__get_entries(feed, items)
+        if self.VALIDATE or not feed.feed['updated']:
+            # validation and the feed's updated element need all the
+            # entries up front
+            feed.items = list(entries)
+        else:
+            # otherwise entries are produced while the feed is written
+            feed.items = entries
         
         if self.VALIDATE:
             feed.validate()
@@ -190,10 +225,16 @@ class AtomFeed(object):
             'extra_attrs': extra_attrs,
             'hide_generator': hide_generator,
         }
+        # a list, or an iterator of items consumed by write() when the feed
+        # has its updated set (see Feed.get_feed)
         self.items = []
     
     
-    def add_item(self, atom_id, title, updated, content=None, published=None, rights=None, source=None, summary=None,
+    def add_item(self, *args, **kwargs):
+        self.items.append(self.make_item(*args, **kwargs))
+    
+    
+    def make_item(self, atom_id, title, updated, content=None, published=None, rights=None, source=None, summary=None,
         authors=[], categories=[], contributors=[], links=[], extra_attrs={}):
         if atom_id is None:
             raise LookupError('Feed has no item_id method')
@@ -201,7 +242,7 @@ class AtomFeed(object):
             raise LookupError('Feed has no item_title method')
         if updated is None:
             raise LookupError('Feed has no item_updated method')
-        self.items.append({
+        return {
             'id': atom_id,
             'title': title,
             'updated': updated,
@@ -215,7 +256,7 @@ class AtomFeed(object):
             'contributors': contributors,
             'links': links,
             'extra_attrs': extra_attrs,
-        })
+        }
     
     
     def latest_updated(self):
@@ -10,6 +10,17 @@ EVENT_ITEMS = (
     ('location', 'location'),
     ('last_modified', 'last_modified'),
     ('created', 'created'),
+    ('rrule', 'rrule'),
+    ('exdate', 'exdates'),
+)
+
+# overrides share the uid of their item and are told apart by recurrence-id
+OVERRIDE_ITEMS = (
+    ('recurrence-id', 'recurrence_id'),
+    ('dtstart', 'start'),
+    ('dtend', 'end'),
+    ('summary', 'summary'),
+    ('location', 'location'),
 )
 
 class ICalendarFeed(object):
@@ -17,7 +28,7 @@ class ICalendarFeed(object):
     def __call__(self, *args, **kwargs):
         self.args = args
         self.kwargs = kwargs
-        
+
         cal = vobject.iCalendar()
 
         for item in self.items():
@@ -29,6 +40,16 @@ class ICalendarFeed(object):
                 if value:
                     event.add(vkey).value = value
 
+            for override in self.item_overrides(item):
+
+                event = cal.add('vevent')
+                event.add('uid').value = self.item_uid(item)
+
+                for vkey, key in OVERRIDE_ITEMS:
+                    value = getattr(self, 'override_' + key)(override)
+                    if value:
+                        event.add(vkey).value = value
+
         response = HttpResponse(cal.serialize())
         response['Content-Type'] = 'text/calendar'
 
@@ -56,4 +77,28 @@ class ICalendarFeed(object):
         pass
 
     def item_created(self, item):
-        pass
\ No newline at end of file
+        pass
+
+    def item_rrule(self, item):
+        pass
+
+    def item_exdates(self, item):
+        pass
+
+    def item_overrides(self, item):
+        return []
+
+    def override_recurrence_id(self, override):
+        pass
+
+    def override_start(self, override):
+        pass
+
+    def override_end(self, override):
+        pass
+
+    def override_summary(self, override):
+        pass
+
+    def override_location(self, override):
+        pass
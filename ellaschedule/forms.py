@@ -1,5 +1,7 @@
 from django import forms
 from django.utils.translation import ugettext_lazy as _
+from ellaschedule.conf.settings import CHECK_EVENT_CONFLICTS, CONFLICT_CHECK_DAYS
+from ellaschedule.conflicts import find_event_conflicts
 from ellaschedule.models import Event, Occurrence
 import datetime
 import time
@@ -17,14 +19,40 @@ class SpanForm(forms.ModelForm):
 
 
 class EventForm(SpanForm):
-    def __init__(self, hour24=False, *args, **kwargs):
+    def __init__(self, hour24=False, calendar=None, check_conflicts=CHECK_EVENT_CONFLICTS, *args, **kwargs):
         super(EventForm, self).__init__(*args, **kwargs)
+        self.calendar = calendar
+        self.check_conflicts = check_conflicts
     
     end_recurring_period = forms.DateTimeField(help_text = _("This date is ignored for one time only events."), required=False)
     
     class Meta:
         model = Event
         exclude = ('creator', 'created_on', 'calendar')
+
+    def clean(self):
+        cleaned_data = super(EventForm, self).clean()
+        calendar = self.calendar
+        if calendar is None and self.instance.pk is not None:
+            calendar = self.instance.calendar
+        if self.check_conflicts and calendar is not None and not self._errors:
+            event = Event(
+                start = cleaned_data.get('start'),
+                end = cleaned_data.get('end'),
+                rule = cleaned_data.get('rule'),
+                end_recurring_period = cleaned_data.get('end_recurring_period'),
+                place = cleaned_data.get('place'),
+                parent_event = cleaned_data.get('parent_event'),
+                exceptions = self.instance.exceptions,
+            )
+            event.pk = event.id = self.instance.pk
+            conflicts = find_event_conflicts(event, calendar,
+                event.start + datetime.timedelta(days=CONFLICT_CHECK_DAYS))
+            if conflicts:
+                span, other = conflicts[0]
+                raise forms.ValidationError(_("The event overlaps %(title)s at %(start)s.") % {
+                    'title': other[2].title, 'start': other[0]})
+        return cleaned_data
         
 
 class OccurrenceForm(SpanForm):
@@ -32,3 +60,26 @@ class OccurrenceForm(SpanForm):
     class Meta:
         model = Occurrence
         exclude = ('original_start', 'original_end', 'event', 'cancelled')
+
+
+class SeriesRangeForm(forms.Form):
+    """
+    The occurrences of events which the bulk admin actions (see
+    Event.cancel_range, shift_range and split_series_at) work on.
+    """
+    start = forms.DateTimeField(label=_("from"))
+    end = forms.DateTimeField(label=_("until"), required=False,
+        help_text=_("Leave empty for all the following occurrences."))
+    shift = forms.IntegerField(label=_("shift by minutes"), required=False)
+
+    def __init__(self, required=(), *args, **kwargs):
+        super(SeriesRangeForm, self).__init__(*args, **kwargs)
+        for name in required:
+            self.fields[name].required = True
+
+    def clean(self):
+        cleaned_data = self.cleaned_data
+        start, end = cleaned_data.get('start'), cleaned_data.get('end')
+        if start is not None and end is not None and end <= start:
+            raise forms.ValidationError(_("The end time must be later than start time."))
+        return cleaned_data
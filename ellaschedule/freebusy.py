@@ -0,0 +1,135 @@
+import datetime
+
+from django.db.models import Q
+
+def get_busy_spans(calendars, start, end, categories=None):
+    """
+    Yields the (start, end) spans of all the occurrences of ``calendars``
+    (of events in ``categories`` if given) between start and end which are
+    not cancelled, in no particular order.  The events are read with one
+    query and their persisted occurrences with another one, as plain values;
+    no occurrence instances are created.
+    """
+    from ellaschedule.models import Event, Occurrence
+    persisted = {}
+    occurrences = Occurrence.objects.filter(event__calendar__in=calendars).filter(
+        Q(start__lt=end, end__gt=start) |
+        Q(original_start__lte=end, original_end__gte=start))
+    events = Event.objects.in_window(start, end).filter(calendar__in=calendars)
+    if categories is not None:
+        occurrences = occurrences.filter(event__category__in=categories)
+        events = events.filter(category__in=categories)
+    for event_id, original_start, o_start, o_end, cancelled in occurrences.values_list(
+            'event', 'original_start', 'start', 'end', 'cancelled'):
+        persisted[(event_id, original_start)] = (o_start, o_end, cancelled)
+
+    for event in events.select_related('rule'):
+        exceptions = event.get_exceptions()
+        for o_start, o_end in event._get_occurrence_spans(start, end):
+            if (event.id, o_start) not in persisted and o_start not in exceptions:
+                yield o_start, o_end
+        for original, span in exceptions.items():
+            if span is not None and span[0] < end and span[1] > start and \
+                    (event.id, original) not in persisted:
+                yield span
+    for o_start, o_end, cancelled in persisted.values():
+        if not cancelled:
+            yield o_start, o_end
+
+def merge_spans(spans, start=None, end=None):
+    """
+    Returns the union of (start, end) spans as a sorted list of disjoint
+    spans, clipped to start and end if they are given.  Touching spans are
+    joined and empty ones dropped.
+
+    >>> merge_spans([(3, 5), (1, 2), (4, 8), (8, 9), (10, 10), (11, 12)])
+    [(1, 2), (3, 9), (11, 12)]
+    >>> merge_spans([(3, 5), (1, 2), (4, 8)], 4, 7)
+    [(4, 7)]
+    """
+    merged = []
+    for s_start, s_end in sorted(spans):
+        if start is not None and s_start < start:
+            s_start = start
+        if end is not None and s_end > end:
+            s_end = end
+        if s_end <= s_start:
+            continue
+        if merged and s_start <= merged[-1][1]:
+            if s_end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], s_end)
+        else:
+            merged.append((s_start, s_end))
+    return merged
+
+def get_vfreebusy(busy, start, end):
+    """
+    Returns an iCalendar with a VFREEBUSY component listing the ``busy``
+    spans between start and end, as returned by
+    CalendarManager.free_busy.  The naive local times are written in UTC.
+    """
+    import vobject
+    from dateutil import tz
+
+    local = tz.tzlocal()
+    cal = vobject.iCalendar()
+    freebusy = cal.add('vfreebusy')
+    freebusy.add('dtstart').value = start.replace(tzinfo=local)
+    freebusy.add('dtend').value = end.replace(tzinfo=local)
+    freebusy.add('dtstamp').value = datetime.datetime.now(local)
+    if busy:
+        freebusy.add('freebusy').value = [(s_start.replace(tzinfo=local),
+            s_end.replace(tzinfo=local)) for s_start, s_end in busy]
+    return cal
+
+def find_free_slots(calendars, duration, window, limit=10, working_hours=None):
+    """
+    Returns the first ``limit`` gaps of at least ``duration`` (a timedelta)
+    in the window given as a (start, end) tuple when none of ``calendars``
+    has an occurrence, as a list of (start, end) tuples.  If
+    ``working_hours`` is given as a (start, end) tuple of times, only the
+    time between them on each day is considered free.
+
+    The window is walked in growing chunks, so the rules are only expanded
+    as far as needed to find the slots, not to the end of the window.
+    """
+    start, end = window
+    slots = []
+    free_from = start
+    chunk_start = start
+    chunk_length = max(duration, datetime.timedelta(days=1))
+    while chunk_start < end and len(slots) < limit:
+        chunk_end = min(chunk_start + chunk_length, end)
+        spans = list(get_busy_spans(calendars, chunk_start, chunk_end))
+        if working_hours is not None:
+            spans.extend(get_off_hours(working_hours, chunk_start, chunk_end))
+        for busy_start, busy_end in merge_spans(spans, chunk_start, chunk_end):
+            if busy_start - free_from >= duration:
+                slots.append((free_from, busy_start))
+                if len(slots) == limit:
+                    return slots
+            free_from = max(free_from, busy_end)
+        chunk_start = chunk_end
+        chunk_length *= 2
+    if len(slots) < limit and end - free_from >= duration:
+        slots.append((free_from, end))
+    return slots
+
+def get_off_hours(working_hours, start, end):
+    """
+    Returns the spans outside ``working_hours`` ((start, end) tuple of times)
+    of the days from start to end.
+
+    >>> get_off_hours((datetime.time(9), datetime.time(17)), datetime.datetime(2008, 1, 1, 12), datetime.datetime(2008, 1, 2, 12))
+    [(datetime.datetime(2008, 1, 1, 0, 0), datetime.datetime(2008, 1, 1, 9, 0)), (datetime.datetime(2008, 1, 1, 17, 0), datetime.datetime(2008, 1, 2, 9, 0)), (datetime.datetime(2008, 1, 2, 17, 0), datetime.datetime(2008, 1, 3, 0, 0))]
+    """
+    work_start, work_end = working_hours
+    day = start.date()
+    spans = []
+    while day <= end.date():
+        day_start = datetime.datetime.combine(day, datetime.time.min)
+        next_day = day_start + datetime.timedelta(days=1)
+        spans.append((day_start, datetime.datetime.combine(day, work_start)))
+        spans.append((datetime.datetime.combine(day, work_end), next_day))
+        day = next_day.date()
+    return merge_spans(spans)
@@ -0,0 +1,51 @@
+import datetime
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+class Command(BaseCommand):
+    help = "Measure how many events per second are saved, with and without a calendar"
+    option_list = BaseCommand.option_list + (
+        make_option('--count', dest='count', type='int', default=500,
+            help='Number of events saved in each run.'),
+    )
+
+    def handle(self, *args, **options):
+        from ellaschedule.models import Calendar, Event
+        from ellaschedule.signals import get_default_calendar_id, disable_default_calendar, \
+            enable_default_calendar
+
+        count = options['count']
+        start = datetime.datetime(2010, 1, 1, 8, 0)
+
+        def save_events(calendar):
+            started = time.time()
+            for i in range(count):
+                Event(title=u'Benchmark %d' % i, calendar=calendar,
+                    start=start + datetime.timedelta(hours=i),
+                    end=start + datetime.timedelta(hours=i, minutes=30)).save()
+            return count / max(time.time() - started, 0.001)
+
+        # the default calendar is resolved, and cached, before the runs are
+        # timed; it is created for good if missing, like by the first event
+        # saved without a calendar
+        get_default_calendar_id()
+
+        # nothing of the run is kept
+        transaction.enter_transaction_management()
+        transaction.managed(True)
+        try:
+            calendar = Calendar(name=u'Benchmark', slug=u'benchmark')
+            calendar.save()
+            print "With a calendar: %.1f events/s" % save_events(calendar)
+            print "Without a calendar: %.1f events/s" % save_events(None)
+            disable_default_calendar()
+            try:
+                print "With a calendar, default calendar disabled: %.1f events/s" % save_events(calendar)
+            finally:
+                enable_default_calendar()
+        finally:
+            transaction.rollback()
+            transaction.leave_transaction_management()
@@ -0,0 +1,67 @@
+import cPickle as pickle
+import datetime
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+class Command(BaseCommand):
+    args = "calendar_slug"
+    help = "Compare the size and speed of pickled and packed occurrences of a calendar"
+    option_list = BaseCommand.option_list + (
+        make_option('--start', dest='start', default=None,
+            help='Start of the expanded period as YYYY-MM-DD, today by default.'),
+        make_option('--days', dest='days', type='int', default=365,
+            help='Length of the expanded period in days.'),
+        make_option('--repeat', dest='repeat', type='int', default=5,
+            help='Number of runs each timing is the best of.'),
+    )
+
+    def handle(self, *args, **options):
+        from ellaschedule.models import Calendar
+        from ellaschedule.packing import pack_occurrences, unpack_occurrences, \
+            inflate_occurrences
+        from ellaschedule.periods import Period
+        from ellaschedule.utils import parse_datetime
+
+        if len(args) != 1:
+            raise CommandError("Usage: benchmark_occurrence_packing %s" % self.args)
+        try:
+            calendar = Calendar.objects.get(slug=args[0])
+        except Calendar.DoesNotExist:
+            raise CommandError("No calendar %r" % args[0])
+        try:
+            if options['start']:
+                start = parse_datetime(options['start'])
+            else:
+                start = datetime.datetime.combine(datetime.date.today(), datetime.time.min)
+        except ValueError, e:
+            raise CommandError(str(e))
+        end = start + datetime.timedelta(days=options['days'])
+
+        events = list(calendar.event_set.slim())
+        occurrences = Period(events, start, end).occurrences
+        events = dict([(event.id, event) for event in events])
+        print "%d occurrences of %d events between %s and %s." % (len(occurrences),
+            len(events), start, end)
+
+        def best(function, *args):
+            times = []
+            for i in range(options['repeat']):
+                started = time.time()
+                result = function(*args)
+                times.append(time.time() - started)
+            return result, min(times) * 1000
+
+        formats = [
+            ('pickle', lambda: pickle.dumps(occurrences, pickle.HIGHEST_PROTOCOL), pickle.loads),
+            ('packed', lambda: pack_occurrences(occurrences, False),
+                lambda data: inflate_occurrences(unpack_occurrences(data), events)),
+            ('packed+zlib', lambda: pack_occurrences(occurrences),
+                lambda data: inflate_occurrences(unpack_occurrences(data), events)),
+        ]
+        print "%-12s %12s %12s %12s" % ('format', 'bytes', 'encode ms', 'decode ms')
+        for name, encode, decode in formats:
+            data, encode_time = best(encode)
+            result, decode_time = best(decode, data)
+            print "%-12s %12d %12.1f %12.1f" % (name, len(data), encode_time, decode_time)
@@ -0,0 +1,377 @@
+import datetime
+import sys
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.template.defaultfilters import slugify
+
+from ellaschedule.utils import format_exceptions
+
+class Command(BaseCommand):
+    args = "<file.ics>"
+    help = "Import events from a (large) iCalendar file into a calendar"
+    option_list = BaseCommand.option_list + (
+        make_option('--calendar', dest='calendar', default=None,
+            help='Slug of the calendar to import into. It is created if it does not exist.'),
+        make_option('--chunk-size', dest='chunk_size', type='int', default=500,
+            help='Number of events saved in one transaction.'),
+        make_option('--relate', dest='relate', default=None,
+            help='Relate imported events to an object, given as app_label.model:pk.'),
+        make_option('--distinction', dest='distinction', default=None,
+            help='Distinction of the relations created by --relate.'),
+    )
+
+    def handle(self, *args, **options):
+        from django.contrib.contenttypes.models import ContentType
+        from django.core.exceptions import ObjectDoesNotExist
+        from ellaschedule.models import Calendar, Rule
+        from ellaschedule.signals import get_default_category, disable_default_calendar, \
+            enable_default_calendar, disable_indexing, enable_indexing
+
+        self.stdout = options.get('stdout', sys.stdout)
+        self.verbosity = int(options.get('verbosity', 1))
+        if len(args) != 1:
+            raise CommandError("Usage: import_ical %s" % self.args)
+        if not options['calendar']:
+            raise CommandError("--calendar is required")
+
+        try:
+            self.calendar = Calendar.objects.get(slug=options['calendar'])
+        except Calendar.DoesNotExist:
+            self.calendar = Calendar(name=options['calendar'],
+                slug=slugify(options['calendar']), category=get_default_category())
+            self.calendar.save()
+
+        self.relation = None
+        if options['relate']:
+            try:
+                model, object_id = options['relate'].split(':')
+                app_label, model = model.split('.')
+                ct = ContentType.objects.get(app_label=app_label, model=model.lower())
+                self.relation = (ct.get_object_for_this_type(pk=int(object_id)),
+                    options['distinction'])
+            except (ValueError, ObjectDoesNotExist):
+                raise CommandError("--relate must be app_label.model:pk of an existing model")
+
+        # existing rules, keyed on their frequency and normalized params, so
+        # that every distinct RRULE ends up as one Rule row
+        self.rules = {}
+        for rule in Rule.objects.all():
+            self.rules.setdefault(rule_key(rule.frequency, rule.get_params()), rule)
+
+        # uid -> (event id, duration, content) of imported events, needed to
+        # attach overrides (RECURRENCE-ID) which may come before or after
+        # their event
+        self.imported = {}
+        self.pending_overrides = {}
+        self.counts = {'events': 0, 'overrides': 0, 'skipped': 0, 'rules': 0}
+
+        chunk_size = options['chunk_size']
+        started = time.time()
+        chunk = []
+        ics = open(args[0])
+        # every imported event has its calendar, and the journal, the
+        # calendar version and the visibility index are updated once per
+        # chunk; imported events have no parent, the place occupancy index
+        # is left alone
+        disable_default_calendar()
+        disable_indexing()
+        try:
+            for component in iter_vevents(ics):
+                chunk.append(component)
+                if len(chunk) >= chunk_size:
+                    self.import_chunk(chunk)
+                    chunk = []
+                    self.report(started)
+            if chunk:
+                self.import_chunk(chunk)
+        finally:
+            enable_indexing()
+            enable_default_calendar()
+            ics.close()
+
+        if self.verbosity > 0:
+            elapsed = time.time() - started
+            unresolved = sum([len(overrides) for overrides in self.pending_overrides.values()])
+            self.stdout.write("Imported %(events)d events (%(rules)d new rules) and %(overrides)d overrides, skipped %(skipped)d.\n" % self.counts)
+            if unresolved:
+                self.stdout.write("%d overrides refer to events which are not in the file.\n" % unresolved)
+            self.stdout.write("Took %.1fs, %.1f events/s.\n" % (elapsed,
+                self.counts['events'] / max(elapsed, 0.001)))
+
+    def report(self, started):
+        if self.verbosity > 1:
+            elapsed = time.time() - started
+            self.stdout.write("%d events imported, %.1f events/s ...\n" % (
+                self.counts['events'], self.counts['events'] / max(elapsed, 0.001)))
+
+    def import_chunk(self, components):
+        from ellaschedule.models import Event, EventRelation
+
+        self.batch = {'created': [], 'changed': set(), 'occurrences': []}
+        related = []
+        for component in components:
+            uid = get_value(component, 'uid')
+            if get_value(component, 'recurrence_id') is not None:
+                self.pending_overrides.setdefault(uid, []).append(component)
+                continue
+
+            start, end = get_span(component)
+            if start is None:
+                self.counts['skipped'] += 1
+                continue
+            try:
+                rule, end_recurring_period = self.get_rule(component)
+            except ValueError:
+                self.counts['skipped'] += 1
+                continue
+
+            title = get_value(component, 'summary') or u''
+            event = Event(
+                title = title[:255],
+                slug = slugify(title)[:255] or u'event',
+                description = get_value(component, 'description') or u'',
+                place = get_value(component, 'location'),
+                start = start,
+                end = end,
+                rule = rule,
+                end_recurring_period = end_recurring_period,
+                calendar = self.calendar,
+                category = self.calendar.category,
+            )
+            # cancelled occurrences are stored like the ones cancelled on the site
+            exdates = get_exdates(component)
+            event.exceptions = format_exceptions(dict([(exdate, None) for exdate in exdates]))
+            event.save()
+            self.counts['events'] += 1
+            self.counts['overrides'] += len(exdates)
+            self.batch['created'].append(event.id)
+            if uid is not None:
+                self.imported[uid] = (event.id, end - start, get_content(component))
+
+            if self.relation is not None:
+                related.append(event.id)
+
+        if related:
+            obj, distinction = self.relation
+            EventRelation.objects.relate(related, [obj], distinction)
+        self.import_overrides([uid for uid in self.pending_overrides if uid in self.imported])
+        self.index_batch()
+    import_chunk = transaction.commit_on_success(import_chunk)
+
+    def import_overrides(self, uids):
+        from ellaschedule.models import Event, Occurrence
+
+        for uid in uids:
+            if uid not in self.imported:
+                continue
+            event_id, duration, content = self.imported[uid]
+            moves = []
+            for override in self.pending_overrides.pop(uid):
+                original_start = to_datetime(get_value(override, 'recurrence_id'))
+                start, end = get_span(override)
+                # the parts an override leaves out are the ones of its event
+                override_content = tuple([value or default for value, default in
+                    zip(get_content(override), content)])
+                if override_content == content:
+                    # only the time changed, stored like the occurrences
+                    # moved on the site
+                    moves.append((original_start, start, end))
+                    continue
+                title = override_content[0][:255]
+                occurrence = Occurrence(
+                    event_id = event_id,
+                    title = title,
+                    slug = slugify(title)[:255] or u'occurrence',
+                    category = self.calendar.category,
+                    start = start,
+                    end = end,
+                    original_start = original_start,
+                    original_end = original_start + duration,
+                )
+                occurrence.save()
+                self.batch['occurrences'].append(occurrence.id)
+                self.counts['overrides'] += 1
+            if moves:
+                event = Event.objects.get(pk=event_id)
+                for original_start, start, end in moves:
+                    event.add_exception(original_start, start, end)
+                event.save()
+                self.batch['changed'].add(event_id)
+                self.counts['overrides'] += len(moves)
+
+    def index_batch(self):
+        """
+        Does what the signals do for each saved event and occurrence, once
+        for the chunk.
+        """
+        from ellaschedule.cache import bump_version
+        from ellaschedule.models import JournalEntry, EventVisibility
+
+        created, occurrences = self.batch['created'], self.batch['occurrences']
+        changed = list(self.batch['changed'] - set(created))
+        EventVisibility.objects.index_events(created)
+        JournalEntry.objects.record_many('event', created, self.calendar.pk, 'created')
+        JournalEntry.objects.record_many('event', changed, self.calendar.pk, 'changed')
+        JournalEntry.objects.record_many('occurrence', occurrences, self.calendar.pk, 'created')
+        if created or changed or occurrences:
+            bump_version(self.calendar.pk)
+
+    def get_rule(self, component):
+        """
+        Returns the (deduplicated) Rule and end_recurring_period for the
+        component's RRULE. Raises ValueError for RRULEs Rule cannot express.
+        """
+        from ellaschedule.models import Rule
+
+        value = get_value(component, 'rrule')
+        if value is None:
+            return None, None
+        frequency, params, until = parse_rrule(value)
+        key = rule_key(frequency, params)
+        if key not in self.rules:
+            rule = Rule(
+                name = value[:32],
+                description = value,
+                frequency = frequency,
+                params = format_params(params) or None,
+            )
+            rule.save()
+            self.rules[key] = rule
+            self.counts['rules'] += 1
+        return self.rules[key], until
+
+
+def iter_vevents(lines):
+    """
+    Yields VEVENT components of an iCalendar stream one by one, so that
+    memory use does not depend on the size of the file. Time zones defined in
+    the stream are registered before the events that use them are parsed.
+    """
+    import vobject
+
+    block = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if block is None:
+            if line in ('BEGIN:VEVENT', 'BEGIN:VTIMEZONE'):
+                block = [line]
+            continue
+        block.append(line)
+        if line == 'END:VTIMEZONE':
+            timezone = vobject.readOne('\r\n'.join(['BEGIN:VCALENDAR'] + block + ['END:VCALENDAR'])).vtimezone
+            vobject.icalendar.registerTzid(timezone.tzid.value, timezone.gettzinfo())
+            block = None
+        elif line == 'END:VEVENT':
+            yield vobject.readOne('\r\n'.join(block))
+            block = None
+
+def get_value(component, name):
+    if not hasattr(component, name):
+        return None
+    return getattr(component, name).value
+
+def to_datetime(value):
+    """
+    Converts iCalendar date or datetime values to the naive local datetimes
+    used throughout the schedule.
+    """
+    from dateutil import tz
+
+    if not isinstance(value, datetime.datetime):
+        return datetime.datetime.combine(value, datetime.time.min)
+    if value.tzinfo is not None:
+        value = value.astimezone(tz.tzlocal()).replace(tzinfo=None)
+    return value
+
+def get_span(component):
+    start = get_value(component, 'dtstart')
+    if start is None:
+        return None, None
+    end = get_value(component, 'dtend')
+    if end is None:
+        duration = get_value(component, 'duration')
+        if duration is not None:
+            end = start + duration
+        elif isinstance(start, datetime.datetime):
+            end = start
+        else:
+            end = start + datetime.timedelta(days=1)
+    return to_datetime(start), to_datetime(end)
+
+def get_content(component):
+    """
+    Returns the summary, description and location of a component, empty if
+    they are not given.
+    """
+    return tuple([get_value(component, name) or u''
+        for name in ('summary', 'description', 'location')])
+
+def get_exdates(component):
+    exdates = []
+    for exdate in getattr(component, 'exdate_list', []):
+        exdates.extend([to_datetime(value) for value in exdate.value])
+    return exdates
+
+def parse_rrule(value):
+    """
+    Splits an RRULE value into frequency, Rule params and UNTIL.
+
+    >>> frequency, params, until = parse_rrule('FREQ=MONTHLY;BYDAY=1MO,-1FR;UNTIL=20090101T000000')
+    >>> frequency, sorted(params.items()), until
+    ('MONTHLY', [('byweekday', [MO(+1), FR(-1)])], datetime.datetime(2009, 1, 1, 0, 0))
+    """
+    from dateutil import parser, rrule
+    from ellaschedule.models.rules import ICAL_PARAMS, ICAL_WEEKDAYS, freqs
+
+    names = dict([(ical, param) for param, ical in ICAL_PARAMS.items()])
+    parts = dict([part.split('=', 1) for part in value.upper().split(';') if '=' in part])
+    frequency = parts.pop('FREQ', None)
+    if frequency not in [freq for freq, name in freqs]:
+        raise ValueError("Unsupported FREQ %s" % frequency)
+    until = parts.pop('UNTIL', None)
+    if until is not None:
+        until = to_datetime(parser.parse(until))
+
+    params = {}
+    for name, values in parts.items():
+        if name not in names:
+            raise ValueError("Unsupported RRULE part %s" % name)
+        param = names[name]
+        values = values.split(',')
+        if param in ('byweekday', 'wkst'):
+            days = []
+            for day in values:
+                if day[-2:] not in ICAL_WEEKDAYS:
+                    raise ValueError("Unsupported %s %s" % (name, day))
+                weekday, position = ICAL_WEEKDAYS.index(day[-2:]), day[:-2]
+                if position:
+                    # a positional day, e.g. 1MO or -1FR, is rrule's MO(+1) or FR(-1)
+                    if param == 'wkst':
+                        raise ValueError("Unsupported WKST %s" % day)
+                    weekday = rrule.weekday(weekday, int(position))
+                days.append(weekday)
+            values = days
+        else:
+            values = [int(v) for v in values]
+        if len(values) == 1:
+            values = values[0]
+        params[param] = values
+    return frequency, params, until
+
+def format_params(params):
+    """
+    Formats params the way Rule.params stores them.
+    """
+    formatted = []
+    for param in sorted(params):
+        values = params[param]
+        if not isinstance(values, list):
+            values = [values]
+        formatted.append('%s:%s' % (param, ','.join([str(v) for v in values])))
+    return ';'.join(formatted)
+
+def rule_key(frequency, params):
+    return (frequency, format_params(params))
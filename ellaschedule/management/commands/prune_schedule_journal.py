@@ -0,0 +1,27 @@
+import datetime
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+class Command(NoArgsCommand):
+    help = "Compact the schedule change journal and prune old entries"
+    option_list = NoArgsCommand.option_list + (
+        make_option('--days', dest='days', type='int', default=30,
+            help='Remove entries older than this many days. Clients which did not sync since then get a full resync.'),
+        make_option('--compact-only', action='store_true', dest='compact_only', default=False,
+            help='Only remove superseded entries, do not prune.'),
+    )
+
+    def handle_noargs(self, **options):
+        from ellaschedule.models import JournalEntry
+
+        print "Compacting the journal ..."
+        removed = JournalEntry.objects.compact()
+        print "%d superseded entries removed." % removed
+
+        if options['compact_only']:
+            return
+        before = datetime.datetime.now() - datetime.timedelta(days=options['days'])
+        print "Pruning entries older than %s ..." % before
+        removed = JournalEntry.objects.prune(before)
+        print "%d entries pruned." % removed
@@ -0,0 +1,10 @@
+from django.core.management.base import NoArgsCommand
+
+class Command(NoArgsCommand):
+    help = "Rebuild the index of the objects related to events used by get_events_for_object"
+
+    def handle_noargs(self, **options):
+        from ellaschedule.models import EventVisibility
+
+        EventVisibility.objects.rebuild()
+        print "%d event visibility rows." % EventVisibility.objects.count()
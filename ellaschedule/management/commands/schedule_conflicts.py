@@ -0,0 +1,47 @@
+import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+class Command(BaseCommand):
+    args = "[calendar_slug ...]"
+    help = "List overlapping occurrences within calendars or at the same place"
+    option_list = BaseCommand.option_list + (
+        make_option('--start', dest='start', default=None,
+            help='Start of the checked period as YYYY-MM-DD, today by default.'),
+        make_option('--days', dest='days', type='int', default=90,
+            help='Length of the checked period in days.'),
+        make_option('--by', dest='by', default='calendar,place',
+            help='Comma separated kinds of conflicts to report: calendar, place.'),
+    )
+
+    def handle(self, *args, **options):
+        from ellaschedule.conflicts import find_conflicts
+        from ellaschedule.models import Calendar
+        from ellaschedule.utils import parse_datetime
+
+        try:
+            if options['start']:
+                start = parse_datetime(options['start'])
+            else:
+                start = datetime.datetime.combine(datetime.date.today(), datetime.time.min)
+        except ValueError, e:
+            raise CommandError(str(e))
+        end = start + datetime.timedelta(days=options['days'])
+        by = [kind.strip() for kind in options['by'].split(',')]
+        if [kind for kind in by if kind not in ('calendar', 'place')]:
+            raise CommandError("--by takes calendar and/or place")
+
+        calendars = Calendar.objects.all()
+        if args:
+            calendars = calendars.filter(slug__in=args)
+        names = dict(calendars.values_list('id', 'name'))
+
+        conflicts = find_conflicts(calendars, start, end, by)
+        for kind, key, span, other in conflicts:
+            if kind == 'calendar':
+                key = names.get(key, key)
+            print (u"%s %s: %s (%s - %s) / %s (%s - %s)" % (kind, key,
+                span[2].title, span[0], span[1],
+                other[2].title, other[0], other[1])).encode('utf-8')
+        print "%d conflicts between %s and %s." % (len(conflicts), start, end)
@@ -1,5 +1,8 @@
 from ellaschedule.models.calendars import *
 from ellaschedule.models.events import *
 from ellaschedule.models.rules import *
+from ellaschedule.models.journal import *
+from ellaschedule.models.occupancy import *
+from ellaschedule.models.visibility import *
 
 from ellaschedule.signals import *
@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 import datetime
+import operator
 
 from django.contrib.contenttypes import generic
-from django.db import models
+from django.db import models, connection, transaction
 from django.db.models import Q
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
@@ -14,6 +15,7 @@ from dateutil import rrule
 
 from ella.core.models import Publishable
 
+from ellaschedule.cache import bump_object_version, bump_relations_version
 from ellaschedule.utils import EventListManager
 
 class CalendarManager(models.Manager):
@@ -60,7 +62,14 @@ class CalendarManager(models.Manager):
         ...
         failed
         """
-        calendar_list = self.get_calendars_for_object(obj, distinction)
+        return self.get_single_calendar(self.get_calendars_for_object(obj, distinction))
+
+    def get_single_calendar(self, calendar_list):
+        """
+        Returns the only calendar of ``calendar_list``, raising like
+        get_calendar_for_object if there is none or more than one.
+        """
+        calendar_list = list(calendar_list)
         if len(calendar_list) == 0:
             raise Calendar.DoesNotExist, "Calendar does not exist."
         elif len(calendar_list) > 1:
@@ -102,6 +111,40 @@ class CalendarManager(models.Manager):
             dist_q = Q()
         return self.filter(dist_q, Q(calendarrelation__object_id=obj.id, calendarrelation__content_type=ct))
 
+    def get_calendars_for_objects(self, objs, distinction = None):
+        """
+        The bulk version of get_calendars_for_object: returns {obj: [calendars]}
+        for all of ``objs`` with one query, an empty list for the objects
+        without a calendar.  Use it instead of get_calendar_for_object in
+        loops, e.g. over the users of a page.
+        """
+        objs = list(objs)
+        calendars = dict([(obj, []) for obj in objs])
+        object_ids = get_object_ids(objs)
+        if not object_ids:
+            return calendars
+        keys = {}
+        for obj in objs:
+            keys[(ContentType.objects.get_for_model(type(obj)).id, obj.id)] = obj
+        relations = CalendarRelation.objects.filter(reduce(operator.or_,
+            [Q(content_type=ct_id, object_id__in=ids) for ct_id, ids in object_ids.items()]))
+        if distinction:
+            relations = relations.filter(distinction=distinction)
+        for relation in relations.select_related('calendar'):
+            calendars[keys[(relation.content_type_id, relation.object_id)]].append(relation.calendar)
+        return calendars
+
+    def free_busy(self, calendars, start, end):
+        """
+        Returns the times between start and end when any of ``calendars`` (a
+        list or queryset of calendars or their ids) has an occurrence, as a
+        sorted list of disjoint (start, end) tuples.  Cancelled occurrences
+        are free.  Use ellaschedule.freebusy.get_vfreebusy to render the
+        result as an iCalendar VFREEBUSY.
+        """
+        from ellaschedule.freebusy import get_busy_spans, merge_spans
+        return merge_spans(get_busy_spans(calendars, start, end), start, end)
+
 class Calendar(Publishable):
     '''
     This is for grouping events so that batch relations can be made to all
@@ -184,7 +227,201 @@ class Calendar(Publishable):
         return reverse('s_create_event_in_calendar', args=[self.slug])
 
 
-class CalendarRelationManager(models.Manager):
+def get_object_ids(objects):
+    """
+    Groups model instances by their ContentType, returning {content type id:
+    [object ids]}.  ContentTypes are cached, so this costs at most one query
+    per model.
+    """
+    ids = {}
+    for obj in objects:
+        ct = ContentType.objects.get_for_model(type(obj))
+        ids.setdefault(ct.id, []).append(obj.id)
+    return ids
+
+def prefetch_content_objects(relations, field='content_object'):
+    """
+    Resolves the generic foreign key ``field`` of ``relations`` (model
+    instances, e.g. a queryset of CalendarRelations) with one in_bulk query
+    per content type instead of a query per relation, and returns them as a
+    list.  Relations whose object no longer exists resolve to None.
+    """
+    relations = list(relations)
+    if not relations:
+        return relations
+    generic_key = getattr(type(relations[0]), field)
+    ct_attname = relations[0]._meta.get_field(generic_key.ct_field).attname
+    ids = {}
+    for relation in relations:
+        ids.setdefault(getattr(relation, ct_attname), set()).add(
+            getattr(relation, generic_key.fk_field))
+    objects = {}
+    for ct_id, object_ids in ids.items():
+        model = ContentType.objects.get_for_id(ct_id).model_class()
+        if model is not None:
+            objects[ct_id] = model._default_manager.in_bulk(list(object_ids))
+    for relation in relations:
+        setattr(relation, generic_key.cache_attr, objects.get(
+            getattr(relation, ct_attname), {}).get(getattr(relation, generic_key.fk_field)))
+    return relations
+
+class RelationManager(models.Manager):
+    """
+    Bulk operations shared by CalendarRelationManager and
+    EventRelationManager.  Each runs a constant number of queries per model
+    of the related objects, however many relations it touches, and keeps the
+    EventVisibility index up to date.
+    """
+    # set by the subclasses: the foreign key to the calendar or the event,
+    # and the one of EventVisibility to the relation
+    target_field = None
+    visibility_field = None
+
+    def _reindex(self, target_ids, ct_id, object_ids, distinction):
+        # the relations between target_ids and object_ids: the new ones and
+        # the ones they duplicate, not all the relations of the targets
+        from ellaschedule.models.visibility import EventVisibility
+
+        qn = connection.ops.quote_name
+        where = 'r.%s IN (%s) AND r.%s = %%s AND r.%s IN (%s)' % (
+            qn(self.target_field + '_id'), ', '.join(['%s'] * len(target_ids)),
+            qn('content_type_id'), qn('object_id'), ', '.join(['%s'] * len(object_ids)))
+        params = target_ids + [ct_id] + object_ids
+        if distinction is None:
+            where += ' AND r.%s IS NULL' % qn('distinction')
+        else:
+            where += ' AND r.%s = %%s' % qn('distinction')
+            params.append(distinction)
+        EventVisibility.objects.index_relations(self.visibility_field, where, params)
+
+    def _relate(self, targets, objects, distinction, ignore_conflicts, values=None):
+        # values: {field name: value} of the other columns of the new rows
+        values = values or {}
+        names = values.keys()
+        target_ids = [getattr(target, 'pk', target) for target in targets]
+        if not target_ids:
+            return 0
+        rows = []
+        for ct_id, object_ids in get_object_ids(objects).items():
+            existing = set()
+            if ignore_conflicts:
+                existing = set(self.filter(**{
+                    '%s__in' % self.target_field: target_ids,
+                    'content_type': ct_id,
+                    'distinction': distinction,
+                }).values_list(self.target_field, 'object_id'))
+            for target_id in target_ids:
+                for object_id in object_ids:
+                    if (target_id, object_id) in existing:
+                        continue
+                    if ignore_conflicts:
+                        existing.add((target_id, object_id))
+                    rows.append((target_id, ct_id, object_id, distinction) +
+                        tuple([values[name] for name in names]))
+        if rows:
+            qn = connection.ops.quote_name
+            columns = [self.target_field + '_id', 'content_type_id', 'object_id',
+                'distinction'] + [self.model._meta.get_field(name).column for name in names]
+            cursor = connection.cursor()
+            cursor.executemany('INSERT INTO %s (%s) VALUES (%s)' % (
+                qn(self.model._meta.db_table), ', '.join([qn(column) for column in columns]),
+                ', '.join(['%s'] * len(columns))), rows)
+            transaction.commit_unless_managed()
+            related = {}
+            for row in rows:
+                related.setdefault(row[1], set()).add(row[2])
+            for ct_id, object_ids in related.items():
+                self._reindex(target_ids, ct_id, list(object_ids), distinction)
+                for object_id in object_ids:
+                    bump_object_version(ct_id, object_id)
+        return len(rows)
+
+    def copy_relations(self, source, target):
+        """
+        Copies all the relations of ``source`` to ``target`` (calendars or
+        events, or their ids) with one INSERT ... SELECT and reindexes the
+        copies at once, e.g. when a series is split.  Returns the number of
+        copied relations.  No signals are sent.
+        """
+        from ellaschedule.models.visibility import EventVisibility
+
+        source_id, target_id = getattr(source, 'pk', source), getattr(target, 'pk', target)
+        target_column = self.target_field + '_id'
+        columns = [field.column for field in self.model._meta.local_fields
+            if not field.primary_key and field.column != target_column]
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        cursor = connection.cursor()
+        cursor.execute('INSERT INTO %s (%s, %s) SELECT %%s, %s FROM %s WHERE %s = %%s' % (
+            table, qn(target_column), ', '.join([qn(column) for column in columns]),
+            ', '.join([qn(column) for column in columns]), table, qn(target_column)),
+            [target_id, source_id])
+        count = cursor.rowcount
+        transaction.commit_unless_managed()
+        if count:
+            EventVisibility.objects.index_relations(self.visibility_field,
+                'r.%s = %%s' % qn(target_column), [target_id])
+            related = self.filter(**{self.target_field: target_id}).values_list(
+                'content_type', 'object_id').distinct()
+            for ct_id, object_id in related:
+                bump_object_version(ct_id, object_id)
+        return count
+
+    def remove_relations(self, targets, objects, distinction=None):
+        """
+        Deletes the relations between ``targets`` (calendars or events, or
+        their ids) and ``objects``, only the ones with ``distinction`` if it
+        is given, without loading them.  Returns the number of deleted
+        relations.
+        """
+        from ellaschedule.models.visibility import EventVisibility
+
+        target_ids = [getattr(target, 'pk', target) for target in targets]
+        if not target_ids:
+            return 0
+        qn = connection.ops.quote_name
+        cursor = connection.cursor()
+        count = 0
+        for ct_id, object_ids in get_object_ids(objects).items():
+            where = '%s IN (%s) AND %s = %%s AND %s IN (%s)' % (
+                qn(self.target_field + '_id'), ', '.join(['%s'] * len(target_ids)),
+                qn('content_type_id'), qn('object_id'), ', '.join(['%s'] * len(object_ids)))
+            params = target_ids + [ct_id] + object_ids
+            if distinction:
+                where += ' AND %s = %%s' % qn('distinction')
+                params.append(distinction)
+            # the index rows first, they reference the relations
+            cursor.execute('DELETE FROM %s WHERE %s IN (SELECT %s FROM %s WHERE %s)' % (
+                qn(EventVisibility._meta.db_table), qn(self.visibility_field + '_id'),
+                qn('id'), qn(self.model._meta.db_table), where), params)
+            cursor.execute('DELETE FROM %s WHERE %s' % (qn(self.model._meta.db_table), where),
+                params)
+            count += cursor.rowcount
+            for object_id in object_ids:
+                bump_object_version(ct_id, object_id)
+        transaction.commit_unless_managed()
+        return count
+
+    def change_distinction(self, distinction, new_distinction):
+        '''
+        This function is for change the a group of relations from an old
+        distinction to a new one. It should only be used for managerial stuff.
+        It runs two updates, whatever the number of relations.
+        '''
+        from ellaschedule.models.visibility import EventVisibility
+
+        EventVisibility.objects.filter(**{
+            '%s__isnull' % self.visibility_field: False,
+            'distinction': distinction,
+        }).update(distinction=new_distinction)
+        count = self.filter(distinction=distinction).update(distinction=new_distinction)
+        bump_relations_version()
+        return count
+
+class CalendarRelationManager(RelationManager):
+    target_field = 'calendar'
+    visibility_field = 'calendar_relation'
+
     def create_relation(self, calendar, content_object, distinction=None, inheritable=True):
         """
         Creates a relation between calendar and content_object.
@@ -197,11 +434,23 @@ class CalendarRelationManager(models.Manager):
             object_id = object_id,
             calendar = calendar,
             distinction = distinction,
+            inheritable = inheritable,
             content_object = content_object
         )
         cr.save()
         return cr
 
+    def relate(self, calendars, objects, distinction=None, inheritable=True, ignore_conflicts=False):
+        """
+        Relates every one of ``objects`` to every one of ``calendars`` (or
+        their ids) with one insert, e.g. when attaching thousands of users
+        to calendars.  With ignore_conflicts, relations which already exist
+        with the same distinction are skipped.  Returns the number of
+        created relations.  No signals are sent.
+        """
+        return self._relate(calendars, objects, distinction, ignore_conflicts,
+            {'inheritable': inheritable})
+
 class CalendarRelation(models.Model):
     '''
     This is for relating data to a Calendar, and possible all of the events for
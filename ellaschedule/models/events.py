@@ -2,11 +2,10 @@
 import datetime
 
 from django.contrib.contenttypes import generic
-from django.db import models
-from django.db.models import Q
+from django.db import models, transaction
+from django.db.models import Q, F
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
-from django.core.urlresolvers import reverse
 from django.template.defaultfilters import date
 from django.utils.translation import ugettext, ugettext_lazy as _
 
@@ -14,19 +13,73 @@ from dateutil import rrule
 
 from ella.core.models import Publishable
 
+from ellaschedule.cache import bump_version
 from ellaschedule.models.rules import Rule
-from ellaschedule.models.calendars import Calendar
-from ellaschedule.utils import OccurrenceReplacer
+from ellaschedule.models.calendars import Calendar, RelationManager
+from ellaschedule.urltemplates import url_template, date_values, DATE_PARAMS
+from ellaschedule.utils import OccurrenceReplacer, EventListManager, expand_occurrences, \
+    parse_exceptions, format_exceptions
+
+# The columns calendar views need.  The other ones, e.g. the description and
+# the rest of Publishable, are deferred and loaded if something touches them.
+SLIM_EVENT_FIELDS = ('title', 'start', 'end', 'rule', 'end_recurring_period',
+    'calendar', 'place', 'exceptions')
+SLIM_OCCURRENCE_FIELDS = ('title', 'event', 'start', 'end', 'cancelled',
+    'original_start', 'original_end')
+
+def _occurrences_updated(event, occurrence_ids):
+    # queryset updates send no signals, the journal, data cached under the
+    # version of the calendar and the place occupancy index are updated by
+    # hand for the occurrences of event with occurrence_ids
+    from ellaschedule.models.journal import JournalEntry
+    from ellaschedule.models.occupancy import PlaceOccupancy
+    if not occurrence_ids:
+        return
+    if event.calendar_id is not None:
+        JournalEntry.objects.record_many('occurrence', occurrence_ids,
+            event.calendar_id, 'changed')
+        bump_version(event.calendar_id)
+    if event.parent_event_id is not None:
+        PlaceOccupancy.objects.rebuild(event.parent_event)
 
 class EventManager(models.Manager):
 
-    def get_for_object(self, content_object, distinction=None, inherit=True):
-        return EventRelation.objects.get_events_for_object(content_object, distinction, inherit)
+    def slim(self, *fields):
+        """
+        Returns the events with only SLIM_EVENT_FIELDS and ``fields``
+        loaded, for rendering calendars.
+        """
+        return self.only(*(SLIM_EVENT_FIELDS + fields))
+
+    def get_for_object(self, content_object, distinction=None, inherit=True, start=None, end=None):
+        return EventRelation.objects.get_events_for_object(content_object, distinction, inherit,
+            start, end)
+
+    def in_window(self, start, end):
+        """
+        Returns the events which may have occurrences between start and
+        end: one time events in the window, recurring events which started
+        before its end and events with an occurrence moved into it, whether
+        persisted or in their exceptions.
+        """
+        return self.filter(
+            Q(rule__isnull=True, start__lt=end, end__gt=start) |
+            Q(rule__isnull=False, start__lt=end) |
+            Q(moved_start__lt=end, moved_end__gte=start) |
+            Q(occurrence__start__lt=end, occurrence__end__gt=start)
+        ).distinct()
 
 class Event(Publishable):
     '''
     This model stores meta data for a date.  You can relate this data to many
     other models.
+
+    exceptions: the cancelled and moved generated occurrences which have no
+    content of their own, see get_exceptions.  They do not need a full
+    Occurrence row.
+
+    moved_start, moved_end: the span of the occurrences moved by the
+    exceptions, kept on save for EventManager.in_window.
     '''
     start = models.DateTimeField(_("start"), null=True, blank=True)
     end = models.DateTimeField(_("end"), null=True, blank=True, help_text=_("The end time must be later than the start time."))
@@ -37,6 +90,9 @@ class Event(Publishable):
     calendar = models.ForeignKey(Calendar, blank=True)
     parent_event = models.ForeignKey('self', null=True, blank=True)
     place = models.CharField(_("place"), max_length=255, null=True, blank=True, help_text=_("Where is this event occurring"))
+    exceptions = models.TextField(_("exceptions"), blank=True, default='', editable=False)
+    moved_start = models.DateTimeField(_("moved start"), null=True, editable=False)
+    moved_end = models.DateTimeField(_("moved end"), null=True, editable=False)
     objects = EventManager()
 
     class Meta:
@@ -52,8 +108,17 @@ class Event(Publishable):
             'end': date(self.end, date_format),
         }
 
+    def save(self, *args, **kwargs):
+        spans = [span for span in self.get_exceptions().values() if span is not None]
+        if spans:
+            self.moved_start = min([span[0] for span in spans])
+            self.moved_end = max([span[1] for span in spans])
+        else:
+            self.moved_start = self.moved_end = None
+        super(Event, self).save(*args, **kwargs)
+
     def get_absolute_url(self):
-        return reverse('event', args=[self.id])
+        return url_template('event', 'event_id')(event_id=self.id)
 
     def create_relation(self, obj, distinction = None):
         """
@@ -80,30 +145,102 @@ class Event(Publishable):
         []
 
         """
-        persisted_occurrences = self.occurrence_set.all()
-        occ_replacer = OccurrenceReplacer(persisted_occurrences)
-        occurrences = self._get_occurrence_list(start, end)
-        final_occurrences = []
-        for occ in occurrences:
-            # replace occurrences with their persisted counterparts
-            if occ_replacer.has_occurrence(occ):
-                p_occ = occ_replacer.get_occurrence(
-                        occ)
-                # ...but only if they are within this period
-                if p_occ.start < end and p_occ.end >= start:
-                    final_occurrences.append(p_occ)
-            else:
-              final_occurrences.append(occ)
-        # then add persisted occurrences which originated outside of this period but now
-        # fall within it
-        final_occurrences += occ_replacer.get_additional_occurrences(start, end)
-        return final_occurrences
+        return [occurrence or self._create_occurrence(o_start, o_end)
+            for o_start, o_end, event, occurrence in
+            expand_occurrences([self], start, end, self.occurrence_set.all())]
 
-    def get_rrule_object(self):
+    def get_rrule_object(self, after=None):
+        """
+        If ``after`` is given the returned rrule may start later than the
+        event, but it still produces every occurrence starting at or after
+        ``after``, so that expanding far from the start of a long series
+        does not iterate over all the occurrences before (see
+        Rule.fast_forward).
+        """
         if self.rule is not None:
-            params = self.rule.get_params()
+            if after is None:
+                dtstart, params = self.start, self.rule.get_params()
+            else:
+                dtstart, params = self.rule.fast_forward(self.start, after)
             frequency = 'rrule.%s' % self.rule.frequency
-            return rrule.rrule(eval(frequency), dtstart=self.start, **params)
+            return rrule.rrule(eval(frequency), dtstart=dtstart, **params)
+
+    def get_ical_rrule(self):
+        """
+        Returns the value of the iCalendar RRULE property for this event or
+        None for one time only events.  The end_recurring_period becomes the
+        UNTIL part, unless the rule's count ends the series first.
+        """
+        if self.rule is None:
+            return None
+        until = self.end_recurring_period
+        if until is not None and 'count' in self.rule.get_params():
+            last = list(self.get_rrule_object())[-1:]
+            if last and last[0] <= until:
+                until = None
+        return self.rule.get_ical_rrule(until)
+
+    def get_exceptions(self):
+        """
+        Returns the exceptions of the event as a dict mapping the original
+        starts of generated occurrences to None if they are cancelled or to
+        their (start, end) if they are moved.  Expansion applies them the
+        way an rruleset applies EXDATEs, before persisted occurrences are
+        looked at.
+        """
+        cached = self.__dict__.get('_exceptions')
+        if cached is None or cached[0] != self.exceptions:
+            cached = self._exceptions = (self.exceptions, parse_exceptions(self.exceptions))
+        return cached[1]
+
+    def add_exception(self, original_start, start=None, end=None):
+        """
+        Cancels the generated occurrence which originally starts at
+        ``original_start``, or moves it to start-end if they are given.  The
+        event has to be saved afterwards.
+        """
+        exceptions = dict(self.get_exceptions())
+        if start is None:
+            exceptions[original_start] = None
+        else:
+            exceptions[original_start] = (start, end)
+        self.exceptions = format_exceptions(exceptions)
+
+    def remove_exception(self, original_start):
+        """
+        Restores the generated occurrence which originally starts at
+        ``original_start``.  The event has to be saved afterwards.
+        """
+        exceptions = dict(self.get_exceptions())
+        if exceptions.pop(original_start, False) is not False:
+            self.exceptions = format_exceptions(exceptions)
+
+    def _get_exception_occurrence(self, original_start, original_end):
+        """
+        Returns an unsaved Occurrence for a generated occurrence cancelled or
+        moved by the exceptions of the event, or None.
+        """
+        exceptions = self.get_exceptions()
+        if original_start not in exceptions:
+            return None
+        occurrence = self._create_occurrence(original_start, original_end)
+        if exceptions[original_start] is None:
+            occurrence.cancelled = True
+        else:
+            occurrence.start, occurrence.end = exceptions[original_start]
+        return occurrence
+
+    def _get_moved_exception_occurrences(self, start, end, originals=()):
+        """
+        Returns unsaved Occurrences for the generated occurrences moved
+        between start and end by the exceptions of the event, leaving out the
+        ones whose original start is in ``originals``.
+        """
+        difference = self.end - self.start
+        return [self._get_exception_occurrence(original, original + difference)
+            for original, span in sorted(self.get_exceptions().items())
+            if span is not None and span[0] < end and span[1] >= start and
+            original not in originals]
 
     def _create_occurrence(self, start, end=None):
         if end is None:
@@ -120,31 +257,63 @@ class Event(Publishable):
             try:
                 return Occurrence.objects.get(event = self, original_start = date)
             except Occurrence.DoesNotExist:
-                return self._create_occurrence(next_occurrence)
+                occurrence = self._create_occurrence(next_occurrence)
+                return self._get_exception_occurrence(occurrence.original_start,
+                    occurrence.original_end) or occurrence
 
 
     def _get_occurrence_list(self, start, end):
         """
         returns a list of occurrences for this event from start to end.
         """
+        return [self._create_occurrence(o_start, o_end) for o_start, o_end in
+            self._get_occurrence_spans(start, end)]
+
+    def _get_occurrence_spans(self, start, end):
+        """
+        returns a list of (start, end) tuples of the unpersisted occurrences
+        for this event from start to end, without creating Occurrence objects.
+        """
         difference = (self.end - self.start)
         if self.rule is not None:
-            occurrences = []
             if self.end_recurring_period and self.end_recurring_period < end:
                 end = self.end_recurring_period
-            rule = self.get_rrule_object()
-            o_starts = rule.between(start-difference, end, inc=True)
-            for o_start in o_starts:
-                o_end = o_start + difference
-                occurrences.append(self._create_occurrence(o_start, o_end))
-            return occurrences
+            rule = self.get_rrule_object(start-difference)
+            return [(o_start, o_start + difference) for o_start in
+                rule.between(start-difference, end, inc=True)]
         else:
             # check if event is in the period
             if self.start < end and self.end >= start:
-                return [self._create_occurrence(self.start)]
+                return [(self.start, self.end)]
             else:
                 return []
 
+    def _get_occurrence_spans_from(self, start):
+        """
+        returns a generator that produces (start, end) tuples of the
+        unpersisted occurrences for this event which start at or after
+        ``start``, in order.
+        """
+        rule = self.get_rrule_object(start)
+        if rule is None:
+            if self.start >= start:
+                yield self.start, self.end
+            return
+        difference = self.end - self.start
+        for o_start in rule:
+            if self.end_recurring_period and o_start > self.end_recurring_period:
+                return
+            if o_start >= start:
+                yield o_start, o_start + difference
+
+    def occurrence_page(self, after=None, cursor=None, limit=20, include_cancelled=False):
+        """
+        Returns a page of the occurrences of this event and the cursor for
+        the next one, see EventListManager.occurrence_page.
+        """
+        return EventListManager([self]).occurrence_page(after, cursor, limit,
+            include_cancelled)
+
     def _occurrences_after_generator(self, after=None):
         """
         returns a generator that produces unpresisted occurrences after the
@@ -156,7 +325,8 @@ class Event(Publishable):
         rule = self.get_rrule_object()
         if rule is None:
             if self.end > after:
-                yield self._create_occurrence(self.start, self.end)
+                yield self._get_exception_occurrence(self.start, self.end) or \
+                    self._create_occurrence(self.start, self.end)
             raise StopIteration
         date_iter = iter(rule)
         difference = self.end - self.start
@@ -166,7 +336,8 @@ class Event(Publishable):
                 raise StopIteration
             o_end = o_start + difference
             if o_end > after:
-                yield self._create_occurrence(o_start, o_end)
+                yield self._get_exception_occurrence(o_start, o_end) or \
+                    self._create_occurrence(o_start, o_end)
 
 
     def occurrences_after(self, after=None):
@@ -180,6 +351,139 @@ class Event(Publishable):
             next = generator.next()
             yield occ_replacer.get_occurrence(next)
 
+    def _get_range_overrides(self, start, end):
+        """
+        Returns the persisted occurrences which originally start between
+        start (inclusive) and end (exclusive) and the (start, end) spans of
+        the generated occurrences there which have none; their exceptions
+        are not looked at.
+        """
+        persisted = self.occurrence_set.filter(original_start__gte=start,
+            original_start__lt=end)
+        originals = set(persisted.values_list('original_start', flat=True))
+        spans = [(o_start, o_end) for o_start, o_end in
+            self._get_occurrence_spans(start, end)
+            if start <= o_start < end and o_start not in originals]
+        return persisted, spans
+
+    def cancel_range(self, start, end):
+        """
+        Cancels the occurrences of the event which originally start between
+        start (inclusive) and end (exclusive), e.g. a holiday week, and
+        returns their number.  The persisted occurrences are cancelled with
+        one query, the generated ones are stored in the exceptions of the
+        event with another one.
+        """
+        persisted, spans = self._get_range_overrides(start, end)
+        occurrence_ids = list(persisted.values_list('id', flat=True))
+        count = 0
+        if occurrence_ids:
+            count = persisted.update(cancelled=True)
+            _occurrences_updated(self, occurrence_ids)
+        if spans:
+            for o_start, o_end in spans:
+                self.add_exception(o_start)
+            self.save()
+        return count + len(spans)
+    cancel_range = transaction.commit_on_success(cancel_range)
+
+    def shift_range(self, start, end, delta):
+        """
+        Moves the occurrences of the event which originally start between
+        start (inclusive) and end (exclusive) by ``delta`` (a timedelta) and
+        returns the event they now belong to.
+
+        If end is None, every occurrence from start on is shifted: the
+        series is split at start (see split_series_at) and the new event is
+        moved, with a constant number of queries however long the series
+        is.  Otherwise the persisted occurrences are moved with one query
+        and the generated ones are stored in the exceptions of the event
+        with another one.
+        """
+        if end is None:
+            if self.rule is None:
+                end = self.end + datetime.timedelta(seconds=1)
+            else:
+                event = self.split_series_at(start)
+                if event is None:
+                    return self
+                event.start += delta
+                event.end += delta
+                if event.end_recurring_period is not None:
+                    event.end_recurring_period += delta
+                event.exceptions = format_exceptions(dict([(original + delta,
+                    span and (span[0] + delta, span[1] + delta))
+                    for original, span in event.get_exceptions().items()]))
+                event.save()
+                # the series moved with its occurrences, originals included
+                occurrence_ids = list(event.occurrence_set.values_list('id', flat=True))
+                if occurrence_ids:
+                    event.occurrence_set.update(start=F('start') + delta,
+                        end=F('end') + delta, original_start=F('original_start') + delta,
+                        original_end=F('original_end') + delta)
+                    _occurrences_updated(event, occurrence_ids)
+                return event
+        persisted, spans = self._get_range_overrides(start, end)
+        occurrence_ids = list(persisted.values_list('id', flat=True))
+        if occurrence_ids:
+            persisted.update(start=F('start') + delta, end=F('end') + delta)
+            _occurrences_updated(self, occurrence_ids)
+        if spans:
+            exceptions = self.get_exceptions()
+            for original, original_end in spans:
+                span = exceptions.get(original, (original, original_end))
+                # cancelled occurrences stay cancelled
+                if span is not None:
+                    self.add_exception(original, span[0] + delta, span[1] + delta)
+            self.save()
+        return self
+    shift_range = transaction.commit_on_success(shift_range)
+
+    def split_series_at(self, date):
+        """
+        Ends the series before ``date`` and returns a copy of the event which
+        continues it from its first occurrence at or after date, taking the
+        persisted occurrences and exceptions from there and the event
+        relations along.  If
+        the series starts at or after date, nothing is split and the event
+        itself is returned; if it ends before, None is returned.
+
+        Series limited by the count of their rule cannot be split.
+        """
+        if self.rule is None:
+            raise ValueError("only recurring events can be split")
+        if 'count' in self.rule.get_params():
+            raise ValueError("series limited by count cannot be split")
+        try:
+            o_start, o_end = self._get_occurrence_spans_from(date).next()
+        except StopIteration:
+            return None
+        if o_start == self.start:
+            return self
+
+        # a full copy, self may have deferred fields
+        event = Event.objects.get(pk=self.pk)
+        authors = list(event.authors.all())
+        event.pk = event.id = None
+        event.start, event.end = o_start, o_end
+        exceptions = self.get_exceptions()
+        event.exceptions = format_exceptions(dict([(original, span)
+            for original, span in exceptions.items() if original >= o_start]))
+        event.save()
+        event.authors = authors
+        self.end_recurring_period = o_start - datetime.timedelta(seconds=1)
+        self.exceptions = format_exceptions(dict([(original, span)
+            for original, span in exceptions.items() if original < o_start]))
+        self.save()
+        moved = self.occurrence_set.filter(original_start__gte=o_start)
+        occurrence_ids = list(moved.values_list('id', flat=True))
+        if occurrence_ids:
+            moved.update(event=event)
+            _occurrences_updated(event, occurrence_ids)
+        EventRelation.objects.copy_relations(self, event)
+        return event
+    split_series_at = transaction.commit_on_success(split_series_at)
+
     def get_user_authors(self):
         return [
             author.user for author in self.authors.all() if author.user
@@ -209,47 +513,29 @@ class Event(Publishable):
             }
         ]
         """
-        events = self.get_agenda()
+        from ellaschedule.models.occupancy import PlaceOccupancy
 
-        days = set([event.start.date() for event in events])
+        events_by_day = {}
+        for event in self.get_agenda():
+            events_by_day.setdefault(event.start.date(), []).append(event)
+        occupancy = PlaceOccupancy.objects.get_occupancy(self)
 
         agenda = []
-
-        #TODO: ugly spaghetti with ugly O(). Refactor, we have better sorts.
-        for day in days:
-            day_agenda = {
-                'date' : day
-            }
-            times = {}
-            start_times = set()
-            places = set()
-            for event in events:
-                if event.start.date() == day:
-                    places.add(event.place)
-                    if not event.start in times:
-                        times[event.start.time()] = []
-                    times[event.start.time()].append(event)
-                    start_times.add(event.start.time())
-
-            places = list(places)
-            start_times = list(start_times)
-            start_times.sort()
-
-            day_agenda['places'] = places
-            day_agenda['agenda'] = {}
-
-            for time in start_times:
-                day_agenda['agenda'][time] = []
-                for place in places:
-                    add = None
-                    for event in events:
-                        if event.start.date() == day and event.start.time() == time and event.place == place:
-                            add = event
-                    day_agenda['agenda'][time].append(add)
-            agenda.append(day_agenda)
+        for day in sorted(events_by_day):
+            # the places of the day come from the occupancy index
+            places = sorted(occupancy.get(day, {}))
+            cells = {}
+            for event in events_by_day[day]:
+                cells.setdefault(event.start.time(), {})[event.place or u''] = event
+            agenda.append({
+                'date' : day,
+                'places' : places,
+                'agenda' : dict([(time, [events.get(place) for place in places])
+                    for time, events in cells.items()]),
+            })
         return agenda
 
-class EventRelationManager(models.Manager):
+class EventRelationManager(RelationManager):
     '''
     >>> EventRelation.objects.all().delete()
     >>> CalendarRelation.objects.all().delete()
@@ -272,6 +558,9 @@ class EventRelationManager(models.Manager):
     >>> event1.create_relation(user2, 'viewer')
     >>> event2.create_relation(user1, 'viewer')
     '''
+    target_field = 'event'
+    visibility_field = 'event_relation'
+
     # Currently not supported
     # Multiple level reverse lookups of generic relations appears to be
     # unsupported in Django, which makes sense.
@@ -297,7 +586,8 @@ class EventRelationManager(models.Manager):
     #         eventrelation__event = event
     #     )
 
-    def get_events_for_object(self, content_object, distinction=None, inherit=True):
+    def get_events_for_object(self, content_object, distinction=None, inherit=True,
+        start=None, end=None):
         '''
         returns a queryset full of events, that relate to the object through, the
         distinction
@@ -331,35 +621,36 @@ class EventRelationManager(models.Manager):
         >>> cr = calendar.create_relation(user, 'viewer', True)
         >>> EventRelation.objects.get_events_for_object(user, 'viewer')
         [<Event: Test1: Tuesday, Jan. 1, 2008-Friday, Jan. 11, 2008>, <Event: Test2: Tuesday, Jan. 1, 2008-Friday, Jan. 11, 2008>]
+
+        If start and end are given, only the events which may have
+        occurrences between them are returned (see EventManager.in_window).
+
+        The relations are looked up in the EventVisibility index with a
+        single join.
         '''
         ct = ContentType.objects.get_for_model(type(content_object))
+        filters = {
+            'visibility__content_type': ct,
+            'visibility__object_id': content_object.id,
+        }
         if distinction:
-            dist_q = Q(eventrelation__distinction = distinction)
-            cal_dist_q = Q(calendar__calendarrelation__distinction = distinction)
+            filters['visibility__distinction'] = distinction
+        if not inherit:
+            filters['visibility__calendar_relation'] = None
+        if start is not None and end is not None:
+            events = Event.objects.in_window(start, end)
         else:
-            dist_q = Q()
-            cal_dist_q = Q()
-        if inherit:
-            inherit_q = Q(
-                cal_dist_q,
-                calendar__calendarrelation__object_id = content_object.id,
-                calendar__calendarrelation__content_type = ct,
-                calendar__calendarrelation__inheritable = True,
-            )
-        else:
-            inherit_q = Q()
-        event_q = Q(dist_q, Q(eventrelation__object_id=content_object.id),Q(eventrelation__content_type=ct))
-        return Event.objects.filter(inherit_q|event_q)
+            events = Event.objects.all()
+        return events.filter(**filters).distinct()
 
-    def change_distinction(self, distinction, new_distinction):
-        '''
-        This function is for change the a group of eventrelations from an old
-        distinction to a new one. It should only be used for managerial stuff.
-        It is also expensive so it should be used sparingly.
-        '''
-        for relation in self.filter(distinction = distinction):
-            relation.distinction = new_distinction
-            relation.save()
+    def relate(self, events, objects, distinction=None, ignore_conflicts=False):
+        """
+        Relates every one of ``objects`` to every one of ``events`` (or their
+        ids) with one insert.  With ignore_conflicts, relations which already
+        exist with the same distinction are skipped.  Returns the number of
+        created relations.  No signals are sent.
+        """
+        return self._relate(events, objects, distinction, ignore_conflicts)
 
     def create_relation(self, event, content_object, distinction=None):
         """
@@ -416,6 +707,15 @@ class EventRelation(models.Model):
 
 
 
+class OccurrenceManager(models.Manager):
+
+    def slim(self, *fields):
+        """
+        Returns the occurrences with only SLIM_OCCURRENCE_FIELDS and
+        ``fields`` loaded, for rendering calendars.
+        """
+        return self.only(*(SLIM_OCCURRENCE_FIELDS + fields))
+
 class Occurrence(Publishable):
     event = models.ForeignKey(Event, verbose_name=_("event"))
     start = models.DateTimeField(_("start"))
@@ -424,6 +724,8 @@ class Occurrence(Publishable):
     original_start = models.DateTimeField(_("original start"))
     original_end = models.DateTimeField(_("original end"))
 
+    objects = OccurrenceManager()
+
     class Meta:
         verbose_name = _("occurrence")
         verbose_name_plural = _("occurrences")
@@ -431,9 +733,11 @@ class Occurrence(Publishable):
 
     def __init__(self, *args, **kwargs):
         super(Occurrence, self).__init__(*args, **kwargs)
-        if self.title is None:
+        # deferred fields (see OccurrenceManager.slim) come from the database
+        # when touched, reading them here would cost a query each
+        if 'title' in self.__dict__ and self.title is None:
             self.title = self.event.title
-        if self.description is None:
+        if 'description' in self.__dict__ and self.description is None:
             self.description = self.event.description
 
 
@@ -441,60 +745,63 @@ class Occurrence(Publishable):
         return self.original_start != self.start or self.original_end != self.end
     moved = property(moved)
 
+    def save(self, *args, **kwargs):
+        if self.pk is None and self.original_start in self.event.get_exceptions():
+            # the row replaces the exception of the generated occurrence
+            self.event.remove_exception(self.original_start)
+            self.event.save()
+        super(Occurrence, self).save(*args, **kwargs)
+
+    def _save_exception(self):
+        # generated occurrences are only cancelled or moved, which the
+        # exceptions of their event store without an Occurrence row
+        if self.cancelled:
+            self.event.add_exception(self.original_start)
+        elif self.moved:
+            self.event.add_exception(self.original_start, self.start, self.end)
+        else:
+            self.event.remove_exception(self.original_start)
+        self.event.save()
+
     def move(self, new_start, new_end):
         self.start = new_start
         self.end = new_end
-        self.save()
+        if self.pk is None:
+            self._save_exception()
+        else:
+            self.save()
 
     def cancel(self):
         self.cancelled = True
-        self.save()
+        if self.pk is None:
+            self._save_exception()
+        else:
+            self.save()
 
     def uncancel(self):
         self.cancelled = False
-        self.save()
+        if self.pk is None:
+            self._save_exception()
+        else:
+            self.save()
 
-    def get_absolute_url(self):
+    def _get_url(self, name):
+        # unpersisted occurrences are looked up by their original start
         if self.pk is not None:
-            return reverse('occurrence', kwargs={'occurrence_id': self.pk,
-                'event_id': self.event.id})
-        return reverse('occurrence_by_date', kwargs={
-            'event_id': self.event.id,
-            'year': self.start.year,
-            'month': self.start.month,
-            'day': self.start.day,
-            'hour': self.start.hour,
-            'minute': self.start.minute,
-            'second': self.start.second,
-        })
+            return url_template(name, 'event_id', 'occurrence_id')(
+                event_id=self.event_id, occurrence_id=self.pk)
+        values = date_values(self.original_start)
+        values['event_id'] = self.event_id
+        return url_template(name + '_by_date', 'event_id', *DATE_PARAMS)(**values)
+
+    def get_absolute_url(self):
+        return self._get_url('occurrence')
 
     def get_cancel_url(self):
-        if self.pk is not None:
-            return reverse('cancel_occurrence', kwargs={'occurrence_id': self.pk,
-                'event_id': self.event.id})
-        return reverse('cancel_occurrence_by_date', kwargs={
-            'event_id': self.event.id,
-            'year': self.start.year,
-            'month': self.start.month,
-            'day': self.start.day,
-            'hour': self.start.hour,
-            'minute': self.start.minute,
-            'second': self.start.second,
-        })
+        return self._get_url('cancel_occurrence')
 
     def get_edit_url(self):
-        if self.pk is not None:
-            return reverse('edit_occurrence', kwargs={'occurrence_id': self.pk,
-                'event_id': self.event.id})
-        return reverse('edit_occurrence_by_date', kwargs={
-            'event_id': self.event.id,
-            'year': self.start.year,
-            'month': self.start.month,
-            'day': self.start.day,
-            'hour': self.start.hour,
-            'minute': self.start.minute,
-            'second': self.start.second,
-        })
+        return self._get_url('edit_occurrence')
 
     def __unicode__(self):
         return ugettext("%(start)s to %(end)s") % {
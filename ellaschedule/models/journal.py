@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from django.db import models, connection, transaction
+from django.db.models import Q, Max, Count
+from django.db.models.query import QuerySet
+from django.utils.http import int_to_base36, base36_to_int
+from django.utils.translation import ugettext_lazy as _
+
+from ellaschedule.models.calendars import Calendar
+from ellaschedule.models.events import Event, Occurrence
+from ellaschedule.models.rules import Rule
+
+actions = (
+    ("created", _("created")),
+    ("changed", _("changed")),
+    ("deleted", _("deleted")),
+    ("pruned", _("pruned")),
+)
+
+# models tracked by the journal and the fields sent to syncing clients
+SYNC_MODELS = {
+    'calendar': (Calendar, ('id', 'name', 'slug')),
+    'rule': (Rule, ('id', 'name', 'frequency', 'params')),
+    'event': (Event, ('id', 'title', 'description', 'start', 'end', 'rule',
+        'end_recurring_period', 'calendar', 'parent_event', 'place', 'exceptions')),
+    'occurrence': (Occurrence, ('id', 'event', 'title', 'description', 'start',
+        'end', 'original_start', 'original_end', 'cancelled')),
+}
+
+class JournalEntryManager(models.Manager):
+
+    def record(self, instance, action, calendar_id=None):
+        """
+        Appends an entry for ``instance`` (a Calendar, Rule, Event or
+        Occurrence) to the journal.  ``calendar_id`` is the calendar of
+        occurrences whose event can not be loaded any more, because it is
+        being deleted along with them; without it, their entry is left out.
+
+        An event which moved to another calendar is deleted from the old one,
+        with its occurrences, which change in the new one.
+        """
+        model = instance._meta.object_name.lower()
+        if model == 'calendar':
+            calendar_id = instance.pk
+        elif model == 'event':
+            calendar_id = instance.calendar_id
+            old = getattr(instance, '_old_values', None)
+            if action != 'deleted' and old is not None and \
+                    old['calendar'] not in (None, calendar_id):
+                self._record_move(instance, old['calendar'])
+        elif model == 'occurrence':
+            if calendar_id is None:
+                calendar_ids = list(Event.objects.filter(pk=instance.event_id).values_list(
+                    'calendar', flat=True))
+                if not calendar_ids:
+                    # an entry without a calendar would go to every calendar
+                    return None
+                calendar_id = calendar_ids[0]
+        else:
+            # rules are shared by all calendars
+            calendar_id = None
+        return self.create(model=model, object_id=instance.pk,
+            calendar_id=calendar_id, action=action)
+
+    def record_many(self, model, object_ids, calendar_id, action):
+        """
+        Appends an entry for each of ``object_ids`` of ``model`` in
+        ``calendar_id`` to the journal with one insert, for queryset updates
+        which send no signals.
+        """
+        if not object_ids:
+            return
+        qn = connection.ops.quote_name
+        now = connection.ops.value_to_db_datetime(datetime.datetime.now())
+        cursor = connection.cursor()
+        cursor.executemany('INSERT INTO %s (%s, %s, %s, %s, %s) VALUES (%%s, %%s, %%s, %%s, %%s)' % (
+            qn(self.model._meta.db_table), qn('model'), qn('object_id'), qn('calendar_id'),
+            qn('action'), qn('timestamp')),
+            [(model, object_id, calendar_id, action, now) for object_id in object_ids])
+        transaction.commit_unless_managed()
+
+    def _record_move(self, event, old_calendar_id):
+        self.create(model='event', object_id=event.pk, calendar_id=old_calendar_id,
+            action='deleted')
+        for occurrence_id in event.occurrence_set.values_list('id', flat=True):
+            self.create(model='occurrence', object_id=occurrence_id,
+                calendar_id=old_calendar_id, action='deleted')
+            self.create(model='occurrence', object_id=occurrence_id,
+                calendar_id=event.calendar_id, action='changed')
+
+    def get_sync_token(self, entry_id=None):
+        """
+        Returns an opaque token pointing after the journal entry with
+        ``entry_id``, or after the latest entry.
+        """
+        if entry_id is None:
+            entry_id = self.aggregate(last=Max('id'))['last'] or 0
+        return int_to_base36(entry_id)
+
+    def get_changes(self, calendar, sync_token=None, event_ids=None):
+        """
+        Returns what changed in ``calendar`` since ``sync_token`` was issued,
+        as a dictionary with the ``created``, ``changed`` and ``deleted``
+        items and a new ``sync_token``.  Items are dictionaries with a
+        ``type`` and an ``id`` and, unless deleted, the item ``data``.
+
+        If ``event_ids`` is given, only the events with these ids and their
+        occurrences are returned, e.g. the ones GET_EVENTS_FUNC lets the
+        client see; changed items it may not see any more are deleted.  It
+        may be a queryset of events, which is then only read for the events
+        of the changed items, so that a delta costs what changed rather
+        than the size of the calendar.
+
+        Without a token, or with one older than the pruned part of the
+        journal, the whole calendar is returned as created and ``reset`` is
+        set, telling the client to drop what it has.
+        """
+        since = None
+        if sync_token:
+            try:
+                since = base36_to_int(sync_token)
+            except ValueError:
+                pass
+        if since is not None and self.filter(action='pruned', object_id__gt=since).count():
+            since = None
+        if since is None:
+            return self._get_calendar_contents(calendar, event_ids)
+
+        # entries of other calendars up to the latest one need not be read
+        # again, so the new token points after them as well
+        last = self.aggregate(last=Max('id'))['last'] or since
+        changes = {}
+        entries = self.filter(Q(calendar_id=calendar.pk) | Q(calendar_id__isnull=True),
+            id__gt=since, id__lte=last).exclude(action='pruned').order_by('id')
+        for model, object_id, action in entries.values_list('model', 'object_id', 'action'):
+            first_action = changes.get((model, object_id), (action, action))[0]
+            changes[(model, object_id)] = (first_action, action)
+
+        created, changed, deleted = [], [], []
+        for (model, object_id), (first_action, action) in changes.items():
+            if action == 'deleted':
+                if first_action != 'created':
+                    deleted.append((model, object_id))
+            elif first_action == 'created':
+                created.append((model, object_id))
+            else:
+                changed.append((model, object_id))
+
+        data = self._get_sync_data(created + changed)
+        if event_ids is not None:
+            event_ids = self._get_visible_ids(event_ids, created + changed, data)
+            deleted += [(model, object_id) for model, object_id in changed
+                if (model, object_id) in data and
+                not self._is_visible(model, object_id, data, event_ids)]
+            created = [(model, object_id) for model, object_id in created
+                if self._is_visible(model, object_id, data, event_ids)]
+            changed = [(model, object_id) for model, object_id in changed
+                if self._is_visible(model, object_id, data, event_ids)]
+        return {
+            'sync_token': self.get_sync_token(last),
+            'reset': False,
+            'created': self._get_items(created, data),
+            'changed': self._get_items(changed, data),
+            'deleted': [{'type': model, 'id': object_id} for model, object_id in deleted],
+        }
+
+    def _get_calendar_contents(self, calendar, event_ids=None):
+        # take the token first so that nothing saved meanwhile gets lost
+        sync_token = self.get_sync_token()
+        created = [('calendar', calendar.pk)]
+        created += [('rule', pk) for pk in Rule.objects.values_list('id', flat=True)]
+        created += [('event', pk) for pk in
+            calendar.event_set.values_list('id', flat=True)]
+        created += [('occurrence', pk) for pk in
+            Occurrence.objects.filter(event__calendar=calendar).values_list('id', flat=True)]
+        data = self._get_sync_data(created)
+        if event_ids is not None:
+            event_ids = self._get_visible_ids(event_ids, created, data)
+            created = [(model, object_id) for model, object_id in created
+                if self._is_visible(model, object_id, data, event_ids)]
+        return {
+            'sync_token': sync_token,
+            'reset': True,
+            'created': self._get_items(created, data),
+            'changed': [],
+            'deleted': [],
+        }
+
+    def _get_sync_data(self, items):
+        """
+        Loads the sync fields of ``items`` with one query per model.
+        """
+        ids = {}
+        for model, object_id in items:
+            ids.setdefault(model, []).append(object_id)
+        data = {}
+        for model, object_ids in ids.items():
+            model_class, fields = SYNC_MODELS[model]
+            for values in model_class.objects.filter(pk__in=object_ids).values(*fields):
+                data[(model, values['id'])] = values
+        return data
+
+    def _get_visible_ids(self, event_ids, items, data):
+        # the ids of the events of items among event_ids
+        if not isinstance(event_ids, QuerySet):
+            return event_ids
+        ids = set()
+        for model, object_id in items:
+            if model == 'event':
+                ids.add(object_id)
+            elif model == 'occurrence' and (model, object_id) in data:
+                ids.add(data[(model, object_id)]['event'])
+        if not ids:
+            return ids
+        return set(event_ids.filter(pk__in=ids).values_list('id', flat=True))
+
+    def _is_visible(self, model, object_id, data, event_ids):
+        if model == 'event':
+            return object_id in event_ids
+        if model == 'occurrence':
+            values = data.get((model, object_id))
+            return values is not None and values['event'] in event_ids
+        return True
+
+    def _get_items(self, items, data):
+        # items which disappeared since their journal entry was read are
+        # left out, their deletion comes with the next sync
+        return [{'type': model, 'id': object_id, 'data': data[(model, object_id)]}
+            for model, object_id in items if (model, object_id) in data]
+
+    def compact(self, before=None):
+        """
+        Removes entries superseded by a later entry for the same object in
+        the same calendar.  Syncing clients are not affected, they only need
+        the latest state; the entry deleting an object from the calendar it
+        left is kept.  Returns the number of removed entries.
+        """
+        entries = self.exclude(action='pruned')
+        if before is not None:
+            entries = entries.filter(timestamp__lt=before)
+        removed = 0
+        superseded = entries.values('model', 'object_id', 'calendar_id').annotate(
+            last=Max('id'), count=Count('id')).filter(count__gt=1)
+        for group in superseded:
+            stale = self.filter(model=group['model'], object_id=group['object_id'],
+                calendar_id=group['calendar_id'], id__lt=group['last'])
+            removed += stale.count()
+            stale.delete()
+        return removed
+
+    def prune(self, before):
+        """
+        Removes all entries older than ``before``.  Sync tokens issued before
+        the newest removed entry will get a full resync.  Returns the number
+        of removed entries.
+        """
+        entries = self.filter(timestamp__lt=before).exclude(action='pruned')
+        last = entries.aggregate(last=Max('id'))['last']
+        if last is None:
+            return 0
+        removed = entries.count()
+        self.filter(id__lte=last).delete()
+        self.create(model='', object_id=last, action='pruned')
+        return removed
+
+class JournalEntry(models.Model):
+    '''
+    An append-only log of changes of calendars, rules, events and
+    persisted occurrences, used to answer "what changed since X" for
+    syncing clients.  Entries are written from the post_save and
+    post_delete signals (see ellaschedule.signals).
+
+    model: lower-case name of the changed model
+    object_id: primary key of the changed object
+    calendar_id: the calendar the object belongs to, or null for rules,
+    which are shared by all calendars
+    action: created, changed or deleted; pruned marks entries up to
+    object_id as removed from the journal
+    '''
+    model = models.CharField(_("model"), max_length=20)
+    object_id = models.IntegerField(_("object id"), db_index=True)
+    calendar_id = models.IntegerField(_("calendar"), null=True, blank=True, db_index=True)
+    action = models.CharField(_("action"), max_length=10, choices=actions)
+    timestamp = models.DateTimeField(_("timestamp"), default=datetime.datetime.now)
+
+    objects = JournalEntryManager()
+
+    class Meta:
+        verbose_name = _('journal entry')
+        verbose_name_plural = _('journal entries')
+        app_label = 'ellaschedule'
+
+    def __unicode__(self):
+        return u'%s %s %s' % (self.model, self.object_id, self.action)
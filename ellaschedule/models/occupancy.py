@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from django.db import models
+from django.utils.translation import ugettext_lazy as _
+
+from ellaschedule.conf.settings import OCCUPANCY_SLOT_MINUTES
+from ellaschedule.models.events import Event
+from ellaschedule.utils import expand_occurrences
+
+def get_slot(time, slot_minutes=OCCUPANCY_SLOT_MINUTES):
+    """
+    Returns the number of the slot of a day in which ``time`` falls.
+    """
+    return (time.hour * 60 + time.minute) // slot_minutes
+
+def get_slot_mask(start_slot, end_slot):
+    """
+    Returns a bitmap with the bits of slots start_slot to end_slot - 1 set.
+
+    >>> bin = lambda mask: ''.join([str((mask >> i) & 1) for i in range(8)])
+    >>> bin(get_slot_mask(2, 5))
+    '00111000'
+    """
+    if end_slot <= start_slot:
+        return 0
+    return ((1L << (end_slot - start_slot)) - 1) << start_slot
+
+def get_span_masks(start, end, slot_minutes=OCCUPANCY_SLOT_MINUTES):
+    """
+    Returns {day: bitmap} of the slots occupied by a span, a slot being
+    occupied when the span overlaps any part of it.
+    """
+    slots_per_day = 24 * 60 // slot_minutes
+    masks = {}
+    day = start.date()
+    while True:
+        day_start = datetime.datetime.combine(day, datetime.time.min)
+        next_day = day_start + datetime.timedelta(days=1)
+        first = start > day_start and get_slot(start, slot_minutes) or 0
+        if end >= next_day:
+            last = slots_per_day
+        else:
+            # the slot in which the span ends is occupied unless it ends at
+            # its very start
+            last = get_slot(end, slot_minutes)
+            if (end - datetime.datetime.combine(day, datetime.time.min)).seconds % (slot_minutes * 60):
+                last += 1
+        masks[day] = get_slot_mask(first, last)
+        if end <= next_day:
+            return masks
+        day = next_day.date()
+
+class PlaceOccupancyManager(models.Manager):
+
+    def rebuild(self, parent_event, days=None):
+        """
+        Recomputes the occupancy of the places on ``days`` (all days by
+        default) from the child events of ``parent_event``.  Only the
+        children near the given days are read and expanded.
+        """
+        children = Event.objects.filter(parent_event=parent_event)
+        rows = self.filter(parent_event=parent_event)
+        if days is not None:
+            days = set(days)
+            if not days:
+                return
+            start = datetime.datetime.combine(min(days), datetime.time.min)
+            end = datetime.datetime.combine(max(days), datetime.time.min) + datetime.timedelta(days=1)
+            children = Event.objects.in_window(start, end).filter(parent_event=parent_event)
+            rows = rows.filter(day__in=days)
+        else:
+            span = children.aggregate(start=models.Min('start'), end=models.Max('end'),
+                end_recurring_period=models.Max('end_recurring_period'))
+            if span['start'] is None:
+                rows.delete()
+                return
+            start = span['start']
+            end = max([value for value in (span['end'], span['end_recurring_period'],
+                parent_event.end) if value is not None])
+
+        occupancy = {}
+        for o_start, o_end, event, occurrence in expand_occurrences(
+                children.select_related('rule'), start, end):
+            if occurrence is not None and occurrence.cancelled:
+                continue
+            place = event.place or u''
+            for day, mask in get_span_masks(o_start, o_end).items():
+                if days is not None and day not in days:
+                    continue
+                occupancy[(place, day)] = occupancy.get((place, day), 0) | mask
+
+        rows.delete()
+        for (place, day), mask in occupancy.items():
+            self.create(parent_event=parent_event, place=place, day=day,
+                slot_minutes=OCCUPANCY_SLOT_MINUTES, bitmap='%x' % mask)
+
+    def get_occupancy(self, parent_event):
+        """
+        Returns {day: {place: bitmap}} for the child events of
+        ``parent_event``, building the index first if it is missing or was
+        built with another slot resolution.
+        """
+        rows = list(self.filter(parent_event=parent_event).values_list(
+            'place', 'day', 'slot_minutes', 'bitmap'))
+        if not rows or [row for row in rows if row[2] != OCCUPANCY_SLOT_MINUTES]:
+            self.rebuild(parent_event)
+            rows = list(self.filter(parent_event=parent_event).values_list(
+                'place', 'day', 'slot_minutes', 'bitmap'))
+        occupancy = {}
+        for place, day, slot_minutes, bitmap in rows:
+            occupancy.setdefault(day, {})[place] = long(bitmap, 16)
+        return occupancy
+
+    def get_free_places(self, parent_event, start, end):
+        """
+        Returns the sorted places used by the child events of
+        ``parent_event`` which are free between start and end, e.g. the
+        rooms of a conference free from 14:00 to 15:00 on its second day.
+        """
+        occupancy = self.get_occupancy(parent_event)
+        places = set()
+        for day_places in occupancy.values():
+            places.update(day_places)
+        for day, mask in get_span_masks(start, end).items():
+            day_places = occupancy.get(day, {})
+            places = [place for place in places if not day_places.get(place, 0) & mask]
+        return sorted(places)
+
+class PlaceOccupancy(models.Model):
+    '''
+    An index of which parts of a day a place is occupied by the child events
+    of an event, e.g. the rooms of a conference, used to build agendas and
+    to look up free places without scanning the events.
+
+    parent_event: the event whose child events occupy the place
+    place: the place of the child events (Event.place), empty if not set
+    day: the day
+    slot_minutes: the resolution of the bitmap (OCCUPANCY_SLOT_MINUTES when
+    it was built)
+    bitmap: one bit per slot of the day, lowest bit first, set when the place
+    is occupied in the slot, in hex
+    '''
+    parent_event = models.ForeignKey(Event, verbose_name=_("parent event"))
+    place = models.CharField(_("place"), max_length=255, blank=True)
+    day = models.DateField(_("day"))
+    slot_minutes = models.PositiveSmallIntegerField(_("slot minutes"))
+    bitmap = models.TextField(_("bitmap"))
+
+    objects = PlaceOccupancyManager()
+
+    class Meta:
+        verbose_name = _('place occupancy')
+        verbose_name_plural = _('place occupancies')
+        unique_together = (('parent_event', 'place', 'day'),)
+        app_label = 'ellaschedule'
+
+    def __unicode__(self):
+        return u'%s %s' % (self.place, self.day)
+
+    def is_free(self, start_time, end_time):
+        """
+        Returns True if the place is free from start_time to end_time (times)
+        on the day.
+        """
+        start = datetime.datetime.combine(self.day, start_time)
+        end = datetime.datetime.combine(self.day, end_time)
+        mask = get_span_masks(start, end, self.slot_minutes).get(self.day, 0)
+        return not long(self.bitmap, 16) & mask
@@ -1,4 +1,11 @@
+import datetime
+import re
+
+from dateutil import rrule
+from dateutil.relativedelta import relativedelta
+
 from django.db import models
+from django.utils.datastructures import SortedDict
 from django.utils.translation import ugettext, ugettext_lazy as _
 
 freqs = (   ("YEARLY", _("Yearly")),
@@ -9,6 +16,45 @@ freqs = (   ("YEARLY", _("Yearly")),
             ("MINUTELY", _("Minutely")),
             ("SECONDLY", _("Secondly")))
 
+# rrule params as named by the iCalendar RRULE property, in serialization order
+ICAL_PARAMS = SortedDict([
+    ('interval', 'INTERVAL'),
+    ('wkst', 'WKST'),
+    ('bysetpos', 'BYSETPOS'),
+    ('bymonth', 'BYMONTH'),
+    ('bymonthday', 'BYMONTHDAY'),
+    ('byyearday', 'BYYEARDAY'),
+    ('byweekno', 'BYWEEKNO'),
+    ('byweekday', 'BYDAY'),
+    ('byhour', 'BYHOUR'),
+    ('byminute', 'BYMINUTE'),
+    ('bysecond', 'BYSECOND'),
+    ('byeaster', 'BYEASTER'),
+    ('count', 'COUNT'),
+])
+
+ICAL_WEEKDAYS = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+
+# a weekday as rrule.weekday prints it, e.g. MO or FR(-1) for the last friday
+WEEKDAY_RE = re.compile(r'^(MO|TU|WE|TH|FR|SA|SU)(?:\(([+-]?\d+)\))?$')
+
+def parse_param_value(value):
+    """
+    >>> parse_param_value('3'), parse_param_value('FR(-1)')
+    (3, FR(-1))
+    """
+    match = WEEKDAY_RE.match(value)
+    if match is None:
+        return int(value)
+    day, n = match.groups()
+    return rrule.weekday(ICAL_WEEKDAYS.index(day), n and int(n) or None)
+
+def format_ical_weekday(day):
+    # an int or an rrule.weekday, which may have a position
+    if isinstance(day, rrule.weekday):
+        return '%s%s' % (day.n or '', ICAL_WEEKDAYS[day.weekday])
+    return ICAL_WEEKDAYS[day]
+
 class Rule(models.Model):
     """
     This defines a rule by which an event will recur.  This is defined by the
@@ -24,6 +70,9 @@ class Rule(models.Model):
         rruleparam = see list below
         value = int[,int]*
 
+      byweekday values may also be weekdays with their position in the
+      period, e.g. byweekday:MO(+1) for the first monday of a month.
+
       The options are: (documentation for these can be found at
       http://labix.org/python-dateutil#head-470fa22b2db72000d7abe698a5783a46b0731b57)
         ** count
@@ -51,8 +100,8 @@ class Rule(models.Model):
     def get_params(self):
         """
         >>> rule = Rule(params = "count:1;bysecond:1;byminute:1,2,4,5")
-        >>> rule.get_params()
-        {'count': 1, 'byminute': [1, 2, 4, 5], 'bysecond': 1}
+        >>> sorted(rule.get_params().items())
+        [('byminute', [1, 2, 4, 5]), ('bysecond', 1), ('count', 1)]
         """
         if self.params is None:
             return {}
@@ -61,12 +110,109 @@ class Rule(models.Model):
         for param in params:
             param = param.split(':')
             if len(param) == 2:
-                param = (str(param[0]), [int(p) for p in param[1].split(',')])
+                param = (str(param[0]), [parse_param_value(p) for p in param[1].split(',')])
                 if len(param[1]) == 1:
                     param = (param[0], param[1][0])
                 param_dict.append(param)
         return dict(param_dict)
 
+    def get_ical_rrule(self, until=None):
+        """
+        Returns the value of an iCalendar RRULE property describing this rule.
+        If ``until`` is given it is used as the UNTIL part and any ``count``
+        param is dropped, as iCalendar does not allow both.
+
+        >>> rule = Rule(frequency = "WEEKLY", params = "byweekday:0,2;count:10")
+        >>> rule.get_ical_rrule()
+        'FREQ=WEEKLY;BYDAY=MO,WE;COUNT=10'
+        >>> rule.get_ical_rrule(datetime.datetime(2008, 5, 5))
+        'FREQ=WEEKLY;BYDAY=MO,WE;UNTIL=20080505T000000'
+        >>> Rule(frequency = "MONTHLY", params = "byweekday:MO(+1),FR(-1)").get_ical_rrule()
+        'FREQ=MONTHLY;BYDAY=1MO,-1FR'
+        """
+        params = self.get_params()
+        if until is not None:
+            params.pop('count', None)
+        parts = ['FREQ=%s' % self.frequency]
+        for param in ICAL_PARAMS:
+            if param not in params:
+                continue
+            value = params[param]
+            if not isinstance(value, list):
+                value = [value]
+            if param in ('byweekday', 'wkst'):
+                value = [format_ical_weekday(day) for day in value]
+            parts.append('%s=%s' % (ICAL_PARAMS[param], ','.join([str(v) for v in value])))
+        if until is not None:
+            parts.append('UNTIL=%s' % until.strftime('%Y%m%dT%H%M%S'))
+        return ';'.join(parts)
+
+    def fast_forward(self, dtstart, after):
+        """
+        Returns a dtstart and params for an rrule which, from ``after`` on,
+        produces the same occurrences as this rule starting at ``dtstart``,
+        but starts close before ``after``, skipping whole recurrence
+        periods.  The parts rrule derives from dtstart when they are not
+        given are set explicitly.  Rules with a count are not fast
+        forwarded, the count starts at dtstart.
+
+        >>> rule = Rule(frequency = "MONTHLY", params = "interval:2")
+        >>> dtstart, params = rule.fast_forward(datetime.datetime(2008, 1, 31, 8, 0), datetime.datetime(2010, 6, 1))
+        >>> dtstart
+        datetime.datetime(2010, 3, 31, 8, 0)
+        >>> params['bymonthday'], params['byhour'], params['interval']
+        (31, 8, 2)
+        """
+        params = self.get_params()
+        if 'count' in params or after <= dtstart:
+            return dtstart, params
+        interval = params.get('interval', 1)
+        if isinstance(interval, list):
+            interval = interval[0]
+        elapsed = after - dtstart
+        if self.frequency == 'YEARLY':
+            periods = after.year - dtstart.year
+            shift = lambda n: relativedelta(years=n)
+        elif self.frequency == 'MONTHLY':
+            periods = (after.year - dtstart.year) * 12 + after.month - dtstart.month
+            shift = lambda n: relativedelta(months=n)
+        elif self.frequency == 'WEEKLY':
+            periods = elapsed.days // 7
+            shift = lambda n: datetime.timedelta(weeks=n)
+        elif self.frequency == 'DAILY':
+            periods = elapsed.days
+            shift = lambda n: datetime.timedelta(days=n)
+        elif self.frequency == 'HOURLY':
+            periods = elapsed.days * 24 + elapsed.seconds // 3600
+            shift = lambda n: datetime.timedelta(hours=n)
+        elif self.frequency == 'MINUTELY':
+            periods = elapsed.days * 1440 + elapsed.seconds // 60
+            shift = lambda n: datetime.timedelta(minutes=n)
+        else:
+            periods = elapsed.days * 86400 + elapsed.seconds
+            shift = lambda n: datetime.timedelta(seconds=n)
+        # keep one period in hand, the occurrences of the period containing
+        # after may start before it
+        skip = (periods // interval - 1) * interval
+        if skip <= 0:
+            return dtstart, params
+
+        if not [p for p in ('byweekno', 'byyearday', 'bymonthday', 'byweekday', 'byeaster') if p in params]:
+            if self.frequency == 'YEARLY':
+                params.setdefault('bymonth', dtstart.month)
+                params['bymonthday'] = dtstart.day
+            elif self.frequency == 'MONTHLY':
+                params['bymonthday'] = dtstart.day
+            elif self.frequency == 'WEEKLY':
+                params['byweekday'] = dtstart.weekday()
+        if self.frequency not in ('HOURLY', 'MINUTELY', 'SECONDLY'):
+            params.setdefault('byhour', dtstart.hour)
+        if self.frequency not in ('MINUTELY', 'SECONDLY'):
+            params.setdefault('byminute', dtstart.minute)
+        if self.frequency != 'SECONDLY':
+            params.setdefault('bysecond', dtstart.second)
+        return dtstart + shift(skip), params
+
     def __unicode__(self):
         """Human readable string for Rule"""
         return self.name
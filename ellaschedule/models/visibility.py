@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+from django.contrib.contenttypes.models import ContentType
+from django.db import models, connection, transaction
+from django.utils.translation import ugettext_lazy as _
+
+from ellaschedule.models.calendars import CalendarRelation
+from ellaschedule.models.events import Event, EventRelation
+
+class EventVisibilityManager(models.Manager):
+
+    def _insert(self, select, params):
+        qn = connection.ops.quote_name
+        columns = ['event_id', 'content_type_id', 'object_id', 'distinction',
+            'event_relation_id', 'calendar_relation_id']
+        cursor = connection.cursor()
+        cursor.execute('INSERT INTO %s (%s) %s' % (qn(self.model._meta.db_table),
+            ', '.join([qn(column) for column in columns]), select), params)
+        transaction.commit_unless_managed()
+
+    def _delete(self, where, params):
+        cursor = connection.cursor()
+        cursor.execute('DELETE FROM %s WHERE %s' % (
+            connection.ops.quote_name(self.model._meta.db_table), where), params)
+        transaction.commit_unless_managed()
+
+    def _insert_event_relations(self, where, params):
+        # one row per event relation
+        qn = connection.ops.quote_name
+        self._insert('SELECT r.%s, r.%s, r.%s, r.%s, r.%s, NULL FROM %s r WHERE %s' % (
+            qn('event_id'), qn('content_type_id'), qn('object_id'),
+            qn('distinction'), qn('id'), qn(EventRelation._meta.db_table), where),
+            params)
+
+    def _insert_calendar_relations(self, where, params):
+        # one row per inheritable calendar relation and event of the calendar
+        qn = connection.ops.quote_name
+        self._insert('SELECT e.%s, r.%s, r.%s, r.%s, NULL, r.%s FROM %s r '
+            'INNER JOIN %s e ON e.%s = r.%s WHERE r.%s = %%s AND %s' % (
+            qn(Event._meta.pk.column), qn('content_type_id'), qn('object_id'),
+            qn('distinction'), qn('id'), qn(CalendarRelation._meta.db_table),
+            qn(Event._meta.db_table), qn('calendar_id'), qn('calendar_id'),
+            qn('inheritable'), where), [True] + list(params))
+
+    def rebuild(self):
+        """
+        Rebuilds the whole index from the event and calendar relations with
+        three queries.
+        """
+        self._delete('1 = 1', [])
+        self._insert_event_relations('1 = 1', [])
+        self._insert_calendar_relations('1 = 1', [])
+
+    def index_event_relation(self, relation):
+        self.filter(event_relation=relation).delete()
+        self.create(event_id=relation.event_id, content_type_id=relation.content_type_id,
+            object_id=relation.object_id, distinction=relation.distinction,
+            event_relation=relation)
+
+    def index_calendar_relation(self, relation):
+        self.filter(calendar_relation=relation).delete()
+        self._insert_calendar_relations('r.%s = %%s' % connection.ops.quote_name('id'),
+            [relation.pk])
+
+    def index_relations(self, visibility_field, where, params):
+        """
+        Reindexes the relations matching ``where``, a condition on their
+        table aliased r, e.g. after they were inserted without signals.
+        ``visibility_field`` tells which relations: 'event_relation' or
+        'calendar_relation'.
+        """
+        qn = connection.ops.quote_name
+        if visibility_field == 'event_relation':
+            relation_model, insert = EventRelation, self._insert_event_relations
+        else:
+            relation_model, insert = CalendarRelation, self._insert_calendar_relations
+        self._delete('%s IN (SELECT r.%s FROM %s r WHERE %s)' % (
+            qn(visibility_field + '_id'), qn('id'), qn(relation_model._meta.db_table), where),
+            params)
+        insert(where, params)
+
+    def index_events(self, event_ids):
+        """
+        Reindexes the calendar relations inherited by the events with
+        ``event_ids`` with two queries, e.g. after they were saved with
+        indexing disabled (see ellaschedule.signals.disable_indexing).
+        """
+        if not event_ids:
+            return
+        qn = connection.ops.quote_name
+        placeholders = ', '.join(['%s'] * len(event_ids))
+        self._delete('%s IN (%s) AND %s IS NULL' % (qn('event_id'), placeholders,
+            qn('event_relation_id')), list(event_ids))
+        self._insert_calendar_relations('e.%s IN (%s)' % (qn(Event._meta.pk.column),
+            placeholders), list(event_ids))
+
+    def index_event_calendar(self, event):
+        """
+        Reindexes the calendar relations inherited by ``event``, e.g. after
+        it changed calendars.
+        """
+        self.filter(event=event, event_relation=None).delete()
+        self._insert_calendar_relations('e.%s = %%s' % connection.ops.quote_name(
+            Event._meta.pk.column), [event.pk])
+
+class EventVisibility(models.Model):
+    '''
+    A denormalized index of the objects related to events, directly by an
+    EventRelation or through an inheritable CalendarRelation of their
+    calendar, so that EventRelation.objects.get_events_for_object is a single
+    indexed join.  It is kept up to date by signals; rebuild it with the
+    rebuild_event_visibility command after relations were changed without
+    them.
+
+    event: the event
+    content_type, object_id, distinction: as in the relation
+    event_relation: the EventRelation the row comes from, or None
+    calendar_relation: the CalendarRelation the row comes from, or None
+    '''
+    event = models.ForeignKey(Event, verbose_name=_("event"), related_name='visibility')
+    content_type = models.ForeignKey(ContentType)
+    object_id = models.IntegerField()
+    distinction = models.CharField(_("distinction"), max_length = 20, null=True)
+    event_relation = models.ForeignKey(EventRelation, null=True)
+    calendar_relation = models.ForeignKey(CalendarRelation, null=True)
+
+    objects = EventVisibilityManager()
+
+    class Meta:
+        verbose_name = _('event visibility')
+        verbose_name_plural = _('event visibilities')
+        app_label = 'ellaschedule'
+
+    def __unicode__(self):
+        return u'%s - %s:%s' % (self.event_id, self.content_type_id, self.object_id)
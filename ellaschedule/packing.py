@@ -0,0 +1,157 @@
+"""
+A compact format for caching expanded occurrences.
+
+Pickled Occurrence instances carry their event, model state and every field
+of Publishable, so a year of a busy calendar does not fit in a memcached
+item.  pack_occurrences keeps only what tells the occurrences apart:
+
+* a table of the event ids, referenced by index
+* the starts, in seconds, each relative to the one before, and the
+  durations, as little-endian int64 arrays
+* a byte of flags per occurrence: cancelled, persisted, moved
+* the ids, titles and descriptions of the persisted occurrences and the
+  original spans of the moved ones
+
+optionally compressed with zlib.  Times are kept to the second.
+"""
+import datetime
+import struct
+import zlib
+from operator import attrgetter
+
+EPOCH = datetime.datetime(1970, 1, 1)
+MAGIC = 'OCC2'
+# magic, options, number of events, number of occurrences
+HEADER = struct.Struct('<4sBII')
+COMPRESSED = 1
+
+CANCELLED = 1
+PERSISTED = 2
+MOVED = 4
+
+def _seconds(value):
+    delta = value - EPOCH
+    return delta.days * 86400 + delta.seconds
+
+def _datetime(seconds):
+    return EPOCH + datetime.timedelta(seconds=seconds)
+
+def pack_occurrences(occurrences, compress=True):
+    """
+    Returns ``occurrences`` (Occurrence instances, persisted or not) packed
+    into a string, sorted by start.
+    """
+    occurrences = sorted(occurrences, key=attrgetter('start'))
+    event_ids = sorted(set([occurrence.event_id for occurrence in occurrences]))
+    index = dict([(event_id, i) for i, event_id in enumerate(event_ids)])
+    indexes, starts, durations, flags = [], [], [], []
+    persisted, texts, originals = [], [], []
+    previous = 0
+    for occurrence in occurrences:
+        start = _seconds(occurrence.start)
+        indexes.append(index[occurrence.event_id])
+        starts.append(start - previous)
+        durations.append(_seconds(occurrence.end) - start)
+        previous = start
+        flag = occurrence.cancelled and CANCELLED or 0
+        if occurrence.pk is not None:
+            flag |= PERSISTED
+            persisted.append(occurrence.pk)
+            texts.append((occurrence.title or u'').encode('utf-8'))
+            texts.append((occurrence.description or u'').encode('utf-8'))
+        if occurrence.moved:
+            flag |= MOVED
+            original = _seconds(occurrence.original_start)
+            originals.extend((original - start, _seconds(occurrence.original_end) - original))
+        flags.append(flag)
+    count = len(occurrences)
+    body = ''.join([
+        struct.pack('<%dq' % len(event_ids), *event_ids),
+        struct.pack('<%dI' % count, *indexes),
+        struct.pack('<%dq' % count, *starts),
+        struct.pack('<%dq' % count, *durations),
+        struct.pack('%dB' % count, *flags),
+        struct.pack('<%dq' % len(persisted), *persisted),
+        struct.pack('<%dq' % len(originals), *originals),
+        '\0'.join(texts),
+    ])
+    options = 0
+    if compress:
+        body = zlib.compress(body)
+        options |= COMPRESSED
+    return HEADER.pack(MAGIC, options, len(event_ids), count) + body
+
+def unpack_occurrences(data):
+    """
+    Returns the occurrences packed by pack_occurrences as a list of
+    (start, end, event id, cancelled, occurrence id, original start,
+    original end, title, description) tuples, the occurrence id, the title
+    and the description being None for occurrences which are not persisted.  Raises ValueError for data
+    which was not packed by pack_occurrences.
+    """
+    try:
+        magic, options, event_count, count = HEADER.unpack_from(data)
+    except struct.error:
+        raise ValueError("Not packed occurrences")
+    if magic != MAGIC:
+        raise ValueError("Not packed occurrences")
+    body = data[HEADER.size:]
+    if options & COMPRESSED:
+        body = zlib.decompress(body)
+
+    offset = [0]
+    def read(format, length):
+        values = struct.unpack_from('<%d%s' % (length, format), body, offset[0])
+        offset[0] += struct.calcsize('<%d%s' % (length, format))
+        return values
+    event_ids = read('q', event_count)
+    indexes = read('I', count)
+    starts = read('q', count)
+    durations = read('q', count)
+    flags = read('B', count)
+    persisted_count = len([flag for flag in flags if flag & PERSISTED])
+    persisted = iter(read('q', persisted_count))
+    originals = iter(read('q', 2 * len([flag for flag in flags if flag & MOVED])))
+    texts = iter(persisted_count and body[offset[0]:].split('\0') or ())
+
+    items = []
+    start = 0
+    for i in xrange(count):
+        start += starts[i]
+        o_start = _datetime(start)
+        o_end = _datetime(start + durations[i])
+        flag = flags[i]
+        occurrence_id = title = description = None
+        if flag & PERSISTED:
+            occurrence_id = persisted.next()
+            title = texts.next().decode('utf-8')
+            description = texts.next().decode('utf-8')
+        if flag & MOVED:
+            original = start + originals.next()
+            original_start = _datetime(original)
+            original_end = _datetime(original + originals.next())
+        else:
+            original_start, original_end = o_start, o_end
+        items.append((o_start, o_end, event_ids[indexes[i]], bool(flag & CANCELLED),
+            occurrence_id, original_start, original_end, title, description))
+    return items
+
+def inflate_occurrences(items, events):
+    """
+    Returns Occurrence instances for items of unpack_occurrences, given
+    {event id: event}.  Persisted occurrences only get their id, title and
+    description back, enough for display; reload them before saving.
+    """
+    from ellaschedule.models import Occurrence
+
+    occurrences = []
+    for start, end, event_id, cancelled, occurrence_id, original_start, original_end, \
+            title, description in items:
+        occurrence = Occurrence(event=events[event_id], start=start, end=end,
+            cancelled=cancelled, original_start=original_start, original_end=original_end)
+        if occurrence_id is not None:
+            occurrence.id = occurrence.pk = occurrence_id
+            occurrence.title = title
+            occurrence.description = description
+        occurrences.append(occurrence)
+    return occurrences
@@ -3,9 +3,12 @@ from django.db.models.query import QuerySet
 from django.template.defaultfilters import date
 from django.utils.translation import ugettext, ugettext_lazy as _
 from django.utils.dates import WEEKDAYS, WEEKDAYS_ABBR
-from ellaschedule.conf.settings import FIRST_DAY_OF_WEEK, SHOW_CANCELLED_OCCURRENCES
+from ellaschedule.cache import get_cached_occurrences
+from ellaschedule.conf.settings import FIRST_DAY_OF_WEEK, SHOW_CANCELLED_OCCURRENCES, \
+    OCCURRENCE_CACHE
 from ellaschedule.models import Occurrence
-from ellaschedule.utils import OccurrenceReplacer
+from ellaschedule.utils import OccurrenceReplacer, expand_occurrences, \
+    get_persisted_occurrences
 
 weekday_names = []
 weekday_abbrs = []
@@ -46,14 +49,22 @@ class Period(object):
     def _get_sorted_occurrences(self):
         occurrences = []
         if hasattr(self, "occurrence_pool") and self.occurrence_pool is not None:
-            for occurrence in self.occurrence_pool:
+            occurrence_pool = self.occurrence_pool
+            if isinstance(occurrence_pool, Period):
+                # the parent period, expanded only when needed
+                occurrence_pool = occurrence_pool.occurrences
+            for occurrence in occurrence_pool:
                 if occurrence.start <= self.end and occurrence.end >= self.start:
                     occurrences.append(occurrence)
             return occurrences
-        for event in self.events:
-            event_occurrences = event.get_occurrences(self.start, self.end)
-            occurrences += event_occurrences
-        return sorted(occurrences)
+        if OCCURRENCE_CACHE and not hasattr(self, '_persisted_occurrences'):
+            return get_cached_occurrences(self.events, self.start, self.end)
+        # all events are expanded at once, with one query for the persisted
+        # occurrences
+        for o_start, o_end, event, occurrence in expand_occurrences(self.events,
+                self.start, self.end, self.get_persisted_occurrences()):
+            occurrences.append(occurrence or event._create_occurrence(o_start, o_end))
+        return occurrences
 
     def cached_get_sorted_occurrences(self):
         if hasattr(self, '_occurrences'):
@@ -64,10 +75,11 @@ class Period(object):
     occurrences = property(cached_get_sorted_occurrences)
 
     def get_persisted_occurrences(self):
-        if hasattr(self, '_persisted_occurrenes'):
+        if hasattr(self, '_persisted_occurrences'):
             return self._persisted_occurrences
         else:
-            self._persisted_occurrences = Occurrence.objects.filter(event__in = self.events)
+            self._persisted_occurrences = get_persisted_occurrences(self.events,
+                self.start, self.end)
             return self._persisted_occurrences
 
     def classify_occurrence(self, occurrence):
@@ -116,7 +128,7 @@ class Period(object):
 
     def create_sub_period(self, cls, start=None):
         start = start or self.start
-        return cls(self.events, start, self.get_persisted_occurrences(), self.occurrences)
+        return cls(self.events, start, self.get_persisted_occurrences(), self)
 
     def get_periods(self, cls):
         period = self.create_sub_period(cls)
@@ -1,50 +1,311 @@
-from django.conf import settings
-from django.db.models.signals import pre_save
+import threading
+
+from django.db import transaction
+from django.db.models.signals import post_init, pre_save, post_save, pre_delete, post_delete
 
 from ella.core.models import Category
 
 from django.contrib.sites.models import Site
 from django.template.defaultfilters import slugify
 
-from models import Event, Calendar
+from models import Event, Calendar, Occurrence, Rule, JournalEntry, PlaceOccupancy, \
+    EventRelation, CalendarRelation, EventVisibility
+from models.occupancy import get_span_masks
+from cache import bump_version, bump_object_version, get_cached_calendar_id, \
+    set_cached_calendar_id, delete_cached_calendar_id
+from conf.settings import EVENT_DEFAULT_CALENDAR_NAME
+
 
+# per thread: whether the default calendar is assigned, whether events and
+# occurrences are indexed and the calendars of the events being deleted
+_state = threading.local()
 
 def get_default_category():
     try:
-        return Category.objects.get(
+        category = Category.objects.get(
             site = Site.objects.get_current(),
             tree_parent = None
         )
     except Category.DoesNotExist:
         title = u"Default category"
-        
-        return Category.objects.create(
+
+        category = Category.objects.create(
             site = Site.objects.get_current(),
             tree_path = "",
             tree_parent = None,
             title = title,
             slug = slugify(title)
         )
+    return category
 
+def get_default_calendar_id():
+    """
+    Returns the id of the calendar of events saved without one, named
+    EVENT_DEFAULT_CALENDAR_NAME, creating the calendar if needed.  The id is
+    kept in the cache backend, shared by all processes, unless it was read
+    in a transaction with uncommitted changes, which may still roll back.
+    """
+    calendar_id = get_cached_calendar_id(EVENT_DEFAULT_CALENDAR_NAME)
+    if calendar_id is None:
+        ids = list(Calendar._default_manager.filter(
+            name=EVENT_DEFAULT_CALENDAR_NAME).values_list('pk', flat=True)[:1])
+        if not ids:
+            calendar = Calendar(
+                name = EVENT_DEFAULT_CALENDAR_NAME,
+                slug = slugify(EVENT_DEFAULT_CALENDAR_NAME),
+                category = get_default_category()
+            )
+            calendar.save()
+            ids = [calendar.pk]
+        calendar_id = ids[0]
+        if not transaction.is_dirty():
+            set_cached_calendar_id(EVENT_DEFAULT_CALENDAR_NAME, calendar_id)
+    return calendar_id
 
-def optionnal_calendar(sender, **kwargs):
-    event = kwargs.pop('instance')
+def forget_default_calendar(sender, instance, **kwargs):
+    if instance.name == EVENT_DEFAULT_CALENDAR_NAME or \
+            get_cached_calendar_id(EVENT_DEFAULT_CALENDAR_NAME) == instance.pk:
+        delete_cached_calendar_id(EVENT_DEFAULT_CALENDAR_NAME)
 
-    if not isinstance(event, Event):
-        return True
-    try:
-        if not event.calendar:
-            calendar = Calendar._default_manager.get(name='default')
-    except Calendar.DoesNotExist:
-        name = getattr(settings, "EVENT_DEFAULT_CALENDAR_NAME", None) or u"default"
-        calendar = Calendar(
-            name = name,
-            slug = slugify(name),
-            category = get_default_category()
-        )
-        calendar.save()
-        event.calendar = calendar
-        
-    return True
+post_save.connect(forget_default_calendar, sender=Calendar)
+post_delete.connect(forget_default_calendar, sender=Calendar)
+
+def disable_default_calendar():
+    """
+    Stops assigning the default calendar to events saved without one in the
+    current thread, e.g. for bulk importers which set the calendar of every
+    event themselves, until the matching enable_default_calendar call.
+    Calls nest.
+    """
+    _state.disabled = getattr(_state, 'disabled', 0) + 1
+
+def enable_default_calendar():
+    _state.disabled = max(getattr(_state, 'disabled', 0) - 1, 0)
+
+def disable_indexing():
+    """
+    Stops writing the journal, bumping calendar versions and updating the
+    visibility and place occupancy indexes for each event and occurrence
+    saved or deleted in the current thread, until the matching
+    enable_indexing call.  Bulk importers do it once per batch instead, see
+    JournalEntryManager.record_many, bump_version and
+    EventVisibilityManager.index_events.  Calls nest.
+    """
+    _state.indexing_disabled = getattr(_state, 'indexing_disabled', 0) + 1
+
+def enable_indexing():
+    _state.indexing_disabled = max(getattr(_state, 'indexing_disabled', 0) - 1, 0)
+
+def _not_indexed(sender):
+    return sender in (Event, Occurrence) and getattr(_state, 'indexing_disabled', 0)
+
+def optionnal_calendar(sender, instance, **kwargs):
+    # events with a calendar only cost the check of the column
+    if instance.calendar_id is None and not getattr(_state, 'disabled', 0):
+        instance.calendar_id = get_default_calendar_id()
+
+pre_save.connect(optionnal_calendar, sender=Event)
+
+
+def journal_save(sender, instance, created, **kwargs):
+    if _not_indexed(sender):
+        return
+    JournalEntry.objects.record(instance, created and 'created' or 'changed')
+
+def remember_deleted_event(sender, instance, **kwargs):
+    # the occurrences of the event are deleted before it and can not load it
+    # any more to tell their calendar
+    if not hasattr(_state, 'deleted_events'):
+        _state.deleted_events = {}
+    _state.deleted_events[instance.pk] = instance.calendar_id
+
+def journal_delete(sender, instance, **kwargs):
+    deleted_events = getattr(_state, 'deleted_events', {})
+    if _not_indexed(sender):
+        if sender is Event:
+            deleted_events.pop(instance.pk, None)
+        return
+    if sender is Occurrence:
+        JournalEntry.objects.record(instance, 'deleted',
+            deleted_events.get(instance.event_id))
+        return
+    if sender is Event:
+        deleted_events.pop(instance.pk, None)
+    JournalEntry.objects.record(instance, 'deleted')
+
+pre_delete.connect(remember_deleted_event, sender=Event)
+for sender in (Calendar, Rule, Event, Occurrence):
+    post_save.connect(journal_save, sender=sender)
+    post_delete.connect(journal_delete, sender=sender)
+
+
+def _get_occupancy_days(parent_event_id, rule_id, start, end):
+    """
+    Returns the parent event id and the days in the place occupancy index a
+    child event touches, or None for all days.
+    """
+    if parent_event_id is None or start is None or end is None:
+        return parent_event_id, set()
+    if rule_id is not None:
+        # the days of a recurring child are only known after expanding it
+        return parent_event_id, None
+    return parent_event_id, set(get_span_masks(start, end).keys())
+
+# the fields whose old values the indexes below need, by their keys in
+# _old_values
+_TRACKED_FIELDS = {
+    Event: (('parent_event', 'parent_event_id'), ('rule', 'rule_id'), ('start', 'start'),
+        ('end', 'end'), ('moved_start', 'moved_start'), ('moved_end', 'moved_end'),
+        ('calendar', 'calendar_id')),
+    Occurrence: (('start', 'start'), ('end', 'end')),
+}
+
+def remember_loaded_values(sender, instance, **kwargs):
+    # the values the instance was loaded or last saved with, so that saving
+    # it does not have to select them again
+    instance._loaded_values = dict([(key, getattr(instance, attname))
+        for key, attname in _TRACKED_FIELDS[sender]])
+    instance._event_values = None
+
+def remember_old_values(sender, instance, **kwargs):
+    # remember where the event or occurrence was, e.g. the days it left in
+    # the place occupancy index need a rebuild too
+    instance._old_values = None
+    if instance.pk is None or _not_indexed(sender):
+        return
+    if instance._state.db is not None and hasattr(instance, '_loaded_values'):
+        instance._old_values = instance._loaded_values
+        return
+    # built with the pk of a saved row
+    for old in sender.objects.filter(pk=instance.pk).values(
+            *[key for key, attname in _TRACKED_FIELDS[sender]]):
+        instance._old_values = old
+
+def _get_event_values(occurrence):
+    """
+    Returns the parent event id and calendar id of the event of
+    ``occurrence``, from the event it was loaded or expanded with if any, or
+    None once the event is deleted.
+    """
+    if getattr(occurrence, '_event_values', None) is None:
+        event = getattr(occurrence, '_event_cache', None)
+        if event is not None and event.pk == occurrence.event_id:
+            occurrence._event_values = (event.parent_event_id, event.calendar_id)
+        else:
+            occurrence._event_values = False
+            for values in Event.objects.filter(pk=occurrence.event_id).values_list(
+                    'parent_event', 'calendar'):
+                occurrence._event_values = values
+    return occurrence._event_values or None
+
+def _get_event_occupancy_changes(event):
+    # its span and the one of the occurrences moved by its exceptions, before
+    # and after the change
+    spans = [(event.parent_event_id, event.rule_id, event.start, event.end),
+        (event.parent_event_id, event.rule_id, event.moved_start, event.moved_end)]
+    old = getattr(event, '_old_values', None)
+    if old is not None:
+        spans.append((old['parent_event'], old['rule'], old['start'], old['end']))
+        spans.append((old['parent_event'], old['rule'], old['moved_start'], old['moved_end']))
+    return [_get_occupancy_days(*span) for span in spans]
+
+def _get_occurrence_occupancy_changes(occurrence):
+    # its span, its original one and the one it had before the change; the
+    # occurrences of a deleted event go with it
+    values = _get_event_values(occurrence)
+    if values is None or values[0] is None:
+        return []
+    spans = [(occurrence.start, occurrence.end),
+        (occurrence.original_start, occurrence.original_end)]
+    old = getattr(occurrence, '_old_values', None)
+    if old is not None:
+        spans.append((old['start'], old['end']))
+    return [_get_occupancy_days(values[0], None, start, end) for start, end in spans]
+
+def occupancy_changed(sender, instance, **kwargs):
+    if _not_indexed(sender):
+        return
+    if sender is Occurrence:
+        changes = _get_occurrence_occupancy_changes(instance)
+    else:
+        changes = _get_event_occupancy_changes(instance)
+    rebuild = {}
+    for parent_id, days in changes:
+        if parent_id is None:
+            continue
+        if days is None or (parent_id in rebuild and rebuild[parent_id] is None):
+            rebuild[parent_id] = None
+        else:
+            rebuild[parent_id] = rebuild.get(parent_id, set()) | days
+    for parent_id, days in rebuild.items():
+        try:
+            parent = Event.objects.get(pk=parent_id)
+        except Event.DoesNotExist:
+            # deleted along with its children
+            continue
+        PlaceOccupancy.objects.rebuild(parent, days)
+
+for sender in (Event, Occurrence):
+    post_init.connect(remember_loaded_values, sender=sender)
+    pre_save.connect(remember_old_values, sender=sender)
+for sender in (Event, Occurrence):
+    post_save.connect(occupancy_changed, sender=sender)
+    post_delete.connect(occupancy_changed, sender=sender)
+
+
+def calendar_changed(sender, instance, **kwargs):
+    if _not_indexed(sender):
+        return
+    if sender is Calendar:
+        calendar_ids = [instance.pk]
+    elif sender is Event:
+        calendar_ids = [instance.calendar_id]
+        old = getattr(instance, '_old_values', None)
+        if old is not None and old['calendar'] != instance.calendar_id:
+            calendar_ids.append(old['calendar'])
+    elif sender is Occurrence:
+        values = _get_event_values(instance)
+        calendar_ids = values is not None and [values[1]] or []
+    else:
+        calendar_ids = Event.objects.filter(rule=instance).values_list('calendar', flat=True).distinct()
+    for calendar_id in calendar_ids:
+        if calendar_id is not None:
+            bump_version(calendar_id)
+
+for sender in (Calendar, Rule, Event, Occurrence):
+    post_save.connect(calendar_changed, sender=sender)
+    post_delete.connect(calendar_changed, sender=sender)
+
+
+def visibility_changed(sender, instance, created=False, **kwargs):
+    if _not_indexed(sender):
+        return
+    # rows of deleted relations and events go with them
+    if sender is EventRelation:
+        EventVisibility.objects.index_event_relation(instance)
+    elif sender is CalendarRelation:
+        EventVisibility.objects.index_calendar_relation(instance)
+    else:
+        old = getattr(instance, '_old_values', None)
+        if created or (old is not None and old['calendar'] != instance.calendar_id):
+            EventVisibility.objects.index_event_calendar(instance)
+
+for sender in (EventRelation, CalendarRelation, Event):
+    post_save.connect(visibility_changed, sender=sender)
+
+
+def remember_saved_values(sender, instance, **kwargs):
+    # after the receivers above, which compare with the old values
+    remember_loaded_values(sender, instance)
+
+for sender in (Event, Occurrence):
+    post_save.connect(remember_saved_values, sender=sender)
+
+
+def relation_changed(sender, instance, **kwargs):
+    # the calendars and events visible to the related object
+    bump_object_version(instance.content_type_id, instance.object_id)
 
-pre_save.connect(optionnal_calendar)
+for sender in (EventRelation, CalendarRelation):
+    post_save.connect(relation_changed, sender=sender)
+    post_delete.connect(relation_changed, sender=sender)
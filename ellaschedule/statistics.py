@@ -0,0 +1,113 @@
+"""
+Occurrence statistics of calendars, e.g. for heatmaps of a year.
+
+The occurrences are reduced to arrays of start and end minutes and binned in
+one pass, with NumPy if it is installed and in pure python otherwise.
+"""
+import datetime
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from ellaschedule.freebusy import get_busy_spans, merge_spans
+
+MINUTES_PER_DAY = 24 * 60
+
+def get_window(start, end):
+    """
+    Widens start-end to whole days, returning the start and the number of
+    days.
+    """
+    start = datetime.datetime.combine(start.date(), datetime.time.min)
+    days = (end - start).days
+    if start + datetime.timedelta(days=days) < end:
+        days += 1
+    return start, days
+
+def get_minute_spans(calendars, start, days, categories=None):
+    """
+    Returns the (start, end) minutes since ``start`` of the occurrences of
+    ``calendars`` (in ``categories`` if given) which overlap the ``days``
+    days from start.  Ends are clipped to the window, starts are not, so
+    occurrences which started before it are told by a negative start.
+    """
+    end = start + datetime.timedelta(days=days)
+    length = days * MINUTES_PER_DAY
+    spans = []
+    for o_start, o_end in get_busy_spans(calendars, start, end, categories):
+        o_start = o_start - start
+        o_end = o_end - start
+        s = o_start.days * MINUTES_PER_DAY + o_start.seconds // 60
+        e = o_end.days * MINUTES_PER_DAY + (o_end.seconds + 59) // 60
+        if s >= length or (s < 0 and e <= 0):
+            continue
+        spans.append((s, min(e, length)))
+    return spans
+
+def get_histograms(calendars, start, end, categories=None):
+    """
+    Returns the occurrence histograms of ``calendars`` (in ``categories`` if
+    given) over the days from start to end, as a dict of lists:
+
+    ``day_counts``, ``hour_counts``
+        the number of occurrences starting on each day of the window and in
+        each hour of the day (0-23) over the whole window
+    ``day_minutes``, ``hour_minutes``
+        the minutes during which at least one of the occurrences is on, by
+        day and by hour of the day
+
+    Cancelled occurrences are left out.  The window is widened to whole
+    days, ``start`` and ``days`` of the result give it.
+    """
+    start, days = get_window(start, end)
+    spans = get_minute_spans(calendars, start, days, categories)
+    if numpy is not None:
+        histograms = _numpy_histograms(spans, days)
+    else:
+        histograms = _python_histograms(spans, days)
+    histograms['start'] = start
+    histograms['days'] = days
+    return histograms
+
+def _numpy_histograms(spans, days):
+    length = days * MINUTES_PER_DAY
+    spans = numpy.array(spans, dtype=numpy.int64).reshape((len(spans), 2))
+    starts, ends = spans[:, 0], spans[:, 1]
+    counted = starts[starts >= 0]
+
+    # +1 where an occurrence starts, -1 where it ends, the running sum tells
+    # how many are on in each minute
+    changes = numpy.bincount(numpy.maximum(starts, 0), minlength=length + 1) - \
+        numpy.bincount(ends, minlength=length + 1)
+    busy = (numpy.cumsum(changes)[:length] > 0).reshape((days, 24, 60))
+    return {
+        'day_counts': numpy.bincount(counted // MINUTES_PER_DAY, minlength=days).tolist(),
+        'hour_counts': numpy.bincount(counted % MINUTES_PER_DAY // 60, minlength=24).tolist(),
+        'day_minutes': busy.sum(2).sum(1).tolist(),
+        'hour_minutes': busy.sum(2).sum(0).tolist(),
+    }
+
+def _python_histograms(spans, days):
+    day_counts = [0] * days
+    hour_counts = [0] * 24
+    day_minutes = [0] * days
+    hour_minutes = [0] * 24
+    for s, e in spans:
+        if s >= 0:
+            day_counts[s // MINUTES_PER_DAY] += 1
+            hour_counts[s % MINUTES_PER_DAY // 60] += 1
+    for s, e in merge_spans(spans, 0):
+        # walk the busy span hour by hour
+        while s < e:
+            next_hour = min((s // 60 + 1) * 60, e)
+            day_minutes[s // MINUTES_PER_DAY] += next_hour - s
+            hour_minutes[s % MINUTES_PER_DAY // 60] += next_hour - s
+            s = next_hour
+    return {
+        'day_counts': day_counts,
+        'hour_counts': hour_counts,
+        'day_minutes': day_minutes,
+        'hour_minutes': hour_minutes,
+    }
@@ -1,9 +1,13 @@
 import datetime
 from django.conf import settings
 from django import template
-from django.core.urlresolvers import reverse
+from django.contrib.contenttypes.models import ContentType
 from django.utils.dateformat import format
-from schedule.conf.settings import CHECK_PERMISSION_FUNC
+from ellaschedule.conf.settings import BUSY_DAYS_CACHE
+from ellaschedule.cache import get_busy_days, is_busy_day
+from ellaschedule.utils import get_edit_permissions, get_add_permission
+from ellaschedule import urltemplates
+from ellaschedule.urltemplates import url_template
 from schedule.models import Calendar
 from schedule.periods import weekday_names, weekday_abbrs,  Month
 
@@ -27,11 +31,20 @@ def month_table(context,  calendar, month, size="regular", shift=None):
 
 @register.inclusion_tag("schedule/_day_cell.html",  takes_context=True)
 def day_cell(context,  calendar, day, month, size="regular" ):
+    if day.start.month != month.start.month:
+        # days of the neighbouring months only pad the table
+        busy = False
+    elif size == "small" and BUSY_DAYS_CACHE:
+        # small cells only tell busy days from free ones
+        busy = is_busy_day(get_busy_days(calendar, day.start.year), day.start.date())
+    else:
+        busy = day.has_occurrences()
     context.update({
         'calendar' : calendar,
         'day' : day,
         'month' : month,
-        'size' : size
+        'size' : size,
+        'busy' : busy,
     })
     return context
 
@@ -48,11 +61,13 @@ def daily_table( context, day, width, width_slot, height, start=8, end=20, incre
       end - hour at which the day ends
       increment - size of a time slot (in minutes)
     """
-    user = context['request'].user
-    context['addable'] = CHECK_PERMISSION_FUNC(None, user)
+    request = context['request']
+    context['addable'] = get_add_permission(request)
     width_occ = width - width_slot
     day_part = day.get_time_slot(day.start  + datetime.timedelta(hours=start), day.start  + datetime.timedelta(hours=end))
     occurrences = day_part.get_occurrences()
+    # the options of the occurrences check the permissions of their event
+    get_edit_permissions(request, [o.event for o in occurrences])
     occurrences = _cook_occurrences(day_part, occurrences, width_occ, height)
     # get slots to display on the left
     slots = _cook_slots(day_part, increment, width, height)
@@ -78,13 +93,13 @@ def options(context, occurrence ):
         'MEDIA_URL' : getattr(settings, "MEDIA_URL"),
     })
     context['view_occurrence'] = occurrence.get_absolute_url()
-    user = context['request'].user
-    if CHECK_PERMISSION_FUNC(occurrence.event, user):
+    if get_edit_permissions(context['request'], [occurrence.event])[occurrence.event.id]:
         context['edit_occurrence'] = occurrence.get_edit_url()
-        print context['edit_occurrence']
         context['cancel_occurrence'] = occurrence.get_cancel_url()
-        context['delete_event'] = reverse('delete_event', args=(occurrence.event.id,))
-        context['edit_event'] = reverse('edit_event', args=(occurrence.event.calendar.slug, occurrence.event.id,))
+        context['delete_event'] = url_template('delete_event', 'event_id')(
+            event_id=occurrence.event.id)
+        context['edit_event'] = url_template('edit_event', 'calendar_slug', 'event_id')(
+            calendar_slug=occurrence.event.calendar.slug, event_id=occurrence.event.id)
     else:
         context['edit_event'] = context['delete_event'] = ''
     return context
@@ -95,14 +110,29 @@ def create_event_url(context, calendar, slot ):
         'calendar' : calendar,
         'MEDIA_URL' : getattr(settings, "MEDIA_URL"),
     })
-    lookup_context = {
-        'calendar_slug': calendar.slug,
-    }
     context['create_event_url'] ="%s%s" % (
-        reverse( "calendar_create_event", kwargs=lookup_context),
+        url_template("calendar_create_event", 'calendar_slug')(calendar_slug=calendar.slug),
         querystring_for_date(slot))
     return context
 
+def get_calendar_memo(context):
+    """
+    Returns the {(content type id, object id, distinction): [calendars]}
+    memo of the get_calendar tags, kept on the request if it is in the
+    context and for the rendered template otherwise, so that each object is
+    resolved once.
+    """
+    request = context.get('request', None)
+    if request is not None:
+        return request.__dict__.setdefault('_schedule_calendars', {})
+    memo = context.render_context.get('_schedule_calendars')
+    if memo is None:
+        memo = context.render_context['_schedule_calendars'] = {}
+    return memo
+
+def get_calendar_key(obj, distinction):
+    return (ContentType.objects.get_for_model(type(obj)).id, obj.id, distinction)
+
 class CalendarNode(template.Node):
     def __init__(self, content_object, distinction, context_var, create=False):
         self.content_object = template.Variable(content_object)
@@ -110,8 +140,12 @@ class CalendarNode(template.Node):
         self.context_var = context_var
 
     def render(self, context):
-        calendar = Calendar.objects.get_calendar_for_object(self.content_object.resolve(context), self.distinction)
-        context[self.context_var] = Calendar.objects.get_calendar_for_object(self.content_object.resolve(context), self.distinction)
+        obj = self.content_object.resolve(context)
+        memo = get_calendar_memo(context)
+        key = get_calendar_key(obj, self.distinction)
+        if key not in memo:
+            memo[key] = list(Calendar.objects.get_calendars_for_object(obj, self.distinction))
+        context[self.context_var] = Calendar.objects.get_single_calendar(memo[key])
         return ''
 
 def do_get_calendar_for_object(parser, token):
@@ -125,6 +159,31 @@ def do_get_calendar_for_object(parser, token):
         raise template.TemplateSyntaxError, "%r tag follows form %r <content_object> as <context_var>" % (token.contents.split()[0], token.contents.split()[0])
     return CalendarNode(content_object, distinction, context_var)
 
+class PrefetchCalendarsNode(template.Node):
+    def __init__(self, objects, distinction):
+        self.objects = template.Variable(objects)
+        self.distinction = distinction
+
+    def render(self, context):
+        memo = get_calendar_memo(context)
+        objs = [obj for obj in self.objects.resolve(context)
+            if get_calendar_key(obj, self.distinction) not in memo]
+        for obj, calendars in Calendar.objects.get_calendars_for_objects(objs,
+                self.distinction).items():
+            memo[get_calendar_key(obj, self.distinction)] = calendars
+        return ''
+
+def do_prefetch_calendars(parser, token):
+    contents = token.split_contents()
+    if len(contents) == 2:
+        tag_name, objects = contents
+        distinction = None
+    elif len(contents) == 3:
+        tag_name, objects, distinction = contents
+    else:
+        raise template.TemplateSyntaxError, "%r tag follows form %r <objects> [<distinction>]" % (contents[0], contents[0])
+    return PrefetchCalendarsNode(objects, distinction)
+
 class CreateCalendarNode(template.Node):
     def __init__(self, content_object, distinction, context_var, name):
         self.content_object = template.Variable(content_object)
@@ -163,26 +222,23 @@ def do_get_or_create_calendar_for_object(parser, token):
     return CreateCalendarNode(obj, distinction, context_var, name)
 
 register.tag('get_calendar', do_get_calendar_for_object)
+register.tag('prefetch_calendars', do_prefetch_calendars)
 register.tag('get_or_create_calendar', do_get_or_create_calendar_for_object)
 
 @register.simple_tag
 def querystring_for_date(date, num=6):
-    query_string = '?'
-    qs_parts = ['year=%d', 'month=%d', 'day=%d', 'hour=%d', 'minute=%d', 'second=%d']
-    qs_vars = (date.year, date.month, date.day, date.hour, date.minute, date.second)
-    query_string += '&'.join(qs_parts[:num]) % qs_vars[:num]
-    return query_string
+    return urltemplates.querystring_for_date(date, num)
 
 @register.simple_tag
 def prev_url(target, slug, period):
     return '%s%s' % (
-        reverse(target, kwargs=dict(calendar_slug=slug)),
+        url_template(target, 'calendar_slug')(calendar_slug=slug),
             querystring_for_date(period.prev().start))
 
 @register.simple_tag
 def next_url(target, slug, period):
     return '%s%s' % (
-        reverse(target, kwargs=dict(calendar_slug=slug)),
+        url_template(target, 'calendar_slug')(calendar_slug=slug),
             querystring_for_date(period.next().start))
 
 @register.inclusion_tag("schedule/_prevnext.html")
@@ -3,4 +3,18 @@ from test_utils import *
 from test_periods import *
 from test_templatetags import *
 from test_views import *
-
+from test_feeds import *
+from test_journal import *
+from test_expansion import *
+from test_freebusy import *
+from test_conflicts import *
+from test_occupancy import *
+from test_cache import *
+from test_statistics import *
+from test_series import *
+from test_visibility import *
+from test_relations import *
+from test_urltemplates import *
+from test_signals import *
+from test_packing import *
+from test_import_ical import *
@@ -0,0 +1,209 @@
+import datetime
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from ellaschedule import utils
+from ellaschedule.cache import get_version, get_busy_days, compute_busy_days, is_busy_day, \
+    get_visible_ids, get_visible_events, get_cached_occurrences, clear_occurrence_buckets, \
+    LRUCache
+from ellaschedule.models import Event, Calendar, Rule, EventRelation, CalendarRelation
+
+class TestBusyDays(TestCase):
+    def setUp(self):
+        self.cal = Calendar(name="MyCal")
+        self.cal.save()
+        rule = Rule(frequency="WEEKLY")
+        rule.save()
+        self.event = Event(title='Weekly', calendar=self.cal, rule=rule,
+            start=datetime.datetime(2008, 1, 5, 8, 0), end=datetime.datetime(2008, 1, 5, 9, 0),
+            end_recurring_period=datetime.datetime(2008, 2, 1, 0, 0))
+        self.event.save()
+
+    def test_compute_busy_days(self):
+        bitmap = compute_busy_days(self.cal, 2008)
+        busy = [day for day in range(1, 32) if is_busy_day(bitmap, datetime.date(2008, 1, day))]
+        self.assertEqual(busy, [5, 12, 19, 26])
+        self.assertFalse(is_busy_day(bitmap, datetime.date(2008, 2, 2)))
+
+    def test_version_bumped(self):
+        bitmap = get_busy_days(self.cal, 2008)
+        version = get_version(self.cal.id)
+        self.event.end_recurring_period = datetime.datetime(2008, 3, 1, 0, 0)
+        self.event.save()
+        self.assertNotEqual(get_version(self.cal.id), version)
+        cal = Calendar.objects.get(pk=self.cal.pk)
+        self.assertTrue(is_busy_day(get_busy_days(cal, 2008), datetime.date(2008, 2, 2)))
+
+
+class TestVisibleIds(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='viewer')
+        self.cal = Calendar(name="MyCal")
+        self.cal.save()
+        self.other_cal = Calendar(name="Other")
+        self.other_cal.save()
+        self.events = []
+        for cal in (self.cal, self.other_cal):
+            event = Event(title=cal.name, calendar=cal, start=datetime.datetime(2008, 1, 5, 8, 0),
+                end=datetime.datetime(2008, 1, 5, 9, 0))
+            event.save()
+            self.events.append(event)
+
+    def get_visible(self, distinction=None):
+        # a fresh user, as in a new request
+        user = User.objects.get(pk=self.user.pk)
+        return sorted([event.title for event in get_visible_events(Event.objects.all(),
+            user, distinction)])
+
+    def test_visible_events(self):
+        self.assertEqual(self.get_visible(), [])
+        self.cal.create_relation(self.user, 'viewer')
+        self.assertEqual(self.get_visible(), ['MyCal'])
+        relation = EventRelation.objects.create_relation(self.events[1], self.user, 'owner')
+        self.assertEqual(self.get_visible(), ['MyCal', 'Other'])
+        self.assertEqual(self.get_visible('owner'), ['Other'])
+        relation.delete()
+        self.assertEqual(self.get_visible(), ['MyCal'])
+
+    def test_not_inheritable(self):
+        self.cal.create_relation(self.user, 'viewer', False)
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(get_visible_ids(user), (set([self.cal.pk]), set(), set()))
+        self.assertEqual(self.get_visible(), [])
+
+    def test_bulk_changes(self):
+        CalendarRelation.objects.relate([self.other_cal], [self.user], 'viewer')
+        self.assertEqual(self.get_visible('viewer'), ['Other'])
+        CalendarRelation.objects.change_distinction('viewer', 'owner')
+        self.assertEqual(self.get_visible('viewer'), [])
+        CalendarRelation.objects.remove_relations([self.other_cal], [self.user])
+        self.assertEqual(self.get_visible(), [])
+
+
+class TestOccurrenceCache(TestCase):
+    def setUp(self):
+        clear_occurrence_buckets()
+        self.cal = Calendar(name="MyCal")
+        self.cal.save()
+        rule = Rule(frequency="WEEKLY")
+        rule.save()
+        self.weekly = Event(title='Weekly', calendar=self.cal, rule=rule,
+            start=datetime.datetime(2008, 1, 5, 8, 0), end=datetime.datetime(2008, 1, 5, 9, 0),
+            end_recurring_period=datetime.datetime(2008, 3, 1, 0, 0))
+        self.weekly.save()
+        # spans the end of January
+        Event(title='Trip', calendar=self.cal, start=datetime.datetime(2008, 1, 31, 10, 0),
+            end=datetime.datetime(2008, 2, 2, 10, 0)).save()
+        occurrence = self.weekly.get_occurrence(datetime.datetime(2008, 1, 12, 8, 0))
+        occurrence.title = u'Persisted'
+        occurrence.description = u'Room 2'
+        occurrence.save()
+        self.weekly = Event.objects.get(pk=self.weekly.pk)
+        self.weekly.get_occurrence(datetime.datetime(2008, 1, 19, 8, 0)).move(
+            datetime.datetime(2008, 1, 20, 8, 0), datetime.datetime(2008, 1, 20, 9, 0))
+        self.old_expand = utils.expand_occurrences
+
+    def tearDown(self):
+        utils.expand_occurrences = self.old_expand
+
+    def get_fields(self, occurrences):
+        return [(o.start, o.end, o.event_id, o.cancelled, o.pk, o.original_start, o.title)
+            for o in occurrences]
+
+    def expand(self, start, end):
+        return [occurrence or event._create_occurrence(o_start, o_end) for o_start, o_end,
+            event, occurrence in self.old_expand(Event.objects.all(), start, end)]
+
+    def test_same_as_expansion(self):
+        for start, end in [
+                (datetime.datetime(2008, 1, 1), datetime.datetime(2008, 2, 1)),
+                (datetime.datetime(2008, 1, 14), datetime.datetime(2008, 1, 21)),
+                (datetime.datetime(2008, 2, 1), datetime.datetime(2008, 2, 2)),
+                (datetime.datetime(2007, 12, 1), datetime.datetime(2008, 3, 1))]:
+            expected = self.get_fields(self.expand(start, end))
+            self.assertEqual(self.get_fields(get_cached_occurrences(Event.objects.all(),
+                start, end)), expected)
+            # from the process, then from the cache backend
+            self.assertEqual(self.get_fields(get_cached_occurrences(Event.objects.all(),
+                start, end)), expected)
+            clear_occurrence_buckets()
+            self.assertEqual(self.get_fields(get_cached_occurrences(Event.objects.all(),
+                start, end)), expected)
+        occurrences = get_cached_occurrences(Event.objects.all(),
+            datetime.datetime(2008, 1, 12), datetime.datetime(2008, 1, 13))
+        self.assertEqual([(o.title, o.description) for o in occurrences],
+            [(u'Persisted', u'Room 2')])
+
+    def test_window_boundaries(self):
+        # windows ending where an occurrence starts and starting where one
+        # ends, for generated, persisted and one time occurrences
+        for start, end in [
+                (datetime.datetime(2008, 1, 5, 9, 0), datetime.datetime(2008, 1, 12, 8, 0)),
+                (datetime.datetime(2008, 1, 12, 9, 0), datetime.datetime(2008, 1, 26, 8, 0)),
+                (datetime.datetime(2008, 1, 26, 9, 0), datetime.datetime(2008, 1, 31, 10, 0)),
+                (datetime.datetime(2008, 2, 2, 10, 0), datetime.datetime(2008, 2, 9, 8, 0))]:
+            expected = self.get_fields(self.expand(start, end))
+            self.assertEqual(self.get_fields(get_cached_occurrences(Event.objects.all(),
+                start, end)), expected)
+        # as in the expansion, the generated occurrence starting at the end
+        # is in, the persisted one is not
+        self.assertEqual([o.start for o in get_cached_occurrences(Event.objects.all(),
+            datetime.datetime(2008, 1, 12, 9, 0), datetime.datetime(2008, 1, 26, 8, 0))], [
+            datetime.datetime(2008, 1, 12, 8, 0), datetime.datetime(2008, 1, 20, 8, 0),
+            datetime.datetime(2008, 1, 26, 8, 0)])
+        self.assertEqual([o.start for o in get_cached_occurrences(Event.objects.all(),
+            datetime.datetime(2008, 1, 5, 9, 0), datetime.datetime(2008, 1, 12, 8, 0))],
+            [datetime.datetime(2008, 1, 5, 8, 0)])
+
+    def test_month_boundary(self):
+        rule = Rule(frequency="DAILY")
+        rule.save()
+        Event(title='Daily', calendar=self.cal, rule=rule,
+            start=datetime.datetime(2008, 1, 30, 0, 0), end=datetime.datetime(2008, 1, 30, 1, 0),
+            end_recurring_period=datetime.datetime(2008, 2, 3, 0, 0)).save()
+        start, end = datetime.datetime(2008, 1, 1), datetime.datetime(2008, 2, 1)
+        occurrences = get_cached_occurrences(Event.objects.all(), start, end)
+        self.assertEqual(self.get_fields(occurrences), self.get_fields(self.expand(start, end)))
+        self.assertEqual(occurrences[-1].start, datetime.datetime(2008, 2, 1, 0, 0))
+
+    def test_buckets_reused(self):
+        get_cached_occurrences(Event.objects.all(), datetime.datetime(2008, 1, 1),
+            datetime.datetime(2008, 2, 1))
+        def expand_occurrences(*args, **kwargs):
+            self.fail("expanded again")
+        utils.expand_occurrences = expand_occurrences
+        for start, end in [
+                (datetime.datetime(2008, 1, 14), datetime.datetime(2008, 1, 21)),
+                (datetime.datetime(2008, 1, 31), datetime.datetime(2008, 2, 1))]:
+            self.assertEqual(self.get_fields(get_cached_occurrences(Event.objects.all(),
+                start, end)), self.get_fields(self.expand(start, end)))
+
+    def test_invalidated(self):
+        start, end = datetime.datetime(2008, 1, 1), datetime.datetime(2008, 2, 1)
+        get_cached_occurrences(Event.objects.all(), start, end)
+        # an occurrence saved, then occurrences updated by a query
+        self.weekly.get_occurrence(datetime.datetime(2008, 1, 5, 8, 0)).cancel()
+        self.assertEqual(self.get_fields(get_cached_occurrences(Event.objects.all(), start, end)),
+            self.get_fields(self.expand(start, end)))
+        weekly = Event.objects.get(pk=self.weekly.pk)
+        weekly.cancel_range(datetime.datetime(2008, 1, 12), datetime.datetime(2008, 1, 13))
+        occurrences = get_cached_occurrences(Event.objects.all(), start, end)
+        self.assertEqual(self.get_fields(occurrences), self.get_fields(self.expand(start, end)))
+        self.assertEqual([o.pk is not None for o in occurrences if o.cancelled], [False, True])
+
+    def test_lru(self):
+        lru = LRUCache(2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        self.assertEqual(lru.get('a'), 1)
+        lru.set('c', 3)
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')), (1, None, 3))
+        lru.set('a', 4)
+        lru.set('d', 5)
+        self.assertEqual((lru.get('a'), lru.get('c'), len(lru)), (4, None, 2))
+        lru.clear()
+        self.assertEqual((lru.get('a'), len(lru)), (None, 0))
+        disabled = LRUCache(0)
+        disabled.set('a', 1)
+        self.assertEqual(disabled.get('a'), None)
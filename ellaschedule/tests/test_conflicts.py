@@ -0,0 +1,74 @@
+import datetime
+
+from django.test import TestCase
+from django.forms import ValidationError
+
+from ellaschedule.models import Event, Rule, Calendar
+from ellaschedule.conflicts import find_conflicts, find_event_conflicts
+from ellaschedule.forms import EventForm
+
+class TestConflicts(TestCase):
+    def setUp(self):
+        weekly = Rule(frequency = "WEEKLY")
+        weekly.save()
+        self.cal1 = Calendar(name="Cal 1")
+        self.cal1.save()
+        self.cal2 = Calendar(name="Cal 2")
+        self.cal2.save()
+        self.conference = Event(title='Conference', calendar=self.cal1,
+            start=datetime.datetime(2008, 1, 7, 8, 0), end=datetime.datetime(2008, 1, 9, 18, 0))
+        self.conference.save()
+        self.weekly = Event(title='Weekly Meeting', calendar=self.cal2, place='Room 1',
+            start=datetime.datetime(2008, 1, 1, 9, 0), end=datetime.datetime(2008, 1, 1, 10, 0),
+            end_recurring_period=datetime.datetime(2008, 5, 5, 0, 0), rule=weekly)
+        self.weekly.save()
+        self.talk = Event(title='Talk', calendar=self.cal1, place='room  1',
+            parent_event=self.conference,
+            start=datetime.datetime(2008, 1, 8, 9, 30), end=datetime.datetime(2008, 1, 8, 11, 0))
+        self.talk.save()
+
+    def test_find_conflicts(self):
+        conflicts = find_conflicts([self.cal1, self.cal2],
+            datetime.datetime(2008, 1, 1), datetime.datetime(2008, 2, 1))
+        self.assertEqual([(kind, span[2].title, other[2].title, span[0])
+            for kind, key, span, other in conflicts],
+            [('place', 'Weekly Meeting', 'Talk', datetime.datetime(2008, 1, 8, 9, 0))])
+
+    def test_find_event_conflicts(self):
+        event = Event(title='Lunch', calendar=self.cal1,
+            start=datetime.datetime(2008, 1, 8, 12, 0), end=datetime.datetime(2008, 1, 8, 13, 0))
+        self.assertEqual([other[2].title for span, other in find_event_conflicts(event)],
+            ['Conference'])
+        event.start, event.end = datetime.datetime(2008, 1, 10, 12, 0), datetime.datetime(2008, 1, 10, 13, 0)
+        self.assertEqual(find_event_conflicts(event), [])
+
+    def test_event_form(self):
+        form = EventForm(calendar=self.cal1, check_conflicts=True)
+        form._errors = {}
+        form.cleaned_data = {
+            'place': 'Room 1',
+            'start': datetime.datetime(2008, 1, 15, 9, 30),
+            'end': datetime.datetime(2008, 1, 15, 10, 30),
+        }
+        self.assertRaises(ValidationError, form.clean)
+        form.cleaned_data['place'] = 'Room 2'
+        form.clean()
+
+    def test_event_form_exceptions(self):
+        weekly = Event(title='Standup', calendar=self.cal1, rule=self.weekly.rule,
+            start=datetime.datetime(2008, 1, 1, 12, 0), end=datetime.datetime(2008, 1, 1, 13, 0),
+            end_recurring_period=datetime.datetime(2008, 1, 20, 0, 0))
+        weekly.add_exception(datetime.datetime(2008, 1, 8, 12, 0))
+        weekly.save()
+        form = EventForm(instance=weekly, check_conflicts=True)
+        form._errors = {}
+        form.cleaned_data = {
+            'rule': weekly.rule,
+            'start': weekly.start,
+            'end': weekly.end,
+            'end_recurring_period': weekly.end_recurring_period,
+        }
+        # the occurrence during the conference is cancelled
+        form.clean()
+        weekly.remove_exception(datetime.datetime(2008, 1, 8, 12, 0))
+        self.assertRaises(ValidationError, form.clean)
@@ -0,0 +1,104 @@
+import datetime
+
+from django.test import TestCase
+from django.core.urlresolvers import reverse
+from django.test import Client
+from django.utils import simplejson
+
+from ellaschedule import views
+from ellaschedule.models import Event, Rule, Calendar, Occurrence
+from ellaschedule.utils import expand_occurrences, EventListManager
+
+class TestExpandOccurrences(TestCase):
+    def setUp(self):
+        weekly = Rule(frequency = "WEEKLY")
+        weekly.save()
+        self.cal = Calendar(name="MyCal", slug="mycal")
+        self.cal.save()
+        self.weekly = Event(**{
+                'title': 'Weekly Event',
+                'start': datetime.datetime(2008, 1, 5, 8, 0),
+                'end': datetime.datetime(2008, 1, 5, 9, 0),
+                'end_recurring_period' : datetime.datetime(2008, 5, 5, 0, 0),
+                'rule': weekly,
+                'calendar': self.cal
+               })
+        self.weekly.save()
+        self.single = Event(**{
+                'title': 'Single Event',
+                'start': datetime.datetime(2008, 1, 7, 10, 0),
+                'end': datetime.datetime(2008, 1, 7, 11, 0),
+                'calendar': self.cal
+               })
+        self.single.save()
+        moved = self.weekly.get_occurrence(datetime.datetime(2008, 1, 12, 8, 0))
+        moved.move(datetime.datetime(2008, 1, 13, 8, 0), datetime.datetime(2008, 1, 13, 9, 0))
+
+    def test_expand(self):
+        spans = expand_occurrences(Event.objects.all(),
+            datetime.datetime(2008, 1, 1), datetime.datetime(2008, 1, 15))
+        self.assertEqual([(start, event.title, occurrence is not None)
+            for start, end, event, occurrence in spans], [
+                (datetime.datetime(2008, 1, 5, 8, 0), 'Weekly Event', False),
+                (datetime.datetime(2008, 1, 7, 10, 0), 'Single Event', False),
+                (datetime.datetime(2008, 1, 13, 8, 0), 'Weekly Event', True),
+            ])
+
+    def test_occurrence_page(self):
+        manager = EventListManager(Event.objects.all())
+        page, cursor = manager.occurrence_page(datetime.datetime(2008, 1, 1), limit=2)
+        self.assertEqual([o.start for o in page],
+            [datetime.datetime(2008, 1, 5, 8, 0), datetime.datetime(2008, 1, 7, 10, 0)])
+        page, cursor = manager.occurrence_page(cursor=cursor, limit=2)
+        self.assertEqual([(o.start, o.id is not None) for o in page],
+            [(datetime.datetime(2008, 1, 13, 8, 0), True),
+             (datetime.datetime(2008, 1, 19, 8, 0), False)])
+
+    def test_occurrence_page_end_of_series(self):
+        page, cursor = self.weekly.occurrence_page(datetime.datetime(2008, 4, 20), limit=5)
+        self.assertEqual([o.start for o in page],
+            [datetime.datetime(2008, 4, 26, 8, 0), datetime.datetime(2008, 5, 3, 8, 0)])
+        self.assertEqual(cursor, None)
+
+    def test_occurrences_view(self):
+        response = Client().get(reverse('calendar_occurrences'), {
+            'calendar': 'mycal', 'start': '2008-01-01', 'end': '2008-01-15'})
+        self.assertEqual(response.status_code, 200)
+        data = simplejson.loads(response.content)
+        self.assertEqual(data['calendars'], ['mycal'])
+        self.assertEqual(data['events']['id'], [self.weekly.id, self.single.id])
+        self.assertEqual(data['occurrences']['event'], [0, 1, 0])
+        self.assertEqual(data['occurrences']['start'],
+            [4 * 86400 + 8 * 3600, 6 * 86400 + 10 * 3600, 12 * 86400 + 8 * 3600])
+        self.assertEqual(data['occurrences']['duration'], [3600, 3600, 3600])
+        self.assertEqual(data['occurrences']['id'][:2], [None, None])
+
+    def test_occurrences_view_shared_events(self):
+        # events GET_EVENTS_FUNC gives for both calendars come once
+        Calendar(name="Other", slug="other").save()
+        old_func = views.GET_EVENTS_FUNC
+        views.GET_EVENTS_FUNC = lambda request, calendar: Event.objects.all()
+        try:
+            response = Client().get(reverse('calendar_occurrences'), {
+                'calendar': ['mycal', 'other'], 'start': '2008-01-01', 'end': '2008-01-15'})
+        finally:
+            views.GET_EVENTS_FUNC = old_func
+        data = simplejson.loads(response.content)
+        self.assertEqual(data['events']['id'], [self.weekly.id, self.single.id])
+        self.assertEqual(data['occurrences']['event'], [0, 1, 0])
+
+    def test_occurrences_view_bad_window(self):
+        response = Client().get(reverse('calendar_occurrences'), {
+            'calendar': 'mycal', 'start': '2008-01-15', 'end': '2008-01-01'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_slim_events(self):
+        self.weekly.description = u'Long description'
+        self.weekly.save()
+        spans = expand_occurrences(self.cal.event_set.slim(),
+            datetime.datetime(2008, 1, 1), datetime.datetime(2008, 1, 15))
+        self.assertEqual([span[0].day for span in spans], [5, 7, 13])
+        event, occurrence = spans[2][2], spans[2][3]
+        self.assertFalse('description' in event.__dict__)
+        self.assertFalse('description' in occurrence.__dict__)
+        self.assertEqual(event.description, u'Long description')
@@ -0,0 +1,42 @@
+import datetime
+
+from django.test import TestCase
+
+from ellaschedule.models import Event, Rule, Calendar
+from ellaschedule.feeds import CalendarICalendar
+
+class TestCalendarICalendar(TestCase):
+    def setUp(self):
+        rule = Rule(frequency = "WEEKLY", params = "byweekday:5")
+        rule.save()
+        self.cal = Calendar(name="MyCal")
+        self.cal.save()
+        self.event = Event(**{
+                'title': 'Recent Event',
+                'start': datetime.datetime(2008, 1, 5, 8, 0),
+                'end': datetime.datetime(2008, 1, 5, 9, 0),
+                'end_recurring_period' : datetime.datetime(2008, 5, 5, 0, 0),
+                'rule': rule,
+                'calendar': self.cal
+               })
+        self.event.save()
+
+    def get_feed(self):
+        return CalendarICalendar()(None, self.cal.id).content
+
+    def test_rrule(self):
+        feed = self.get_feed()
+        self.assertEqual(feed.count('BEGIN:VEVENT'), 1)
+        self.assertTrue('RRULE:FREQ=WEEKLY;BYDAY=SA;UNTIL=20080505T000000' in feed)
+
+    def test_exceptions(self):
+        occurrences = self.event.get_occurrences(datetime.datetime(2008, 1, 12),
+            datetime.datetime(2008, 1, 27))
+        occurrences[0].cancel()
+        occurrences[1].move(datetime.datetime(2008, 1, 19, 10, 0),
+            datetime.datetime(2008, 1, 19, 11, 0))
+        feed = self.get_feed()
+        self.assertEqual(feed.count('BEGIN:VEVENT'), 2)
+        self.assertTrue('EXDATE:20080112T080000' in feed)
+        self.assertTrue('RECURRENCE-ID:20080119T080000' in feed)
+        self.assertTrue('DTSTART:20080119T100000' in feed)
@@ -0,0 +1,87 @@
+import datetime
+
+from django.test import TestCase
+from django.core.urlresolvers import reverse
+from django.test import Client
+from django.utils import simplejson
+
+from ellaschedule import views
+
+from ellaschedule.models import Event, Rule, Calendar
+from ellaschedule.freebusy import find_free_slots
+
+class TestFreeBusy(TestCase):
+    def setUp(self):
+        daily = Rule(frequency = "DAILY")
+        daily.save()
+        self.cal1 = Calendar(name="Room 1", slug="room-1")
+        self.cal1.save()
+        self.cal2 = Calendar(name="Room 2", slug="room-2")
+        self.cal2.save()
+        self.daily = Event(**{
+                'title': 'Daily Meeting',
+                'start': datetime.datetime(2008, 1, 1, 9, 0),
+                'end': datetime.datetime(2008, 1, 1, 10, 0),
+                'end_recurring_period' : datetime.datetime(2008, 5, 5, 0, 0),
+                'rule': daily,
+                'calendar': self.cal1
+               })
+        self.daily.save()
+        Event(**{
+                'title': 'Workshop',
+                'start': datetime.datetime(2008, 1, 2, 9, 30),
+                'end': datetime.datetime(2008, 1, 2, 12, 0),
+                'calendar': self.cal2
+               }).save()
+        self.daily.get_occurrence(datetime.datetime(2008, 1, 3, 9, 0)).cancel()
+
+    def test_free_busy(self):
+        busy = Calendar.objects.free_busy([self.cal1, self.cal2],
+            datetime.datetime(2008, 1, 1, 9, 30), datetime.datetime(2008, 1, 4))
+        self.assertEqual(busy, [
+            (datetime.datetime(2008, 1, 1, 9, 30), datetime.datetime(2008, 1, 1, 10, 0)),
+            (datetime.datetime(2008, 1, 2, 9, 0), datetime.datetime(2008, 1, 2, 12, 0)),
+        ])
+
+    def test_moved_into_window(self):
+        event = Event(title='Review', calendar=self.cal2,
+            start=datetime.datetime(2008, 1, 10, 14, 0), end=datetime.datetime(2008, 1, 10, 15, 0))
+        event.save()
+        # stored in the exceptions of the event, without an occurrence row
+        event.get_occurrence(event.start).move(datetime.datetime(2008, 1, 3, 14, 0),
+            datetime.datetime(2008, 1, 3, 15, 0))
+        busy = Calendar.objects.free_busy([self.cal2],
+            datetime.datetime(2008, 1, 3), datetime.datetime(2008, 1, 4))
+        self.assertEqual(busy, [
+            (datetime.datetime(2008, 1, 3, 14, 0), datetime.datetime(2008, 1, 3, 15, 0)),
+        ])
+
+    def test_vfreebusy(self):
+        response = Client().get(reverse('calendar_free_busy'), {
+            'calendar': ['room-1', 'room-2'], 'start': '2008-01-01', 'end': '2008-01-04'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue('BEGIN:VFREEBUSY' in response.content)
+        self.assertTrue('FREEBUSY' in response.content)
+
+    def test_free_busy_view_hidden_events(self):
+        arguments = {'calendar': ['room-1', 'room-2'], 'start': '2008-01-02',
+            'end': '2008-01-03', 'format': 'json'}
+        old_func = views.GET_EVENTS_FUNC
+        views.GET_EVENTS_FUNC = lambda request, calendar: calendar.event_set.exclude(
+            title='Workshop')
+        try:
+            response = Client().get(reverse('calendar_free_busy'), arguments)
+        finally:
+            views.GET_EVENTS_FUNC = old_func
+        self.assertEqual(simplejson.loads(response.content)['busy'],
+            [['2008-01-02 09:00:00', '2008-01-02 10:00:00']])
+
+    def test_find_free_slots(self):
+        slots = find_free_slots([self.cal1, self.cal2], datetime.timedelta(hours=2),
+            (datetime.datetime(2008, 1, 1), datetime.datetime(2008, 2, 1)), limit=3,
+            working_hours=(datetime.time(8, 0), datetime.time(17, 0)))
+        self.assertEqual(slots, [
+            (datetime.datetime(2008, 1, 1, 10, 0), datetime.datetime(2008, 1, 1, 17, 0)),
+            (datetime.datetime(2008, 1, 2, 12, 0), datetime.datetime(2008, 1, 2, 17, 0)),
+            (datetime.datetime(2008, 1, 3, 8, 0), datetime.datetime(2008, 1, 3, 17, 0)),
+        ])
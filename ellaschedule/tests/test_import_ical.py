@@ -0,0 +1,67 @@
+import datetime
+import os
+
+from dateutil import rrule
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+
+from ellaschedule.models import Event, Calendar, Rule, Occurrence, JournalEntry, \
+    EventVisibility, CalendarRelation
+
+ICS = os.path.join(os.path.dirname(__file__), 'data', 'recurring.ics')
+
+class TestImportIcal(TestCase):
+    def setUp(self):
+        call_command('import_ical', ICS, calendar='imported', verbosity=0)
+        self.calendar = Calendar.objects.get(slug='imported')
+
+    def get_occurrences(self, title):
+        event = Event.objects.get(calendar=self.calendar, title=title)
+        return [(o.start, o.cancelled) for o in event.get_occurrences(
+            datetime.datetime(2008, 1, 1), datetime.datetime(2008, 2, 1))]
+
+    def test_exdate_and_override(self):
+        self.assertEqual(self.get_occurrences('Weekly Meeting'), [
+            (datetime.datetime(2008, 1, 7, 9, 0), False),
+            (datetime.datetime(2008, 1, 14, 9, 0), True),
+            (datetime.datetime(2008, 1, 21, 11, 0), False),
+            (datetime.datetime(2008, 1, 28, 9, 0), False),
+        ])
+        # the override which only moves the occurrence is an exception of
+        # the event, the one with a description of its own a row
+        event = Event.objects.get(calendar=self.calendar, title='Weekly Meeting')
+        self.assertEqual(event.get_exceptions()[datetime.datetime(2008, 1, 21, 9, 0)],
+            (datetime.datetime(2008, 1, 21, 11, 0), datetime.datetime(2008, 1, 21, 12, 0)))
+        self.assertEqual([(o.original_start, o.description) for o in
+            Occurrence.objects.filter(event=event)],
+            [(datetime.datetime(2008, 1, 28, 9, 0), u'Room changed')])
+
+    def test_indexed_once(self):
+        events = Event.objects.filter(calendar=self.calendar)
+        self.assertEqual(sorted(JournalEntry.objects.filter(model='event',
+            action='created').values_list('object_id', flat=True)),
+            sorted(events.values_list('id', flat=True)))
+        self.assertEqual(JournalEntry.objects.filter(model='occurrence',
+            calendar_id=self.calendar.pk).count(), 1)
+        # the imported events inherit the relations of their calendar
+        calendar = Calendar(name='Related', slug='related')
+        calendar.save()
+        user = User.objects.create(username='viewer')
+        CalendarRelation.objects.relate([calendar], [user], 'viewer')
+        call_command('import_ical', ICS, calendar='related', verbosity=0)
+        self.assertEqual(EventVisibility.objects.filter(object_id=user.pk).count(), 2)
+
+    def test_positional_byday(self):
+        rule = Rule.objects.get(frequency='MONTHLY')
+        self.assertEqual(rule.get_params(), {'byweekday': [rrule.MO(+1), rrule.FR(-1)]})
+        event = Event.objects.get(calendar=self.calendar, title='Review')
+        self.assertEqual([o.start for o in event.get_occurrences(
+            datetime.datetime(2008, 1, 1), datetime.datetime(2008, 4, 1))], [
+            datetime.datetime(2008, 1, 7, 14, 0), datetime.datetime(2008, 1, 25, 14, 0),
+            datetime.datetime(2008, 2, 4, 14, 0), datetime.datetime(2008, 2, 29, 14, 0),
+            datetime.datetime(2008, 3, 3, 14, 0), datetime.datetime(2008, 3, 28, 14, 0),
+        ])
+        self.assertEqual(event.get_ical_rrule(),
+            'FREQ=MONTHLY;BYDAY=1MO,-1FR;UNTIL=20080401T000000')
@@ -0,0 +1,162 @@
+import datetime
+
+from django.test import TestCase
+
+from ellaschedule.models import Event, Rule, Calendar, JournalEntry
+
+class TestJournal(TestCase):
+    def setUp(self):
+        self.cal = Calendar(name="MyCal")
+        self.cal.save()
+        self.event = Event(**{
+                'title': 'Recent Event',
+                'start': datetime.datetime(2008, 1, 5, 8, 0),
+                'end': datetime.datetime(2008, 1, 5, 9, 0),
+                'calendar': self.cal
+               })
+        self.event.save()
+        self.token = JournalEntry.objects.get_changes(self.cal)['sync_token']
+
+    def test_full_sync(self):
+        changes = JournalEntry.objects.get_changes(self.cal)
+        self.assertTrue(changes['reset'])
+        self.assertTrue(('event', self.event.id) in
+            [(item['type'], item['id']) for item in changes['created']])
+
+    def test_delta_sync(self):
+        self.event.title = 'Changed Event'
+        self.event.save()
+        other = Event(title='Other Event', start=self.event.start,
+            end=self.event.end, calendar=self.cal)
+        other.save()
+        changes = JournalEntry.objects.get_changes(self.cal, self.token)
+        self.assertFalse(changes['reset'])
+        self.assertEqual([(item['type'], item['id']) for item in changes['changed']],
+            [('event', self.event.id)])
+        self.assertEqual([(item['type'], item['id']) for item in changes['created']],
+            [('event', other.id)])
+        self.assertEqual(changes['changed'][0]['data']['title'], 'Changed Event')
+
+        event_id = self.event.id
+        self.event.delete()
+        changes = JournalEntry.objects.get_changes(self.cal, changes['sync_token'])
+        self.assertEqual(changes['deleted'], [{'type': 'event', 'id': event_id}])
+
+    def test_compact_and_prune(self):
+        self.event.save()
+        self.event.save()
+        self.assertEqual(JournalEntry.objects.compact(), 2)
+        changes = JournalEntry.objects.get_changes(self.cal, self.token)
+        self.assertEqual([(item['type'], item['id']) for item in changes['changed']],
+            [('event', self.event.id)])
+
+        JournalEntry.objects.prune(datetime.datetime.now() + datetime.timedelta(days=1))
+        self.assertTrue(JournalEntry.objects.get_changes(self.cal, self.token)['reset'])
+
+    def test_visible_events(self):
+        other = Event(title='Private Event', start=self.event.start,
+            end=self.event.end, calendar=self.cal)
+        other.save()
+        visible = set([self.event.id])
+        changes = JournalEntry.objects.get_changes(self.cal, event_ids=visible)
+        self.assertEqual([item['id'] for item in changes['created'] if item['type'] == 'event'],
+            [self.event.id])
+
+        self.event.title = 'Changed Event'
+        self.event.save()
+        other.title = 'Changed Private Event'
+        other.save()
+        changes = JournalEntry.objects.get_changes(self.cal, self.token, visible)
+        self.assertEqual([(item['type'], item['id']) for item in changes['changed']],
+            [('event', self.event.id)])
+        self.assertEqual(changes['created'], [])
+        # an event the client saw before is gone for it once hidden
+        changes = JournalEntry.objects.get_changes(self.cal, self.token, set([other.id]))
+        self.assertEqual(changes['deleted'], [{'type': 'event', 'id': self.event.id}])
+
+    def test_moved_event(self):
+        occurrence = self.event.get_occurrence(self.event.start)
+        occurrence.title = 'Persisted'
+        occurrence.save()
+        other_cal = Calendar(name="Other")
+        other_cal.save()
+        token = JournalEntry.objects.get_changes(other_cal)['sync_token']
+        self.event.calendar = other_cal
+        self.event.save()
+        changes = JournalEntry.objects.get_changes(self.cal, token)
+        self.assertEqual(sorted([(item['type'], item['id']) for item in changes['deleted']]),
+            [('event', self.event.id), ('occurrence', occurrence.id)])
+        changes = JournalEntry.objects.get_changes(other_cal, token)
+        self.assertEqual(sorted([(item['type'], item['id']) for item in changes['changed']]),
+            [('event', self.event.id), ('occurrence', occurrence.id)])
+
+    def test_deleted_with_event(self):
+        occurrence = self.event.get_occurrence(self.event.start)
+        occurrence.title = 'Persisted'
+        occurrence.save()
+        other_cal = Calendar(name="Other")
+        other_cal.save()
+        token = JournalEntry.objects.get_changes(other_cal)['sync_token']
+        occurrence_id = occurrence.id
+        self.event.delete()
+        self.assertEqual(JournalEntry.objects.filter(model='occurrence', action='deleted',
+            object_id=occurrence_id).values_list('calendar_id', flat=True)[0], self.cal.id)
+        self.assertEqual(JournalEntry.objects.get_changes(other_cal, token)['deleted'], [])
+
+    def test_bulk_operations(self):
+        weekly = Rule(frequency="WEEKLY")
+        weekly.save()
+        event = Event(title='Weekly Meeting', calendar=self.cal, rule=weekly,
+            start=datetime.datetime(2008, 1, 7, 9, 0), end=datetime.datetime(2008, 1, 7, 10, 0),
+            end_recurring_period=datetime.datetime(2008, 3, 31, 0, 0))
+        event.save()
+        occurrences = []
+        for day in (7, 14, 21):
+            occurrence = event.get_occurrence(datetime.datetime(2008, 1, day, 9, 0))
+            occurrence.save()
+            occurrences.append(occurrence)
+        token = JournalEntry.objects.get_changes(self.cal)['sync_token']
+
+        def get_changed(token):
+            changes = JournalEntry.objects.get_changes(self.cal, token)
+            return changes['sync_token'], [(item['id'], item['data']) for item in
+                changes['changed'] if item['type'] == 'occurrence']
+
+        event.cancel_range(datetime.datetime(2008, 1, 7), datetime.datetime(2008, 1, 8))
+        token, changed = get_changed(token)
+        self.assertEqual([(pk, data['cancelled']) for pk, data in changed],
+            [(occurrences[0].id, True)])
+        event.shift_range(datetime.datetime(2008, 1, 14), datetime.datetime(2008, 1, 15),
+            datetime.timedelta(hours=1))
+        token, changed = get_changed(token)
+        self.assertEqual([(pk, data['start']) for pk, data in changed],
+            [(occurrences[1].id, datetime.datetime(2008, 1, 14, 10, 0))])
+        new_event = event.split_series_at(datetime.datetime(2008, 1, 20))
+        token, changed = get_changed(token)
+        self.assertEqual([(pk, data['event']) for pk, data in changed],
+            [(occurrences[2].id, new_event.id)])
+
+    def test_compact_after_move(self):
+        other_cal = Calendar(name="Other")
+        other_cal.save()
+        self.event.calendar = other_cal
+        self.event.save()
+        self.event.save()
+        JournalEntry.objects.compact()
+        changes = JournalEntry.objects.get_changes(self.cal, self.token)
+        self.assertEqual(changes['deleted'], [{'type': 'event', 'id': self.event.id}])
+
+    def test_visible_events_queryset(self):
+        other = Event(title='Private Event', start=self.event.start,
+            end=self.event.end, calendar=self.cal)
+        other.save()
+        self.event.title = 'Changed Event'
+        self.event.save()
+        visible = Event.objects.exclude(pk=other.pk)
+        changes = JournalEntry.objects.get_changes(self.cal, self.token, visible)
+        self.assertEqual([(item['type'], item['id']) for item in changes['changed']],
+            [('event', self.event.id)])
+        self.assertEqual(changes['created'], [])
+        changes = JournalEntry.objects.get_changes(self.cal, event_ids=visible)
+        self.assertEqual([item['id'] for item in changes['created'] if item['type'] == 'event'],
+            [self.event.id])
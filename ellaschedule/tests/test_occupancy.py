@@ -0,0 +1,70 @@
+import datetime
+
+from django.test import TestCase
+
+from ellaschedule.models import Event, Calendar, PlaceOccupancy
+
+class TestPlaceOccupancy(TestCase):
+    def setUp(self):
+        cal = Calendar(name="MyCal")
+        cal.save()
+        self.conference = Event(title='Conference', calendar=cal,
+            start=datetime.datetime(2008, 1, 7, 8, 0), end=datetime.datetime(2008, 1, 8, 18, 0))
+        self.conference.save()
+        self.talks = []
+        for title, place, start, end in (
+                ('Keynote', 'Hall', (2008, 1, 7, 9, 0), (2008, 1, 7, 10, 0)),
+                ('Talk 1', 'Room A', (2008, 1, 8, 14, 0), (2008, 1, 8, 15, 0)),
+                ('Talk 2', 'Room B', (2008, 1, 8, 13, 0), (2008, 1, 8, 14, 10))):
+            talk = Event(title=title, place=place, calendar=cal, parent_event=self.conference,
+                start=datetime.datetime(*start), end=datetime.datetime(*end))
+            talk.save()
+            self.talks.append(talk)
+
+    def test_free_places(self):
+        self.assertEqual(PlaceOccupancy.objects.get_free_places(self.conference,
+            datetime.datetime(2008, 1, 8, 14, 0), datetime.datetime(2008, 1, 8, 15, 0)),
+            ['Hall'])
+        self.assertEqual(PlaceOccupancy.objects.get_free_places(self.conference,
+            datetime.datetime(2008, 1, 8, 15, 0), datetime.datetime(2008, 1, 8, 16, 0)),
+            ['Hall', 'Room A', 'Room B'])
+
+    def test_incremental_rebuild(self):
+        talk = self.talks[1]
+        talk.start, talk.end = datetime.datetime(2008, 1, 7, 14, 0), datetime.datetime(2008, 1, 7, 15, 0)
+        talk.save()
+        self.assertEqual(PlaceOccupancy.objects.get_free_places(self.conference,
+            datetime.datetime(2008, 1, 8, 14, 30), datetime.datetime(2008, 1, 8, 15, 0)),
+            ['Hall', 'Room A', 'Room B'])
+        occupancy = PlaceOccupancy.objects.get(parent_event=self.conference,
+            place='Room A', day=datetime.date(2008, 1, 7))
+        self.assertFalse(occupancy.is_free(datetime.time(14, 30), datetime.time(16, 0)))
+
+    def test_occurrence_changes(self):
+        talk = self.talks[1]
+        talk.get_occurrence(talk.start).cancel()
+        self.assertEqual(PlaceOccupancy.objects.get_free_places(self.conference,
+            datetime.datetime(2008, 1, 8, 14, 0), datetime.datetime(2008, 1, 8, 15, 0)),
+            ['Hall', 'Room A'])
+        talk = Event.objects.get(pk=self.talks[2].pk)
+        occurrence = talk.get_occurrence(talk.start)
+        occurrence.save()
+        occurrence.move(datetime.datetime(2008, 1, 8, 16, 0), datetime.datetime(2008, 1, 8, 17, 0))
+        self.assertEqual(PlaceOccupancy.objects.get_free_places(self.conference,
+            datetime.datetime(2008, 1, 8, 13, 0), datetime.datetime(2008, 1, 8, 15, 0)),
+            ['Hall', 'Room A', 'Room B'])
+        self.assertEqual(PlaceOccupancy.objects.get_free_places(self.conference,
+            datetime.datetime(2008, 1, 8, 16, 0), datetime.datetime(2008, 1, 8, 17, 0)),
+            ['Hall', 'Room A'])
+        occurrence.delete()
+        self.assertEqual(PlaceOccupancy.objects.get_free_places(self.conference,
+            datetime.datetime(2008, 1, 8, 13, 0), datetime.datetime(2008, 1, 8, 14, 0)),
+            ['Hall', 'Room A'])
+
+    def test_structured_agenda(self):
+        agenda = self.conference.get_structured_agenda()
+        self.assertEqual([(day['date'], day['places']) for day in agenda], [
+            (datetime.date(2008, 1, 7), ['Hall']),
+            (datetime.date(2008, 1, 8), ['Room A', 'Room B']),
+        ])
+        self.assertEqual(agenda[1]['agenda'][datetime.time(14, 0)], [self.talks[1], None])
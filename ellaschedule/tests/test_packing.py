@@ -0,0 +1,55 @@
+import datetime
+
+from django.test import TestCase
+
+from ellaschedule.models import Event, Rule, Calendar
+from ellaschedule.packing import pack_occurrences, unpack_occurrences, inflate_occurrences
+
+class TestPacking(TestCase):
+    def setUp(self):
+        weekly = Rule(frequency = "WEEKLY")
+        weekly.save()
+        cal = Calendar(name="MyCal")
+        cal.save()
+        self.weekly = Event(title='Weekly', calendar=cal, rule=weekly,
+            start=datetime.datetime(2008, 1, 7, 9, 0), end=datetime.datetime(2008, 1, 7, 10, 0),
+            end_recurring_period=datetime.datetime(2008, 3, 31, 0, 0))
+        self.weekly.save()
+        self.single = Event(title='Single', calendar=cal,
+            start=datetime.datetime(2008, 1, 15, 8, 0), end=datetime.datetime(2008, 1, 15, 18, 0))
+        self.single.save()
+        persisted = self.weekly.get_occurrence(datetime.datetime(2008, 1, 14, 9, 0))
+        persisted.title = u'Persisted'
+        persisted.description = u'Room 2'
+        persisted.cancelled = True
+        persisted.save()
+        moved = self.weekly.get_occurrence(datetime.datetime(2008, 1, 21, 9, 0))
+        moved.move(datetime.datetime(2008, 1, 22, 9, 0), datetime.datetime(2008, 1, 22, 10, 0))
+        self.weekly = Event.objects.get(pk=self.weekly.pk)
+        self.events = {self.weekly.id: self.weekly, self.single.id: self.single}
+
+    def get_occurrences(self):
+        start, end = datetime.datetime(2008, 1, 1), datetime.datetime(2008, 2, 1)
+        return sorted(self.weekly.get_occurrences(start, end) +
+            self.single.get_occurrences(start, end), key=lambda o: o.start)
+
+    def get_fields(self, occurrences):
+        return [(o.start, o.end, o.event_id, o.cancelled, o.pk, o.original_start,
+            o.original_end) for o in occurrences]
+
+    def test_round_trip(self):
+        occurrences = self.get_occurrences()
+        for compress in (True, False):
+            items = unpack_occurrences(pack_occurrences(occurrences, compress))
+            inflated = inflate_occurrences(items, self.events)
+            self.assertEqual(self.get_fields(inflated), self.get_fields(occurrences))
+        self.assertEqual([(o.title, o.description) for o in inflated if o.pk is not None],
+            [(u'Persisted', u'Room 2')])
+        self.assertEqual([o.start for o in inflated if o.moved],
+            [datetime.datetime(2008, 1, 22, 9, 0)])
+
+    def test_empty(self):
+        self.assertEqual(unpack_occurrences(pack_occurrences([])), [])
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, unpack_occurrences, 'not packed')
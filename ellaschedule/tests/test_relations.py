@@ -0,0 +1,101 @@
+import datetime
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+
+from ellaschedule.models import Event, Calendar, EventRelation, CalendarRelation, EventVisibility, \
+    prefetch_content_objects
+
+class TestBulkRelations(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username='user%d' % i) for i in range(3)]
+        self.cal = Calendar(name="MyCal")
+        self.cal.save()
+        self.events = []
+        for day in (5, 6):
+            event = Event(title='Event %d' % day, calendar=self.cal,
+                start=datetime.datetime(2008, 1, day, 8, 0), end=datetime.datetime(2008, 1, day, 9, 0))
+            event.save()
+            self.events.append(event)
+
+    def get_titles(self, user, distinction=None):
+        return sorted([event.title for event in
+            EventRelation.objects.get_events_for_object(user, distinction)])
+
+    def test_relate_events(self):
+        count = EventRelation.objects.relate(self.events, self.users, 'viewer')
+        self.assertEqual(count, 6)
+        self.assertEqual(EventRelation.objects.filter(distinction='viewer').count(), 6)
+        self.assertEqual(self.get_titles(self.users[2], 'viewer'), ['Event 5', 'Event 6'])
+
+    def test_ignore_conflicts(self):
+        EventRelation.objects.create_relation(self.events[0], self.users[0], 'viewer')
+        count = EventRelation.objects.relate([event.pk for event in self.events],
+            self.users + [self.users[1]], 'viewer', ignore_conflicts=True)
+        self.assertEqual(count, 5)
+        self.assertEqual(EventRelation.objects.count(), 6)
+        # another distinction is not a conflict
+        self.assertEqual(EventRelation.objects.relate(self.events[:1], self.users[:1], 'owner',
+            ignore_conflicts=True), 1)
+
+    def test_relate_calendar(self):
+        CalendarRelation.objects.relate([self.cal], self.users[:2], 'viewer')
+        CalendarRelation.objects.relate([self.cal], self.users[2:], 'viewer', inheritable=False)
+        self.assertEqual(CalendarRelation.objects.filter(inheritable=True).count(), 2)
+        self.assertEqual(self.get_titles(self.users[1], 'viewer'), ['Event 5', 'Event 6'])
+        self.assertEqual(self.get_titles(self.users[2], 'viewer'), [])
+        self.assertEqual(CalendarRelation.objects.relate([self.cal], self.users, 'viewer',
+            ignore_conflicts=True), 0)
+
+    def test_reindex_new_relations_only(self):
+        EventRelation.objects.relate(self.events, self.users[:1], 'viewer')
+        CalendarRelation.objects.relate([self.cal], self.users[:1], 'viewer')
+        indexed = set(EventVisibility.objects.values_list('id', flat=True))
+        EventRelation.objects.relate(self.events, self.users[1:], 'viewer')
+        CalendarRelation.objects.relate([self.cal], self.users[1:], 'viewer')
+        # the rows of the first batch are left alone
+        self.assertEqual(indexed - set(EventVisibility.objects.values_list('id', flat=True)),
+            set())
+        self.assertEqual(EventVisibility.objects.count(), 12)
+        self.assertEqual(self.get_titles(self.users[2], 'viewer'), ['Event 5', 'Event 6'])
+
+    def test_change_distinction(self):
+        EventRelation.objects.relate(self.events, self.users, 'viewer')
+        CalendarRelation.objects.relate([self.cal], self.users[:1], 'viewer')
+        self.assertEqual(EventRelation.objects.change_distinction('viewer', 'owner'), 6)
+        self.assertEqual(EventRelation.objects.filter(distinction='owner').count(), 6)
+        self.assertEqual(self.get_titles(self.users[1], 'owner'), ['Event 5', 'Event 6'])
+        self.assertEqual(self.get_titles(self.users[1], 'viewer'), [])
+        # the calendar relation is left alone
+        self.assertEqual(self.get_titles(self.users[0], 'viewer'), ['Event 5', 'Event 6'])
+
+    def test_remove_relations(self):
+        EventRelation.objects.relate(self.events, self.users, 'viewer')
+        EventRelation.objects.relate(self.events, self.users, 'owner')
+        count = EventRelation.objects.remove_relations(self.events[:1], self.users[:2], 'viewer')
+        self.assertEqual(count, 2)
+        self.assertEqual(self.get_titles(self.users[0], 'viewer'), ['Event 6'])
+        self.assertEqual(self.get_titles(self.users[0], 'owner'), ['Event 5', 'Event 6'])
+        self.assertEqual(EventRelation.objects.remove_relations(self.events, self.users), 10)
+        self.assertEqual(EventVisibility.objects.count(), 0)
+
+class TestPrefetchContentObjects(TestCase):
+    def test_prefetch(self):
+        users = [User.objects.create(username='user%d' % i) for i in range(3)]
+        cal = Calendar(name="MyCal")
+        cal.save()
+        other = Calendar(name="Other")
+        other.save()
+        CalendarRelation.objects.relate([cal], users + [other])
+        User.objects.filter(pk=users[2].pk).delete()
+        expected = dict([((ContentType.objects.get_for_model(type(obj)).id, obj.pk), obj)
+            for obj in users[:2] + [other]])
+        expected[(ContentType.objects.get_for_model(User).id, users[2].pk)] = None
+        relations = prefetch_content_objects(CalendarRelation.objects.all())
+        self.assertEqual(len(relations), 4)
+        for relation in relations:
+            self.assertTrue('_content_object_cache' in relation.__dict__)
+            self.assertEqual(relation.content_object,
+                expected[(relation.content_type_id, relation.object_id)])
+        self.assertEqual(prefetch_content_objects(CalendarRelation.objects.none()), [])
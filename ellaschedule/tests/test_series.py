@@ -0,0 +1,148 @@
+import datetime
+
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.client import Client
+from django.utils import simplejson
+
+from ellaschedule import views
+
+from ellaschedule.models import Event, Rule, Calendar, Occurrence, EventRelation, \
+    EventVisibility
+
+class TestSeriesOperations(TestCase):
+    def setUp(self):
+        weekly = Rule(frequency = "WEEKLY")
+        weekly.save()
+        self.cal = Calendar(name="MyCal")
+        self.cal.save()
+        self.event = Event(title='Weekly Meeting', calendar=self.cal, rule=weekly,
+            start=datetime.datetime(2008, 1, 7, 9, 0), end=datetime.datetime(2008, 1, 7, 10, 0),
+            end_recurring_period=datetime.datetime(2008, 3, 31, 0, 0))
+        self.event.save()
+        # already persisted, must be updated rather than duplicated
+        self.event.get_occurrence(datetime.datetime(2008, 1, 21, 9, 0)).save()
+
+    def get_starts(self, event, start, end):
+        return [(o.start, o.cancelled) for o in event.get_occurrences(start, end)]
+
+    def test_cancel_range(self):
+        count = self.event.cancel_range(datetime.datetime(2008, 1, 14), datetime.datetime(2008, 1, 28))
+        self.assertEqual(count, 2)
+        # the generated occurrence is cancelled in the exceptions of the event
+        self.assertEqual(Occurrence.objects.filter(event=self.event).count(), 1)
+        self.assertEqual(Event.objects.get(pk=self.event.pk).exceptions, '20080114T090000')
+        self.assertEqual(self.get_starts(self.event, datetime.datetime(2008, 1, 7), datetime.datetime(2008, 1, 29)), [
+            (datetime.datetime(2008, 1, 7, 9, 0), False),
+            (datetime.datetime(2008, 1, 14, 9, 0), True),
+            (datetime.datetime(2008, 1, 21, 9, 0), True),
+            (datetime.datetime(2008, 1, 28, 9, 0), False),
+        ])
+
+    def test_shift_range(self):
+        self.event.shift_range(datetime.datetime(2008, 1, 14), datetime.datetime(2008, 1, 28),
+            datetime.timedelta(hours=1))
+        self.assertEqual([o.start.hour for o in self.event.get_occurrences(
+            datetime.datetime(2008, 1, 7), datetime.datetime(2008, 1, 29))], [9, 10, 10, 9])
+
+    def test_shift_following(self):
+        event = self.event.shift_range(datetime.datetime(2008, 1, 20), None,
+            datetime.timedelta(hours=1))
+        self.assertNotEqual(event.pk, self.event.pk)
+        self.assertEqual(Event.objects.get(pk=self.event.pk).end_recurring_period,
+            datetime.datetime(2008, 1, 21, 8, 59, 59))
+        self.assertEqual(event.start, datetime.datetime(2008, 1, 21, 10, 0))
+        persisted = Occurrence.objects.get(event=event)
+        self.assertEqual((persisted.start, persisted.original_start),
+            (datetime.datetime(2008, 1, 21, 10, 0), datetime.datetime(2008, 1, 21, 10, 0)))
+        occurrences = Event.objects.get(pk=self.event.pk).get_occurrences(
+            datetime.datetime(2008, 1, 1), datetime.datetime(2008, 2, 1))
+        occurrences += event.get_occurrences(datetime.datetime(2008, 1, 1), datetime.datetime(2008, 2, 1))
+        self.assertEqual([(o.start.day, o.start.hour) for o in occurrences],
+            [(7, 9), (14, 9), (21, 10), (28, 10)])
+
+    def test_split_series_at(self):
+        self.assertEqual(self.event.split_series_at(datetime.datetime(2008, 1, 1)), self.event)
+        self.assertEqual(self.event.split_series_at(datetime.datetime(2008, 4, 1)), None)
+        single = Event(title='Single', calendar=self.cal,
+            start=datetime.datetime(2008, 1, 7, 9, 0), end=datetime.datetime(2008, 1, 7, 10, 0))
+        self.assertRaises(ValueError, single.split_series_at, datetime.datetime(2008, 1, 1))
+
+    def test_split_series_relations(self):
+        users = [User.objects.create(username='user%d' % i) for i in range(2)]
+        EventRelation.objects.relate([self.event], users[:1], 'owner')
+        EventRelation.objects.relate([self.event], users[1:], 'viewer')
+        event = self.event.split_series_at(datetime.datetime(2008, 2, 1))
+        self.assertEqual(sorted(EventRelation.objects.filter(event=event).values_list(
+            'object_id', 'distinction')), [(users[0].pk, 'owner'), (users[1].pk, 'viewer')])
+        self.assertEqual(EventVisibility.objects.filter(event=event).count(), 2)
+        self.assertEqual(EventVisibility.objects.filter(event=self.event).count(), 2)
+
+
+class TestExceptions(TestCase):
+    def setUp(self):
+        weekly = Rule(frequency = "WEEKLY")
+        weekly.save()
+        self.cal = Calendar(name="MyCal")
+        self.cal.save()
+        self.event = Event(title='Weekly Meeting', calendar=self.cal, rule=weekly,
+            start=datetime.datetime(2008, 1, 7, 9, 0), end=datetime.datetime(2008, 1, 7, 10, 0),
+            end_recurring_period=datetime.datetime(2008, 3, 31, 0, 0))
+        self.event.save()
+
+    def get_event(self):
+        return Event.objects.get(pk=self.event.pk)
+
+    def test_cancel_and_move(self):
+        self.event.get_occurrence(datetime.datetime(2008, 1, 14, 9, 0)).cancel()
+        self.event.get_occurrence(datetime.datetime(2008, 1, 21, 9, 0)).move(
+            datetime.datetime(2008, 2, 1, 9, 0), datetime.datetime(2008, 2, 1, 10, 0))
+        self.assertEqual(Occurrence.objects.count(), 0)
+        event = self.get_event()
+        self.assertEqual([(o.start.day, o.cancelled) for o in event.get_occurrences(
+            datetime.datetime(2008, 1, 10), datetime.datetime(2008, 1, 25))], [(14, True)])
+        # moved into the window from outside of it
+        self.assertEqual([(o.start, o.original_start) for o in event.get_occurrences(
+            datetime.datetime(2008, 1, 30), datetime.datetime(2008, 2, 3))], [
+            (datetime.datetime(2008, 2, 1, 9, 0), datetime.datetime(2008, 1, 21, 9, 0))])
+        self.assertTrue(event.get_occurrence(datetime.datetime(2008, 1, 14, 9, 0)).cancelled)
+
+    def test_occurrence_row_replaces_exception(self):
+        occurrence = self.event.get_occurrence(datetime.datetime(2008, 1, 14, 9, 0))
+        occurrence.move(datetime.datetime(2008, 1, 14, 10, 0), datetime.datetime(2008, 1, 14, 11, 0))
+        occurrence.description = u'Room changed'
+        occurrence.save()
+        self.assertEqual(self.get_event().exceptions, '')
+        self.assertEqual([o.start.hour for o in self.get_event().get_occurrences(
+            datetime.datetime(2008, 1, 14), datetime.datetime(2008, 1, 15))], [10])
+
+    def test_occurrence_page(self):
+        self.event.get_occurrence(datetime.datetime(2008, 1, 14, 9, 0)).cancel()
+        self.event.get_occurrence(datetime.datetime(2008, 1, 7, 9, 0)).move(
+            datetime.datetime(2008, 1, 25, 9, 0), datetime.datetime(2008, 1, 25, 10, 0))
+        occurrences, cursor = self.get_event().occurrence_page(datetime.datetime(2008, 1, 1), limit=3)
+        self.assertEqual([o.start.day for o in occurrences], [21, 25, 28])
+
+    def test_occurrence_page_view(self):
+        self.event.get_occurrence(datetime.datetime(2008, 1, 14, 9, 0)).cancel()
+        old_show = views.SHOW_CANCELLED_OCCURRENCES
+        views.SHOW_CANCELLED_OCCURRENCES = True
+        try:
+            response = Client().get(reverse('calendar_occurrence_page'), {
+                'event': self.event.id, 'after': '2008-01-01', 'limit': 3})
+        finally:
+            views.SHOW_CANCELLED_OCCURRENCES = old_show
+        data = simplejson.loads(response.content)
+        self.assertEqual(data['occurrences']['cancelled'], [False, True, False])
+
+    def test_occurrence_page_hidden_event(self):
+        url = reverse('calendar_occurrence_page')
+        old_func = views.GET_EVENTS_FUNC
+        views.GET_EVENTS_FUNC = lambda request, calendar: calendar.event_set.none()
+        try:
+            response = Client().get(url, {'event': self.event.id})
+        finally:
+            views.GET_EVENTS_FUNC = old_func
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Client().get(url, {'event': 'x'}).status_code, 400)
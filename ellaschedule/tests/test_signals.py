@@ -0,0 +1,107 @@
+import datetime
+
+from django.test import TestCase
+
+from ellaschedule import signals
+from ellaschedule.cache import get_cached_calendar_id, set_cached_calendar_id, \
+    delete_cached_calendar_id, get_version
+from ellaschedule.conf.settings import EVENT_DEFAULT_CALENDAR_NAME
+from ellaschedule.models import Event, Calendar, Rule
+
+class TestDefaultCalendar(TestCase):
+    def setUp(self):
+        # the cache outlives the rolled back test transactions
+        delete_cached_calendar_id(EVENT_DEFAULT_CALENDAR_NAME)
+
+    def tearDown(self):
+        delete_cached_calendar_id(EVENT_DEFAULT_CALENDAR_NAME)
+
+    def create_event(self, **kwargs):
+        event = Event(title='Event', start=datetime.datetime(2008, 1, 5, 8, 0),
+            end=datetime.datetime(2008, 1, 5, 9, 0), **kwargs)
+        event.save()
+        return event
+
+    def test_default_calendar(self):
+        first = self.create_event()
+        second = self.create_event()
+        self.assertEqual(first.calendar.name, EVENT_DEFAULT_CALENDAR_NAME)
+        self.assertEqual(first.calendar_id, second.calendar_id)
+        self.assertEqual(Calendar.objects.filter(name=EVENT_DEFAULT_CALENDAR_NAME).count(), 1)
+
+    def test_own_calendar(self):
+        cal = Calendar(name="MyCal")
+        cal.save()
+        self.assertEqual(self.create_event(calendar=cal).calendar_id, cal.pk)
+        self.assertEqual(get_cached_calendar_id(EVENT_DEFAULT_CALENDAR_NAME), None)
+
+    def test_deleted_default_calendar(self):
+        calendar_id = self.create_event().calendar_id
+        # as if cached by another process
+        set_cached_calendar_id(EVENT_DEFAULT_CALENDAR_NAME, calendar_id)
+        Calendar.objects.filter(pk=calendar_id).delete()
+        self.assertEqual(get_cached_calendar_id(EVENT_DEFAULT_CALENDAR_NAME), None)
+        self.assertNotEqual(self.create_event().calendar_id, calendar_id)
+
+    def test_not_cached_before_commit(self):
+        # the calendar is created in the transaction of the test, which rolls
+        # back
+        self.create_event()
+        self.assertEqual(get_cached_calendar_id(EVENT_DEFAULT_CALENDAR_NAME), None)
+
+    def test_disabled(self):
+        event = Event(title='Event', start=datetime.datetime(2008, 1, 5, 8, 0),
+            end=datetime.datetime(2008, 1, 5, 9, 0))
+        signals.disable_default_calendar()
+        try:
+            signals.disable_default_calendar()
+            signals.enable_default_calendar()
+            # still disabled by the outer call
+            signals.optionnal_calendar(Event, event)
+        finally:
+            signals.enable_default_calendar()
+        self.assertEqual(event.calendar_id, None)
+        signals.optionnal_calendar(Event, event)
+        self.assertNotEqual(event.calendar_id, None)
+
+
+class TestOldValues(TestCase):
+    def setUp(self):
+        self.cal = Calendar(name="MyCal")
+        self.cal.save()
+        self.other_cal = Calendar(name="Other")
+        self.other_cal.save()
+        rule = Rule(frequency="WEEKLY")
+        rule.save()
+        self.event = Event(title='Weekly', calendar=self.cal, rule=rule,
+            start=datetime.datetime(2008, 1, 5, 8, 0), end=datetime.datetime(2008, 1, 5, 9, 0))
+        self.event.save()
+
+    def test_loaded_values(self):
+        event = Event.objects.get(pk=self.event.pk)
+        # not selected again when saved
+        Event.objects.filter(pk=event.pk).update(calendar=self.other_cal)
+        event.calendar = self.other_cal
+        signals.remember_old_values(Event, event)
+        self.assertEqual(event._old_values['calendar'], self.cal.pk)
+        # built with the pk of a saved row
+        event = Event(pk=self.event.pk, calendar=self.cal)
+        signals.remember_old_values(Event, event)
+        self.assertEqual(event._old_values['calendar'], self.other_cal.pk)
+
+    def test_saved_values(self):
+        # each save compares with the one before
+        for calendar in (self.other_cal, self.cal):
+            version = get_version(self.other_cal.pk)
+            self.event.calendar = calendar
+            self.event.save()
+            self.assertNotEqual(get_version(self.other_cal.pk), version)
+
+    def test_occurrence_event(self):
+        occurrence = self.event.get_occurrence(datetime.datetime(2008, 1, 12, 8, 0))
+        occurrence.save()
+        version = get_version(self.cal.pk)
+        # from the event it was expanded with
+        Event.objects.filter(pk=self.event.pk).update(calendar=self.other_cal)
+        occurrence.cancel()
+        self.assertNotEqual(get_version(self.cal.pk), version)
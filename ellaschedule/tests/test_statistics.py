@@ -0,0 +1,51 @@
+import datetime
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.core.urlresolvers import reverse
+from django.test import Client
+from django.utils import simplejson
+
+from ellaschedule.models import Event, Rule, Calendar
+from ellaschedule.statistics import get_histograms, _python_histograms
+
+class TestStatistics(TestCase):
+    def setUp(self):
+        daily = Rule(frequency = "DAILY")
+        daily.save()
+        self.cal = Calendar(name="Room 1", slug="room-1")
+        self.cal.save()
+        Event(title='Daily Meeting', calendar=self.cal, rule=daily,
+            start=datetime.datetime(2008, 1, 1, 9, 0), end=datetime.datetime(2008, 1, 1, 10, 30),
+            end_recurring_period=datetime.datetime(2008, 1, 5, 0, 0)).save()
+        Event(title='Night Shift', calendar=self.cal,
+            start=datetime.datetime(2008, 1, 2, 22, 0), end=datetime.datetime(2008, 1, 3, 2, 0)).save()
+
+    def test_histograms(self):
+        data = get_histograms([self.cal], datetime.datetime(2008, 1, 1), datetime.datetime(2008, 1, 4))
+        self.assertEqual(data['days'], 3)
+        self.assertEqual(data['day_counts'], [1, 2, 1])
+        self.assertEqual(data['day_minutes'], [90, 210, 210])
+        self.assertEqual(data['hour_counts'][9], 3)
+        self.assertEqual(data['hour_minutes'][10], 90)
+        self.assertEqual(data['hour_minutes'][0], 60)
+
+    def test_python_histograms(self):
+        # the fallback when NumPy is not installed
+        data = _python_histograms([(-30, 60), (1410, 1500), (1420, 1440)], 2)
+        self.assertEqual(data['day_counts'], [2, 0])
+        self.assertEqual(data['day_minutes'], [90, 60])
+        self.assertEqual(data['hour_minutes'][0], 120)
+
+    def test_statistics_view(self):
+        arguments = {'calendar': 'room-1', 'start': '2008-01-01', 'end': '2008-01-04'}
+        client = Client()
+        # the histograms cover every event, they are for staff only
+        response = client.get(reverse('calendar_statistics'), arguments)
+        self.assertNotEqual(response['Content-Type'], 'application/json')
+        User.objects.create_user('staff', 'staff@example.com', 'staff')
+        User.objects.filter(username='staff').update(is_staff=True)
+        client.login(username='staff', password='staff')
+        response = client.get(reverse('calendar_statistics'), arguments)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(simplejson.loads(response.content)['day_counts'], [1, 2, 1])
@@ -1,7 +1,13 @@
 import datetime
 
+from django.contrib.auth.models import User
+from django.template import Template, Context
 from django.test import TestCase
 
+from ellaschedule.models import Calendar
+from ellaschedule.periods import Month, Day
+from ellaschedule.templatetags import scheduletags
+
 from schedule.templatetags.scheduletags import querystring_for_date
 
 class TestTemplateTags(TestCase):
@@ -10,4 +16,67 @@ class TestTemplateTags(TestCase):
         date = datetime.datetime(2008,1,1,0,0,0)
         query_string=querystring_for_date(date)
         self.assertEqual("?year=2008&month=1&day=1&hour=0&minute=0&second=0",
-            query_string)
\ No newline at end of file
+            query_string)
+
+class TestDayCell(TestCase):
+    def setUp(self):
+        self.calendar = Calendar(name="MyCal")
+        self.calendar.save()
+        self.old = scheduletags.BUSY_DAYS_CACHE, scheduletags.get_busy_days
+        self.years = []
+        def get_busy_days(calendar, year):
+            self.years.append(year)
+            return self.old[1](calendar, year)
+        scheduletags.BUSY_DAYS_CACHE, scheduletags.get_busy_days = True, get_busy_days
+
+    def tearDown(self):
+        scheduletags.BUSY_DAYS_CACHE, scheduletags.get_busy_days = self.old
+
+    def test_padding_days(self):
+        month = Month([], datetime.datetime(2009, 1, 1))
+        context = scheduletags.day_cell({}, self.calendar,
+            Day([], datetime.datetime(2008, 12, 29)), month, "small")
+        self.assertFalse(context['busy'])
+        self.assertEqual(self.years, [])
+        scheduletags.day_cell({}, self.calendar, Day([], datetime.datetime(2009, 1, 2)),
+            month, "small")
+        self.assertEqual(self.years, [2009])
+
+class TestCalendarTags(TestCase):
+
+    def setUp(self):
+        self.users = [User.objects.create(username='user%d' % i) for i in range(3)]
+        self.calendars = []
+        for user in self.users[:2]:
+            calendar = Calendar(name="%s's calendar" % user.username)
+            calendar.save()
+            calendar.create_relation(user, 'owner')
+            self.calendars.append(calendar)
+
+    def test_get_calendars_for_objects(self):
+        calendars = Calendar.objects.get_calendars_for_objects(self.users, 'owner')
+        self.assertEqual(calendars, {
+            self.users[0]: [self.calendars[0]],
+            self.users[1]: [self.calendars[1]],
+            self.users[2]: [],
+        })
+        self.assertEqual(Calendar.objects.get_calendars_for_objects(self.users, 'viewer')[self.users[0]], [])
+        self.assertEqual(Calendar.objects.get_calendars_for_objects([]), {})
+
+    def test_prefetch_calendars(self):
+        context = Context({'users': self.users[:2]})
+        t = Template('{% load scheduletags %}{% prefetch_calendars users owner %}'
+            '{% for user in users %}{% get_calendar user owner as calendar %}{{ calendar.name }},{% endfor %}')
+        self.assertEqual(t.render(context), "user0's calendar,user1's calendar,")
+
+    def test_get_calendar_memo(self):
+        class Request(object):
+            pass
+        request = Request()
+        t = Template('{% load scheduletags %}{% get_calendar user owner as calendar %}{{ calendar.name }}')
+        self.assertEqual(t.render(Context({'user': self.users[0], 'request': request})),
+            "user0's calendar")
+        # resolved once per request
+        Calendar.objects.all().delete()
+        self.assertEqual(t.render(Context({'user': self.users[0], 'request': request})),
+            "user0's calendar")
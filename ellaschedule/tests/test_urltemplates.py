@@ -0,0 +1,39 @@
+import datetime
+
+from django.core.urlresolvers import reverse, set_script_prefix
+from django.test import TestCase
+
+from ellaschedule.models import Event, Rule, Calendar
+from ellaschedule.urltemplates import url_template
+
+class TestURLTemplates(TestCase):
+    def setUp(self):
+        rule = Rule(frequency = "WEEKLY")
+        rule.save()
+        cal = Calendar(name="MyCal")
+        cal.save()
+        self.event = Event(title='Weekly Event', calendar=cal, rule=rule,
+            start=datetime.datetime(2009, 4, 1, 8, 0), end=datetime.datetime(2009, 4, 1, 9, 0))
+        self.event.save()
+
+    def tearDown(self):
+        set_script_prefix('/')
+
+    def test_occurrence_urls(self):
+        occurrence = self.event.get_occurrence(datetime.datetime(2009, 4, 8, 8, 0))
+        kwargs = {'event_id': self.event.id, 'year': 2009, 'month': 4, 'day': 8,
+            'hour': 8, 'minute': 0, 'second': 0}
+        self.assertEqual(occurrence.get_absolute_url(), reverse('occurrence_by_date', kwargs=kwargs))
+        self.assertEqual(occurrence.get_edit_url(), reverse('edit_occurrence_by_date', kwargs=kwargs))
+        occurrence.save()
+        kwargs = {'event_id': self.event.id, 'occurrence_id': occurrence.pk}
+        self.assertEqual(occurrence.get_cancel_url(), reverse('cancel_occurrence', kwargs=kwargs))
+
+    def test_script_prefix(self):
+        url = url_template('edit_event', 'calendar_slug', 'event_id')
+        self.assertEqual(url(calendar_slug='mycal', event_id=12),
+            reverse('edit_event', args=['mycal', 12]))
+        set_script_prefix('/prefix/')
+        self.assertEqual(url(calendar_slug='mycal', event_id=12),
+            reverse('edit_event', args=['mycal', 12]))
+        self.assertTrue(url(calendar_slug='mycal', event_id=12).startswith('/prefix/'))
@@ -7,6 +7,7 @@ from django.core.urlresolvers import reverse
 from schedule.models import Event, Rule, Occurrence, Calendar
 from schedule.periods import Period, Month, Day
 from schedule.utils import EventListManager
+from ellaschedule import utils
 
 class TestEventListManager(TestCase):
     def setUp(self):
@@ -48,3 +49,36 @@ class TestEventListManager(TestCase):
         self.assertEqual(occurrences.next().event, self.event2)
         self.assertEqual(occurrences.next().event, self.event2)
         self.assertEqual(occurrences.next().event, self.event1)
+
+class TestEditPermissions(TestCase):
+    def setUp(self):
+        cal = Calendar(name="MyCal")
+        cal.save()
+        self.events = []
+        for title in ('Mine', 'Theirs'):
+            event = Event(title=title, calendar=cal, start=datetime.datetime(2009, 4, 1, 8, 0),
+                end=datetime.datetime(2009, 4, 1, 9, 0))
+            event.save()
+            self.events.append(event)
+        self.calls = []
+        self.old_func = utils.CHECK_PERMISSIONS_BULK_FUNC
+        utils.CHECK_PERMISSIONS_BULK_FUNC = self.check_edit_permissions
+
+    def tearDown(self):
+        utils.CHECK_PERMISSIONS_BULK_FUNC = self.old_func
+
+    def check_edit_permissions(self, events, user):
+        self.calls.append(sorted([event.title for event in events]))
+        return dict([(event.id, event.title == 'Mine') for event in events])
+
+    def test_get_edit_permissions(self):
+        class Request(object):
+            user = None
+        request = Request()
+        permissions = utils.get_edit_permissions(request, self.events + self.events[:1])
+        self.assertEqual(permissions, {self.events[0].id: True, self.events[1].id: False})
+        # cached for the request
+        utils.get_edit_permissions(request, self.events[1:])
+        self.assertEqual(self.calls, [['Mine', 'Theirs']])
+        utils.get_edit_permissions(Request(), self.events[1:])
+        self.assertEqual(self.calls, [['Mine', 'Theirs'], ['Theirs']])
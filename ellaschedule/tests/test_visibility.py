@@ -0,0 +1,73 @@
+import datetime
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from ellaschedule.models import Event, Calendar, EventRelation, EventVisibility
+
+class TestEventVisibility(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='viewer')
+        self.cal = Calendar(name="MyCal")
+        self.cal.save()
+        self.other_cal = Calendar(name="Other")
+        self.other_cal.save()
+        self.january = self.create_event('January', self.cal, datetime.datetime(2008, 1, 5, 8, 0))
+        self.march = self.create_event('March', self.cal, datetime.datetime(2008, 3, 5, 8, 0))
+        self.other = self.create_event('Other', self.other_cal, datetime.datetime(2008, 1, 5, 8, 0))
+
+    def create_event(self, title, calendar, start):
+        event = Event(title=title, calendar=calendar, start=start,
+            end=start + datetime.timedelta(hours=1))
+        event.save()
+        return event
+
+    def get_titles(self, *args, **kwargs):
+        return sorted([event.title for event in
+            EventRelation.objects.get_events_for_object(self.user, *args, **kwargs)])
+
+    def test_event_relation(self):
+        EventRelation.objects.create_relation(self.other, self.user, 'owner')
+        self.assertEqual(self.get_titles(), ['Other'])
+        self.assertEqual(self.get_titles('owner'), ['Other'])
+        self.assertEqual(self.get_titles('viewer'), [])
+
+    def test_inherited_calendar_relation(self):
+        self.cal.create_relation(self.user, 'viewer', True)
+        self.assertEqual(self.get_titles('viewer'), ['January', 'March'])
+        self.assertEqual(self.get_titles('viewer', inherit=False), [])
+        # events created later and moved between calendars are indexed too
+        self.create_event('April', self.cal, datetime.datetime(2008, 4, 5, 8, 0))
+        self.other.calendar = self.cal
+        self.other.save()
+        self.march.calendar = self.other_cal
+        self.march.save()
+        self.assertEqual(self.get_titles('viewer'), ['April', 'January', 'Other'])
+
+    def test_not_inheritable(self):
+        self.cal.create_relation(self.user, 'viewer', False)
+        self.assertEqual(self.get_titles(), [])
+
+    def test_both_relations(self):
+        self.cal.create_relation(self.user, 'viewer', True)
+        EventRelation.objects.create_relation(self.january, self.user, 'viewer')
+        self.assertEqual(self.get_titles(), ['January', 'March'])
+        self.assertEqual(self.get_titles(inherit=False), ['January'])
+
+    def test_window(self):
+        self.cal.create_relation(self.user, 'viewer', True)
+        self.assertEqual(self.get_titles(start=datetime.datetime(2008, 3, 1),
+            end=datetime.datetime(2008, 4, 1)), ['March'])
+
+    def test_delete_relation(self):
+        relation = EventRelation.objects.create_relation(self.other, self.user, 'owner')
+        relation.delete()
+        self.assertEqual(self.get_titles(), [])
+
+    def test_rebuild(self):
+        self.cal.create_relation(self.user, 'viewer', True)
+        EventRelation.objects.create_relation(self.other, self.user, 'owner')
+        EventVisibility.objects.all().delete()
+        EventVisibility.objects.rebuild()
+        self.assertEqual(EventVisibility.objects.count(), 3)
+        self.assertEqual(self.get_titles(), ['January', 'March', 'Other'])
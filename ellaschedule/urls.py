@@ -89,6 +89,28 @@ url(r'^occurrence/edit/(?P<event_id>\d+)/(?P<year>\d+)/(?P<month>\d+)/(?P<day>\d
     name="edit_occurrence_by_date"),
     
 
+#sync urls
+url(r'^sync/calendar/(?P<calendar_slug>[-\w]+)/$',
+    'ellaschedule.views.calendar_sync',
+    name="calendar_sync"),
+
+#json urls
+url(r'^json/occurrences/$',
+    'ellaschedule.views.calendar_occurrences',
+    name="calendar_occurrences"),
+url(r'^json/occurrences/page/$',
+    'ellaschedule.views.calendar_occurrence_page',
+    name="calendar_occurrence_page"),
+url(r'^json/statistics/$',
+    'ellaschedule.views.calendar_statistics',
+    name="calendar_statistics"),
+url(r'^statistics/$',
+    'ellaschedule.views.calendar_statistics_heatmap',
+    name="calendar_statistics_heatmap"),
+url(r'^freebusy/$',
+    'ellaschedule.views.calendar_free_busy',
+    name="calendar_free_busy"),
+
 #feed urls 
 url(r'^feed/calendar/(.*)/$',
     'django.contrib.syndication.views.feed', 
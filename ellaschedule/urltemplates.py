@@ -0,0 +1,89 @@
+"""
+URLs of calendar pages built by string formatting.
+
+Month and week pages link every occurrence they show to its detail, edit and
+cancel views, which costs a reverse() per link.  A URLTemplate reverses its
+pattern once per process, with placeholder values for the arguments, and
+fills in the real values by formatting afterwards.
+"""
+from django.core.urlresolvers import reverse, get_script_prefix
+from django.utils.encoding import iri_to_uri
+
+_templates = {}
+
+class URLTemplate(object):
+    """
+    The URL named ``name`` as a format string with a placeholder for each of
+    ``params``, its keyword arguments, which must accept digits.  The script
+    prefix is left out of the format string and added when the URL is
+    built, so templates stay correct whatever the prefix of the request.
+
+    >>> url = URLTemplate('event', 'event_id')  # doctest: +SKIP
+    >>> url(event_id=12)  # doctest: +SKIP
+    '/schedule/event/12/'
+    """
+    def __init__(self, name, *params):
+        self.name = name
+        self.params = params
+        self.template = None
+
+    def _build(self):
+        # numbers unlikely to be anywhere else in the URL, matched by \d+ as
+        # well as by slug patterns
+        placeholders = dict([(param, '7%08d9' % i) for i, param in enumerate(self.params)])
+        path = reverse(self.name, kwargs=placeholders)
+        prefix = get_script_prefix()
+        if path.startswith(prefix):
+            path = path[len(prefix):]
+        template = path.replace('%', '%%')
+        for param, placeholder in placeholders.items():
+            template = template.replace(placeholder, '%%(%s)s' % param)
+        return template
+
+    def __call__(self, **values):
+        if self.template is None:
+            self.template = self._build()
+        return iri_to_uri(get_script_prefix() + self.template % values)
+
+def url_template(name, *params):
+    """
+    Returns the URLTemplate of the URL named ``name`` with the keyword
+    arguments ``params``, shared by the whole process.
+    """
+    key = (name, params)
+    if key not in _templates:
+        _templates[key] = URLTemplate(name, *params)
+    return _templates[key]
+
+def clear_url_templates():
+    """
+    Forgets the templates, e.g. after the URLconf was changed in tests.
+    """
+    _templates.clear()
+
+DATE_PARAMS = ('year', 'month', 'day', 'hour', 'minute', 'second')
+
+def date_values(date):
+    """
+    Returns the keyword arguments of ``date`` for by-date URL patterns.
+    """
+    return {
+        'year': date.year,
+        'month': date.month,
+        'day': date.day,
+        'hour': date.hour,
+        'minute': date.minute,
+        'second': date.second,
+    }
+
+def querystring_for_date(date, num=6):
+    """
+    Returns a querystring with the first ``num`` parts of ``date``.
+
+    >>> import datetime
+    >>> querystring_for_date(datetime.datetime(2009, 4, 1, 8, 30), num=2)
+    '?year=2009&month=4'
+    """
+    qs_parts = ['year=%d', 'month=%d', 'day=%d', 'hour=%d', 'minute=%d', 'second=%d']
+    qs_vars = (date.year, date.month, date.day, date.hour, date.minute, date.second)
+    return '?' + '&'.join(qs_parts[:num]) % qs_vars[:num]
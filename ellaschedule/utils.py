@@ -1,9 +1,13 @@
+import base64
 import datetime
 import heapq
+from itertools import islice
 from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q
+from django.db.models.query import QuerySet
 from django.http import HttpResponseRedirect
 from django.conf import settings
-from ellaschedule.conf.settings import CHECK_PERMISSION_FUNC
+from ellaschedule.conf.settings import CHECK_PERMISSION_FUNC, CHECK_PERMISSIONS_BULK_FUNC
 
 class EventListManager(object):
     """
@@ -25,7 +29,7 @@ class EventListManager(object):
         if after is None:
             after = datetime.datetime.now()
         occ_replacer = OccurrenceReplacer(
-            Occurrence.objects.filter(event__in = self.events))
+            Occurrence.objects.slim().filter(event__in = self.events))
         generators = [event._occurrences_after_generator(after) for event in self.events]
         occurrences = []
 
@@ -46,6 +50,175 @@ class EventListManager(object):
                 next = heapq.heappop(occurrences)[0]
             yield occ_replacer.get_occurrence(next)
 
+    def occurrence_page(self, after=None, cursor=None, limit=20, include_cancelled=False):
+        """
+        Returns a list of at most ``limit`` occurrences of the events, ordered
+        by start, and a cursor for the next page, which is None when there
+        are no more occurrences.  The first page starts with the occurrences
+        ending after ``after``; the following pages are fetched by passing
+        the returned cursor instead.
+
+        Only about a page of occurrences is expanded per event and only the
+        persisted occurrences of the page are loaded, so that the pages of a
+        series without an end cost the same however far they are.
+        """
+        from ellaschedule.models import Occurrence
+        if cursor is not None:
+            key = decode_cursor(cursor)
+        else:
+            key = None
+            if after is None:
+                after = datetime.datetime.now()
+        events = self.events
+        if isinstance(events, QuerySet):
+            events = events.select_related('rule')
+        events = list(events)
+
+        # the generated occurrences of all the events, merged by key
+        streams = []
+        for event in events:
+            if key is None:
+                spans = event._get_occurrence_spans_from(after - (event.end - event.start))
+            else:
+                spans = event._get_occurrence_spans_from(key[0])
+            streams.append(_iter_keyed_spans(event, spans, after, key))
+        merged = heapq.merge(*streams)
+
+        # generated occurrences which are persisted are left to the query
+        # below and the ones with exceptions to the loop after, they may have
+        # been moved or cancelled
+        generated = []
+        while len(generated) < limit:
+            batch = list(islice(merged, limit - len(generated)))
+            if not batch:
+                break
+            persisted = set(Occurrence.objects.filter(
+                event__in=set([o_key[1] for o_key, o_end, event in batch]),
+                original_start__in=set([o_key[2] for o_key, o_end, event in batch]),
+            ).values_list('event', 'original_start'))
+            generated += [item for item in batch if item[0][1:] not in persisted
+                and item[0][2] not in item[2].get_exceptions()]
+
+        for event in events:
+            difference = event.end - event.start
+            for original, span in event.get_exceptions().items():
+                if span is None:
+                    if not include_cancelled:
+                        continue
+                    span = (original, original + difference)
+                o_key = (span[0], event.id, original)
+                if (key is None and span[1] > after) or (key is not None and o_key > key):
+                    generated.append((o_key, span[1],
+                        event._get_exception_occurrence(original, original + difference)))
+
+        persisted = Occurrence.objects.slim().filter(event__in=events)
+        if not include_cancelled:
+            persisted = persisted.filter(cancelled=False)
+        if key is None:
+            persisted = persisted.filter(end__gt=after)
+        else:
+            start, event_id, original_start = key
+            persisted = persisted.filter(Q(start__gt=start) |
+                Q(start=start, event__gt=event_id) |
+                Q(start=start, event=event_id, original_start__gt=original_start))
+        persisted = persisted.order_by('start', 'event', 'original_start')[:limit]
+        events_by_id = dict([(event.id, event) for event in events])
+        for occurrence in persisted:
+            occurrence.event = events_by_id[occurrence.event_id]
+            generated.append(((occurrence.start, occurrence.event_id,
+                occurrence.original_start), occurrence.end, occurrence))
+
+        page = sorted(generated, key=lambda item: item[0])[:limit]
+        occurrences = []
+        for o_key, o_end, item in page:
+            if isinstance(item, Occurrence):
+                occurrences.append(item)
+            else:
+                occurrences.append(item._create_occurrence(o_key[0], o_end))
+        if len(page) < limit:
+            return occurrences, None
+        return occurrences, encode_cursor(*page[-1][0])
+
+def _iter_keyed_spans(event, spans, after, key):
+    """
+    Yields ((start, event id, original start), end, event) for the spans of
+    ``event`` which come after ``key``, or end after ``after`` without a key.
+    """
+    for o_start, o_end in spans:
+        o_key = (o_start, event.id, o_start)
+        if key is None:
+            if o_end <= after:
+                continue
+        elif o_key <= key:
+            continue
+        yield o_key, o_end, event
+
+CURSOR_FORMAT = '%Y%m%d%H%M%S'
+
+def encode_cursor(start, event_id, original_start):
+    """
+    Returns an opaque cursor pointing after the occurrence with the given
+    start, event id and original start.
+
+    >>> cursor = encode_cursor(datetime.datetime(2008, 1, 5, 8, 0), 3, datetime.datetime(2008, 1, 4, 8, 0))
+    >>> decode_cursor(cursor)
+    (datetime.datetime(2008, 1, 5, 8, 0), 3, datetime.datetime(2008, 1, 4, 8, 0))
+    """
+    value = '%s.%d.%s' % (start.strftime(CURSOR_FORMAT), event_id,
+        original_start.strftime(CURSOR_FORMAT))
+    return base64.urlsafe_b64encode(value).rstrip('=')
+
+def decode_cursor(cursor):
+    """
+    Returns the (start, event id, original start) a cursor points after.
+    Raises ValueError for invalid cursors.
+    """
+    try:
+        cursor = str(cursor)
+        value = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        start, event_id, original_start = value.split('.')
+        return (datetime.datetime.strptime(start, CURSOR_FORMAT), int(event_id),
+            datetime.datetime.strptime(original_start, CURSOR_FORMAT))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError("Invalid cursor %r" % cursor)
+
+EXCEPTION_FORMAT = '%Y%m%dT%H%M%S'
+
+def parse_exceptions(value):
+    """
+    Parses the exceptions of an event (see Event.exceptions) into a dict
+    mapping the original starts of the generated occurrences to None if they
+    are cancelled or to their (start, end) if they are moved.
+
+    >>> exceptions = parse_exceptions('20080114T090000 20080121T090000=20080121T100000/20080121T110000')
+    >>> sorted(exceptions.items())[0]
+    (datetime.datetime(2008, 1, 14, 9, 0), None)
+    >>> format_exceptions(exceptions)
+    '20080114T090000 20080121T090000=20080121T100000/20080121T110000'
+    """
+    exceptions = {}
+    for item in (value or '').split():
+        original, span = (item.split('=', 1) + [None])[:2]
+        original = datetime.datetime.strptime(original, EXCEPTION_FORMAT)
+        if span is not None:
+            span = tuple([datetime.datetime.strptime(value, EXCEPTION_FORMAT)
+                for value in span.split('/')])
+        exceptions[original] = span
+    return exceptions
+
+def format_exceptions(exceptions):
+    """
+    Formats a dict returned by parse_exceptions.
+    """
+    items = []
+    for original, span in sorted(exceptions.items()):
+        item = original.strftime(EXCEPTION_FORMAT)
+        if span is not None:
+            item = '%s=%s/%s' % (item, span[0].strftime(EXCEPTION_FORMAT),
+                span[1].strftime(EXCEPTION_FORMAT))
+        items.append(item)
+    return ' '.join(items)
+
 
 class OccurrenceReplacer(object):
     """
@@ -55,7 +228,7 @@ class OccurrenceReplacer(object):
     the generated ones that are equivalent.  This class makes this easier.
     """
     def __init__(self, persisted_occurrences):
-        lookup = [((occ.event, occ.original_start, occ.original_end), occ) for
+        lookup = [((occ.event_id, occ.original_start, occ.original_end), occ) for
             occ in persisted_occurrences]
         self.lookup = dict(lookup)
 
@@ -65,11 +238,18 @@ class OccurrenceReplacer(object):
         has already been matched
         """
         return self.lookup.pop(
-            (occ.event, occ.original_start, occ.original_end),
+            (occ.event_id, occ.original_start, occ.original_end),
             occ)
 
+    def get_persisted(self, event_id, original_start, original_end):
+        """
+        Like get_occurrence, but for a generated occurrence given as its
+        event id and original span.  Returns None when it is not persisted.
+        """
+        return self.lookup.pop((event_id, original_start, original_end), None)
+
     def has_occurrence(self, occ):
-        return (occ.event, occ.original_start, occ.original_end) in self.lookup
+        return (occ.event_id, occ.original_start, occ.original_end) in self.lookup
 
     def get_additional_occurrences(self, start, end):
         """
@@ -78,6 +258,78 @@ class OccurrenceReplacer(object):
         return [occ for key,occ in self.lookup.items() if (occ.start < end and occ.end >= start and not occ.cancelled)]
 
 
+def get_persisted_occurrences(events, start, end, *fields):
+    """
+    Returns the persisted occurrences of ``events`` which are needed to expand
+    them between start and end: the ones which were originally there and the
+    ones which were moved there, with the slim fields and ``fields`` loaded.
+    """
+    from ellaschedule.models import Occurrence
+    return Occurrence.objects.slim(*fields).filter(event__in=events).filter(
+        Q(start__lte=end, end__gte=start) |
+        Q(original_start__lte=end, original_end__gte=start))
+
+def expand_occurrences(events, start, end, persisted_occurrences=None):
+    """
+    Expands all ``events`` between start and end at once and returns a list
+    of (start, end, event, occurrence) tuples sorted by start and end, where
+    occurrence is the persisted Occurrence which replaces the generated one or
+    None.  Generated occurrences are left as plain tuples so that callers who
+    only need the spans do not pay for creating Occurrence objects.
+
+    The persisted occurrences of all the events are loaded in one query
+    unless given.  Occurrences cancelled or moved by the exceptions of their
+    event are returned as unsaved Occurrence objects.
+    """
+    if isinstance(events, QuerySet):
+        events = events.select_related('rule')
+    events = list(events)
+    if persisted_occurrences is None:
+        persisted_occurrences = get_persisted_occurrences(events, start, end)
+    occ_replacer = OccurrenceReplacer(persisted_occurrences)
+    events_by_id = dict([(event.id, event) for event in events])
+    spans = []
+    for event in events:
+        originals = set()
+        for o_start, o_end in event._get_occurrence_spans(start, end):
+            originals.add(o_start)
+            occurrence = occ_replacer.get_persisted(event.id, o_start, o_end)
+            if occurrence is None:
+                occurrence = event._get_exception_occurrence(o_start, o_end)
+                if occurrence is None:
+                    spans.append((o_start, o_end, event, None))
+                    continue
+            occurrence.event = event
+            if occurrence.start < end and occurrence.end >= start:
+                spans.append((occurrence.start, occurrence.end, event, occurrence))
+        for occurrence in event._get_moved_exception_occurrences(start, end, originals):
+            spans.append((occurrence.start, occurrence.end, event, occurrence))
+    for occurrence in occ_replacer.get_additional_occurrences(start, end):
+        event = events_by_id.get(occurrence.event_id)
+        if event is not None:
+            occurrence.event = event
+            spans.append((occurrence.start, occurrence.end, event, occurrence))
+    spans.sort(key=lambda span: span[:2])
+    return spans
+
+def parse_datetime(value):
+    """
+    Parses a datetime given as YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS in a query
+    string.  Raises ValueError for anything else.
+
+    >>> parse_datetime('2008-02-01')
+    datetime.datetime(2008, 2, 1, 0, 0)
+    >>> parse_datetime('2008-02-01T08:30:00')
+    datetime.datetime(2008, 2, 1, 8, 30)
+    """
+    for format in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(value or '', format)
+        except ValueError:
+            pass
+    raise ValueError("Invalid datetime %r" % value)
+
+
 class check_event_permissions(object):
 
     def __init__(self, f):
@@ -97,6 +349,31 @@ class check_event_permissions(object):
         return self.f(request, *args, **kwargs)
 
 
+def get_edit_permissions(request, events):
+    """
+    Returns {event id: whether request.user may edit the event} covering
+    ``events``.  The permissions are cached on the request and the ones not
+    yet known are checked with one call of CHECK_PERMISSIONS_BULK_FUNC, so
+    a page checks each event once, whatever the number of its occurrences.
+    """
+    permissions = request.__dict__.setdefault('_schedule_permissions', {})
+    missing = {}
+    for event in events:
+        if event.id not in permissions:
+            missing[event.id] = event
+    if missing:
+        permissions.update(CHECK_PERMISSIONS_BULK_FUNC(missing.values(), request.user))
+    return permissions
+
+def get_add_permission(request):
+    """
+    Returns whether request.user may add occurrences, cached on the request.
+    """
+    if not hasattr(request, '_schedule_add_permission'):
+        request._schedule_add_permission = CHECK_PERMISSION_FUNC(None, request.user)
+    return request._schedule_add_permission
+
+
 def coerce_date_dict(date_dict):
     """
     given a dictionary (presumed to be from request.GET) it returns a tuple
@@ -1,19 +1,27 @@
 from urllib import quote
 from django.shortcuts import render_to_response, get_object_or_404
 from django.views.generic.create_update import delete_object
-from django.http import HttpResponseRedirect, Http404, HttpResponse
+from django.http import HttpResponseRedirect, Http404, HttpResponse, HttpResponseBadRequest
 from django.template import RequestContext
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.views.generic.create_update import delete_object
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import simplejson
+from django.views.decorators.gzip import gzip_page
+from django.db.models.query import QuerySet
 import datetime
 
-from ellaschedule.conf.settings import GET_EVENTS_FUNC, OCCURRENCE_CANCEL_REDIRECT
+from ellaschedule.conf.settings import GET_EVENTS_FUNC, OCCURRENCE_CANCEL_REDIRECT, SHOW_CANCELLED_OCCURRENCES
 from ellaschedule.forms import EventForm, OccurrenceForm
+from ellaschedule.freebusy import get_vfreebusy, merge_spans
 from ellaschedule.models import *
 from ellaschedule.periods import weekday_names
-from ellaschedule.utils import check_event_permissions, coerce_date_dict
+from ellaschedule.statistics import get_histograms
+from ellaschedule.utils import check_event_permissions, coerce_date_dict, \
+    expand_occurrences, parse_datetime, decode_cursor, EventListManager
 
 def calendar(request, calendar_slug, template='schedule/calendar.html'):
     """
@@ -254,7 +262,7 @@ def create_or_edit_event(request, calendar_slug, event_id=None, next=None,
     calendar = get_object_or_404(Calendar, slug=calendar_slug)
 
     form = form_class(data=request.POST or None, instance=instance,
-        hour24=True, initial=initial_data)
+        hour24=True, calendar=calendar, initial=initial_data)
 
     if form.is_valid():
         event = form.save(commit=False)
@@ -296,6 +304,306 @@ def delete_event(request, event_id, next=None, login_required=True):
                          login_required = login_required
                         )
 
+def calendar_sync(request, calendar_slug):
+    """
+    This view returns, as JSON, what changed in a calendar since the
+    ``sync_token`` passed in request.GET, so that clients do not need to
+    download the whole calendar again.  The response contains a new
+    ``sync_token`` for the next request.  See
+    JournalEntryManager.get_changes for the format.  Only the events
+    GET_EVENTS_FUNC gives for the calendar are sent.
+    """
+    calendar = get_object_or_404(Calendar, slug=calendar_slug)
+    event_list = GET_EVENTS_FUNC(request, calendar)
+    if not isinstance(event_list, QuerySet):
+        event_list = set([event.id for event in event_list])
+    # a queryset is only read for the events which changed
+    changes = JournalEntry.objects.get_changes(calendar, request.GET.get('sync_token'),
+        event_list)
+    return HttpResponse(simplejson.dumps(changes, cls=DjangoJSONEncoder),
+        mimetype='application/json')
+
+def calendar_occurrences(request):
+    """
+    This view returns, as JSON, the occurrences of the calendars given by
+    their slugs in ``calendar`` (which may be repeated) between ``start``
+    (inclusive) and ``end`` (exclusive), both passed in request.GET as
+    YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS.  It is meant for javascript widgets
+    which draw the calendar themselves, so the encoding is columnar:
+
+    ``calendars``
+        the slugs of the calendars
+    ``events``
+        a table of the events with occurrences in the window, given as
+        parallel ``id``, ``title``, ``calendar`` (index into calendars),
+        ``place``, ``url`` and ``recurring`` arrays
+    ``occurrences``
+        parallel ``event`` (index into the events table), ``start`` (seconds
+        since the start of the window), ``duration`` (seconds), ``id`` (of
+        the persisted occurrence or null), ``title`` (null unless changed
+        for the occurrence) and ``cancelled`` arrays, sorted by start
+    """
+    try:
+        start = parse_datetime(request.GET.get('start'))
+        end = parse_datetime(request.GET.get('end'))
+    except ValueError, e:
+        return HttpResponseBadRequest(str(e))
+    slugs = request.GET.getlist('calendar')
+    if end <= start or not slugs:
+        return HttpResponseBadRequest("calendar and a non empty start-end window are required")
+
+    calendars = list(Calendar.objects.filter(slug__in=slugs))
+    if not calendars:
+        raise Http404
+    events = _get_calendars_events(request, calendars)
+
+    spans = []
+    for o_start, o_end, event, occurrence in expand_occurrences(events, start, end):
+        if o_start >= end or (o_end <= start and not o_start == o_end == start):
+            continue
+        if occurrence is not None and occurrence.cancelled and not SHOW_CANCELLED_OCCURRENCES:
+            continue
+        spans.append((o_start, o_end, event, occurrence))
+
+    event_table, occurrence_table = _encode_occurrences(spans, start, calendars)
+    data = {
+        'start': start,
+        'end': end,
+        'calendars': [calendar.slug for calendar in calendars],
+        'events': event_table,
+        'occurrences': occurrence_table,
+    }
+    return HttpResponse(simplejson.dumps(data, cls=DjangoJSONEncoder,
+        separators=(',', ':')), mimetype='application/json')
+calendar_occurrences = gzip_page(calendar_occurrences)
+
+def calendar_occurrence_page(request, limit=20, max_limit=200):
+    """
+    This view returns, as JSON, a page of the occurrences of the calendars
+    given by their slugs in ``calendar``, or of the event with the id given
+    in ``event`` (among the events of these calendars, of its own calendar
+    by default), which end after ``after`` (YYYY-MM-DD or
+    YYYY-MM-DDTHH:MM:SS, now by default).  The following pages are fetched
+    by passing the returned ``cursor`` instead of ``after``; it is null on
+    the last page.  ``limit`` sets the page size.  The encoding is the same
+    as for calendar_occurrences, the occurrence starts being offsets from
+    ``start``.
+    """
+    try:
+        limit = min(int(request.GET.get('limit', limit)), max_limit)
+        after = None
+        if 'after' in request.GET:
+            after = parse_datetime(request.GET['after'])
+        event_id = None
+        if 'event' in request.GET:
+            event_id = int(request.GET['event'])
+        cursor = request.GET.get('cursor')
+        if cursor:
+            base = decode_cursor(cursor)[0]
+        else:
+            cursor = None
+            base = after or datetime.datetime.now()
+            after = base
+    except ValueError, e:
+        return HttpResponseBadRequest(str(e))
+    if limit < 1:
+        return HttpResponseBadRequest("limit must be positive")
+
+    slugs = request.GET.getlist('calendar')
+    if event_id is not None:
+        # the event is looked up among the ones GET_EVENTS_FUNC gives
+        if slugs:
+            calendars = list(Calendar.objects.filter(slug__in=slugs))
+        else:
+            calendars = list(Calendar.objects.filter(event=event_id))
+        events = _get_calendars_events(request, calendars, event_id)[:1]
+        if not events:
+            raise Http404
+    else:
+        calendars = list(Calendar.objects.filter(slug__in=slugs))
+        if not calendars:
+            raise Http404
+        events = _get_calendars_events(request, calendars)
+
+    occurrences, next_cursor = EventListManager(events).occurrence_page(after,
+        cursor, limit, SHOW_CANCELLED_OCCURRENCES)
+    spans = [(occurrence.start, occurrence.end, occurrence.event, occurrence)
+        for occurrence in occurrences]
+    event_table, occurrence_table = _encode_occurrences(spans, base, calendars)
+    data = {
+        'start': base,
+        'cursor': next_cursor,
+        'calendars': [calendar.slug for calendar in calendars],
+        'events': event_table,
+        'occurrences': occurrence_table,
+    }
+    return HttpResponse(simplejson.dumps(data, cls=DjangoJSONEncoder,
+        separators=(',', ':')), mimetype='application/json')
+calendar_occurrence_page = gzip_page(calendar_occurrence_page)
+
+def calendar_free_busy(request):
+    """
+    This view returns when the calendars given by their slugs in
+    ``calendar`` (which may be repeated) are busy between ``start`` and
+    ``end`` (YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS), as an iCalendar VFREEBUSY,
+    or as JSON if ``format`` is json.  Only the events GET_EVENTS_FUNC gives
+    for the request are looked at, see CalendarManager.free_busy for the
+    format.
+    """
+    try:
+        start = parse_datetime(request.GET.get('start'))
+        end = parse_datetime(request.GET.get('end'))
+    except ValueError, e:
+        return HttpResponseBadRequest(str(e))
+    slugs = request.GET.getlist('calendar')
+    if end <= start or not slugs:
+        return HttpResponseBadRequest("calendar and a non empty start-end window are required")
+    calendars = Calendar.objects.filter(slug__in=slugs)
+    busy = merge_spans([(o_start, o_end) for o_start, o_end, event, occurrence in
+        expand_occurrences(_get_calendars_events(request, calendars), start, end)
+        if occurrence is None or not occurrence.cancelled], start, end)
+
+    if request.GET.get('format') == 'json':
+        data = {'start': start, 'end': end, 'busy': busy}
+        return HttpResponse(simplejson.dumps(data, cls=DjangoJSONEncoder),
+            mimetype='application/json')
+    response = HttpResponse(get_vfreebusy(busy, start, end).serialize())
+    response['Content-Type'] = 'text/calendar'
+    return response
+
+def calendar_statistics(request):
+    """
+    This view returns, as JSON, the occurrence histograms of the calendars
+    given by their slugs in ``calendar`` (which may be repeated), limited to
+    the categories given by their ids in ``category`` (which may be
+    repeated, all by default), between ``start`` and ``end`` (YYYY-MM-DD or
+    YYYY-MM-DDTHH:MM:SS, the current year by default).  See
+    ellaschedule.statistics.get_histograms for the format.  It is only served
+    to staff, like the heatmap, as it covers every event of the calendars.
+    """
+    try:
+        calendars, categories, start, end = _get_statistics_arguments(request)
+    except ValueError, e:
+        return HttpResponseBadRequest(str(e))
+    data = get_histograms(calendars, start, end, categories)
+    data['calendars'] = [calendar.slug for calendar in calendars]
+    return HttpResponse(simplejson.dumps(data, cls=DjangoJSONEncoder,
+        separators=(',', ':')), mimetype='application/json')
+calendar_statistics = staff_member_required(gzip_page(calendar_statistics))
+
+def calendar_statistics_heatmap(request, template_name="schedule/statistics.html"):
+    """
+    This view shows staff a heatmap of the busy minutes per day and per hour
+    of the calendars, categories and window given as for
+    calendar_statistics.
+
+    Context Variables:
+
+    ``calendars``
+        The calendars
+    ``months``
+        A list of (first day of the month, [(date, occurrence count, busy
+        minutes, level 0-4) or None for days before the window]) tuples
+    ``hours``
+        A list of (hour, occurrence count, busy minutes, level 0-4) tuples
+    """
+    try:
+        calendars, categories, start, end = _get_statistics_arguments(request)
+    except ValueError, e:
+        return HttpResponseBadRequest(str(e))
+    data = get_histograms(calendars, start, end, categories)
+    max_minutes = max(data['day_minutes'] + [1])
+    months = []
+    for i in range(data['days']):
+        date = (data['start'] + datetime.timedelta(days=i)).date()
+        if not months or months[-1][0].month != date.month:
+            months.append((date.replace(day=1), [None] * (date.day - 1)))
+        minutes = data['day_minutes'][i]
+        months[-1][1].append((date, data['day_counts'][i], minutes,
+            (4 * minutes + max_minutes - 1) // max_minutes))
+    max_minutes = max(data['hour_minutes'] + [1])
+    hours = [(hour, data['hour_counts'][hour], data['hour_minutes'][hour],
+        (4 * data['hour_minutes'][hour] + max_minutes - 1) // max_minutes)
+        for hour in range(24)]
+    return render_to_response(template_name, {
+        "calendars": calendars,
+        "months": months,
+        "hours": hours,
+    }, context_instance=RequestContext(request))
+calendar_statistics_heatmap = staff_member_required(calendar_statistics_heatmap)
+
+def _get_statistics_arguments(request):
+    if 'start' in request.GET or 'end' in request.GET:
+        start = parse_datetime(request.GET.get('start'))
+        end = parse_datetime(request.GET.get('end'))
+    else:
+        start = datetime.datetime(datetime.date.today().year, 1, 1)
+        end = start.replace(year=start.year + 1)
+    slugs = request.GET.getlist('calendar')
+    if end <= start or not slugs:
+        raise ValueError("calendar and a non empty start-end window are required")
+    calendars = list(Calendar.objects.filter(slug__in=slugs))
+    if not calendars:
+        raise Http404
+    categories = None
+    if request.GET.getlist('category'):
+        categories = [int(category) for category in request.GET.getlist('category')]
+    return calendars, categories, start, end
+
+def _get_calendars_events(request, calendars, event_id=None):
+    # GET_EVENTS_FUNC may give an event for each of several calendars, e.g.
+    # the ones it is related to, it is expanded once
+    events, seen = [], set()
+    for calendar in calendars:
+        event_list = GET_EVENTS_FUNC(request, calendar)
+        if isinstance(event_list, QuerySet):
+            if event_id is not None:
+                event_list = event_list.filter(pk=event_id)
+            event_list = event_list.select_related('rule')
+        if event_id is not None:
+            event_list = [event for event in event_list if event.id == event_id]
+        for event in event_list:
+            if event.id not in seen:
+                seen.add(event.id)
+                events.append(event)
+    return events
+
+def _encode_occurrences(spans, base, calendars):
+    """
+    Encodes (start, end, event, occurrence or None) spans as the columnar
+    event and occurrence tables of calendar_occurrences, the occurrence being
+    persisted or changed by the exceptions of its event.
+    """
+    calendar_index = dict([(calendar.id, i) for i, calendar in enumerate(calendars)])
+    event_index = {}
+    event_table = {'id': [], 'title': [], 'calendar': [], 'place': [], 'url': [], 'recurring': []}
+    occurrence_table = {'event': [], 'start': [], 'duration': [], 'id': [], 'title': [], 'cancelled': []}
+    for o_start, o_end, event, occurrence in spans:
+        if event.id not in event_index:
+            event_index[event.id] = len(event_table['id'])
+            event_table['id'].append(event.id)
+            event_table['title'].append(event.title)
+            event_table['calendar'].append(calendar_index.get(event.calendar_id))
+            event_table['place'].append(event.place)
+            event_table['url'].append(event.get_absolute_url())
+            event_table['recurring'].append(event.rule_id is not None)
+        occurrence_table['event'].append(event_index[event.id])
+        occurrence_table['start'].append(_total_seconds(o_start - base))
+        occurrence_table['duration'].append(_total_seconds(o_end - o_start))
+        if occurrence is None:
+            occurrence_table['id'].append(None)
+            occurrence_table['title'].append(None)
+            occurrence_table['cancelled'].append(False)
+        else:
+            occurrence_table['id'].append(occurrence.id)
+            occurrence_table['title'].append(
+                occurrence.title != event.title and occurrence.title or None)
+            occurrence_table['cancelled'].append(occurrence.cancelled)
+    return event_table, occurrence_table
+
+def _total_seconds(delta):
+    return delta.days * 86400 + delta.seconds
+
 def check_next_url(next):
     """
     Checks to make sure the next url is not redirecting to another page.